@@ -4,45 +4,64 @@ import os
 import asyncio
 import json
 import logging
+import logging.handlers
+import queue
+import random
+import atexit
 import pytz
 import threading
 from datetime import datetime, timedelta
-from collections import defaultdict
-from flask import Flask, request, jsonify, send_from_directory, current_app
-from telethon.sync import TelegramClient
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, abort, g
+from telethon import TelegramClient, events
 from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
 from telethon.errors import FloodWaitError, SessionPasswordNeededError, ChannelPrivateError
 from telethon.tl.types import PeerChannel
 from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.contacts import SearchRequest
 from dotenv import load_dotenv
-import requests
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from io import BytesIO
+from search_index import SearchIndex
+from message_store import MessageStore, RpcBudget
+from export_formats import EXPORT_COLUMNS, FORMATS as EXPORT_FORMATS, WRITERS as EXPORT_WRITERS, available_formats
+from dialog_index import DialogIndex, SOURCE_DIALOG, SOURCE_SEARCH
+from admission import AdmissionController, Overloaded
+from shared_store import create_store, StoreMapping
+from worker_ipc import TelegramOwnerLock, serve_unix_socket, forward_request
+from tracing import Tracer, SPAN_KIND_SERVER, SPAN_KIND_CLIENT
+from profiler import SamplingProfiler
+from metrics import registry, SIZE_BUCKETS, FLOOD_WAIT_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import importlib.util
 import base64
 import time
 import re
 import hashlib
-from flask import make_response
+import tempfile
+import zlib
+import gzip
+import mimetypes
+import uuid
+import hmac
 from urllib.parse import quote
 
-# Глобальный кэш для хранения сгенерированных PDF (временное решение)
-pdf_cache = {}
-CACHE_EXPIRY = 300  # 5 минут
+def lazy_import(name):
+    """Ленивый импорт модуля: код модуля выполняется при первом обращении к атрибуту"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
 
-# Добавить в начале файла после импортов
-try:
-    pdfmetrics.registerFont(TTFont('DejaVuSans', 'static/fonts/DejaVuSans.ttf'))
-    pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', 'static/fonts/DejaVuSans-Bold.ttf'))
-    CYRILLIC_FONT_AVAILABLE = True
-except:
-    logger.warning("Шрифты DejaVuSans не найдены. Кириллица в PDF может отображаться некорректно.")
-    CYRILLIC_FONT_AVAILABLE = False
+# HTTP клиент нужен только для Supabase и OpenRouter, не загружаем его при старте
+requests = lazy_import('requests')
+topics = lazy_import('topics')  # NumPy/SciPy загружаются только при первом анализе
+
+# Срок хранения сгенерированных PDF (кэш pdf_cache - в общем хранилище, см. конфигурацию)
+CACHE_EXPIRY = 300  # 5 минут
 
 def get_safe_filename(channel_info):
     """Создает безопасное имя файла на основе username канала"""
@@ -68,10 +87,10 @@ def get_safe_filename(channel_info):
         return 'telegram_report.pdf'
 
 # Устанавливаем UTF-8 как стандартную кодировку
-if sys.stdout.encoding != 'UTF-8':
+if (sys.stdout.encoding or '').lower() != 'utf-8':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace', newline='', line_buffering=True)
     
-if sys.stderr.encoding != 'UTF-8':
+if (sys.stderr.encoding or '').lower() != 'utf-8':
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace', newline='', line_buffering=True)
 
 # Загружаем переменные окружения
@@ -84,46 +103,139 @@ asyncio.set_event_loop(loop)
 # =============================================
 # НАСТРОЙКА ЛОГИРОВАНИЯ
 # =============================================
-class SafeFileHandler(logging.FileHandler):
-    """Обработчик логов с безопасной обработкой Unicode для Windows"""
-    def __init__(self, filename, mode='a', encoding='utf-8', delay=False):
-        super().__init__(filename, mode, encoding, delay)
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))  # Размер файла лога до ротации
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))  # Сколько старых файлов лога хранить
+LOG_BATCH_SIZE = 200  # Сколько записей пишем в файл до принудительного сброса буфера
+LOG_FLUSH_INTERVAL = 1.0  # Максимальная задержка записи лога на диск в секундах
+# Доля INFO записей, которые попадают в лог, для шумных логгеров (имя относительно логгера приложения)
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'requests=0.1,ai=0.25,pdf=0.25')
+
+class SafeFileHandler(logging.handlers.RotatingFileHandler):
+    """Обработчик логов с безопасной обработкой Unicode для Windows и ротацией по размеру.
+
+    Записи только пишутся в буфер файла; сброс на диск делает BatchingQueueListener
+    пачками, поэтому обработчик используется только из потока слушателя очереди.
+    """
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0, encoding='utf-8', delay=False):
+        super().__init__(filename, mode, maxBytes, backupCount, encoding, delay)
     
     def emit(self, record):
         try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
             msg = self.format(record)
             stream = self.stream
             stream.write(msg + self.terminator)
-            self.flush()
         except UnicodeEncodeError:
             try:
                 msg = self.format(record)
                 safe_msg = msg.encode('utf-8', 'backslashreplace').decode('utf-8')
                 stream.write(safe_msg + self.terminator)
-                self.flush()
             except Exception:
                 self.handleError(record)
         except Exception:
             self.handleError(record)
 
+class InProcessQueueHandler(logging.handlers.QueueHandler):
+    """Постановка записей в очередь без форматирования в потоке запроса"""
+    def prepare(self, record):
+        # Очередь внутри процесса: форматирование и трейсбеки обрабатывает поток слушателя
+        return record
+
+class LogSampler(logging.Filter):
+    """Сэмплирование INFO записей шумных логгеров; WARNING и выше проходят всегда"""
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+_NO_RECORD = object()  # Таймаут ожидания очереди логов без новой записи
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Слушатель очереди логов, сбрасывающий файлы пачками, а не после каждой записи"""
+    def _monitor(self):
+        q = self.queue
+        pending = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = q.get(True, LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                # Не None: None - это _sentinel остановки слушателя
+                record = _NO_RECORD
+
+            if record is self._sentinel:
+                self._flush_handlers()
+                break
+
+            if record is not _NO_RECORD:
+                self.handle(record)
+                pending += 1
+
+            # Сбрасываем, когда очередь опустела, набралась пачка или прошло время
+            if pending and (q.empty() or pending >= LOG_BATCH_SIZE or time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL):
+                self._flush_handlers()
+                pending = 0
+                last_flush = time.monotonic()
+
+    def _flush_handlers(self):
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+def parse_sample_rates(value, base_name):
+    """Разбор настройки вида 'requests=0.1,ai=0.25' в словарь {имя логгера: доля}"""
+    rates = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        try:
+            rates[f"{base_name}.{name.strip()}"] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
 os.makedirs('logs', exist_ok=True)
 log_file = 'logs/app.log'
 
 for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
 
-file_handler = SafeFileHandler(log_file, encoding='utf-8')
+file_handler = SafeFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
 stream_handler = logging.StreamHandler()
 
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 file_handler.setFormatter(formatter)
 stream_handler.setFormatter(formatter)
 
+# Потоки запросов только кладут записи в очередь, запись на диск идет в отдельном потоке
+log_queue = queue.SimpleQueue()
+queue_handler = InProcessQueueHandler(log_queue)
+queue_handler.addFilter(LogSampler(parse_sample_rates(LOG_SAMPLE_RATES, __name__)))
+
 logging.basicConfig(
     level=logging.INFO,
-    handlers=[file_handler, stream_handler]
+    handlers=[queue_handler]
 )
+log_listener = BatchingQueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logger = logging.getLogger(__name__)
+# Отдельные логгеры для шумных строк, которые сэмплируются
+request_logger = logger.getChild('requests')
+ai_logger = logger.getChild('ai')
+pdf_logger = logger.getChild('pdf')
 logger.info("Логирование настроено с поддержкой UTF-8")
 
 # =============================================
@@ -152,10 +264,69 @@ app.config['JSON_AS_ASCII'] = False  # Для корректного отобр
 # Создаем статическую папку если её нет
 os.makedirs('static', exist_ok=True)
 
+# Поток, в котором крутится общий event loop (Telegram клиент и фоновые задачи)
+loop_thread = None
+loop_lock = threading.Lock()
+
+def get_background_loop():
+    """Общий event loop в отдельном потоке, создается при первом обращении"""
+    global loop, loop_thread
+    with loop_lock:
+        if loop is None or loop.is_closed() or loop_thread is None or not loop_thread.is_alive():
+            loop = asyncio.new_event_loop()
+            loop_thread = threading.Thread(target=loop.run_forever, name='telegram-loop', daemon=True)
+            loop_thread.start()
+            app.config['GLOBAL_EVENT_LOOP'] = loop
+        return loop
+
+def run_async(coro, timeout=None):
+    """Выполнение корутины в общем event loop из потока запроса"""
+    return asyncio.run_coroutine_threadsafe(tracer.bind(coro), get_background_loop()).result(timeout)
+
+def iter_async(agen, timeout=None, batch_size=100):
+    """Синхронный итератор по асинхронному генератору из общего event loop.
+
+    Элементы забираются пачками, чтобы не переключать потоки на каждый;
+    при досрочном завершении генератор закрывается в event loop.
+    """
+    async def next_batch():
+        batch = []
+        try:
+            while len(batch) < batch_size:
+                batch.append(await agen.__anext__())
+        except StopAsyncIteration:
+            batch.append(StopAsyncIteration)
+        return batch
+
+    try:
+        while True:
+            for item in run_async(next_batch(), timeout):
+                if item is StopAsyncIteration:
+                    return
+                yield item
+    finally:
+        run_async(agen.aclose(), timeout)
+
 # Конфигурация
 API_ID = os.getenv('TELEGRAM_API_ID')
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 SESSION_PATH = os.getenv('TELEGRAM_SESSION_FILE', 'analytics_session.session')
+TELEGRAM_BACKEND = os.getenv('TELEGRAM_BACKEND', 'telethon')  # telethon или fake (синтетические каналы, см. fake_telegram.py)
+
+# Несколько воркеров (gunicorn): общее хранилище состояния и один воркер-владелец Telegram клиента
+SHARED_STORE_URL = os.getenv('SHARED_STORE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'telegram_analytics_store.db')}")
+TELEGRAM_OWNER_LOCK = os.getenv('TELEGRAM_OWNER_LOCK', os.path.join(tempfile.gettempdir(), 'telegram_analytics_owner.lock'))
+TELEGRAM_OWNER_SOCKET = os.getenv('TELEGRAM_OWNER_SOCKET', os.path.join(tempfile.gettempdir(), 'telegram_analytics_owner.sock'))
+TELEGRAM_FORWARD_TIMEOUT = int(os.getenv('TELEGRAM_FORWARD_TIMEOUT', 300))
+# local - у каждого процесса свой клиент (один процесс); shared - владелец по flock, остальные пересылают ему запросы
+TELEGRAM_OWNER_MODE = os.getenv('TELEGRAM_OWNER_MODE', 'local')
+
+shared_store = create_store(SHARED_STORE_URL)
+telegram_owner = TelegramOwnerLock(TELEGRAM_OWNER_LOCK)
+
+# Метаданные PDF в общем хранилище (файлы - в PDF_CACHE_DIR). Запись живет дольше
+# CACHE_EXPIRY, чтобы cleanup_pdf_cache успел увидеть ее устаревшей и удалить файл
+pdf_cache = StoreMapping(shared_store, 'pdf:', ttl=CACHE_EXPIRY * 2)
 
 # Конфигурация Supabase
 SUPABASE_URL = os.getenv('SUPABASE_URL')
@@ -170,14 +341,320 @@ SUPABASE_HEADERS = {
 
 # Конфигурация OpenRouter
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', "https://openrouter.ai/api/v1/chat/completions")  # Для тестов - адрес fake_openrouter.py
 AI_MODEL = "deepseek/deepseek-v3.1-terminus"
 
+# Статические инструкции для ИИ. Текст не меняется между запросами, поэтому
+# провайдер кэширует этот префикс и не тарифицирует его повторно
+AI_ROLE_PROMPT = """Ты эксперт по анализу Telegram каналов с опытом в data-driven маркетинге. Проанализируй данные канала за указанный период и дай развернутые рекомендации.
+
+Ты не описываешь процесс мышления. Ты сразу выдаёшь готовый, структурированный отчёт на основе данных. Не используй фразы вроде 'начну с', 'теперь проверю', 'я думаю'. Ответ должен быть профессиональным, полным и без 'воды'.
+
+Данные передаются компактно: метрики в формате ключ=значение, таблицы со столбцами через '|'."""
+
+AI_SYSTEM_PROMPT = AI_ROLE_PROMPT + """
+
+Начни ответ с пункта '1. Краткое резюме по каналу'.
+
+Требования к анализу:
+1. Ключевые тенденции: закономерности в активности аудитории, аномалии в статистике (резкие скачки или падения).
+2. Рекомендации по контенту: наиболее эффективные форматы контента, темы с максимальной вовлеченностью (по ключевым словам и кластерам тем), оптимальное соотношение типов контента, улучшение контент-стратегии.
+3. Оптимальное время публикаций: часы максимальной активности аудитории, конкретное расписание и частота публикаций.
+4. Оценка вовлеченности: Engagement Rate (ER) = (Реакции + Комментарии + Репосты) / Подписчики * 100%, сравнение с бенчмарками для ниши, посты с аномально высокой/низкой вовлеченностью.
+5. Прогноз роста: прогноз на 7/30 дней по текущим метрикам, потенциал вирального роста, привлечение новой аудитории.
+Дополнительно: рекомендации по SEO в Telegram и инструменты для автоматизации аналитики.
+
+Формат вывода:
+1. Краткое резюме по каналу
+2. Детальный анализ по каждому пункту, кратко и по факту
+3. Конкретные рекомендации для внедрения
+4. Прогноз развития на ближайший период
+5. Рекомендации по возобновлению активности (только если канал неактивен)"""
+
+# Системный промпт для генерации по разделам: общий для всех разделов префикс
+AI_SECTION_SYSTEM_PROMPT = AI_ROLE_PROMPT + """
+
+Ты пишешь один раздел отчета. Начни ответ с заголовка раздела в точности как указано, не повторяй содержание других разделов."""
+
+# Разделы отчета при параллельной генерации: (ключ, заголовок, задание, срок кэша в секундах).
+# Быстро меняющиеся разделы живут в кэше меньше и перегенерируются отдельно от стабильных
+AI_SECTIONS = (
+    ('summary', '1. Краткое резюме по каналу',
+     'Краткое резюме: главные выводы о канале и его аудитории.', 3600),
+    ('trends', '2. Ключевые тенденции',
+     'Закономерности в активности аудитории, аномалии в статистике (резкие скачки или падения).', 3600),
+    ('content', '3. Рекомендации по контенту',
+     'Наиболее эффективные форматы контента, темы с максимальной вовлеченностью (по ключевым словам и кластерам тем), '
+     'оптимальное соотношение типов контента, SEO в Telegram.', 6 * 3600),
+    ('timing', '4. Оптимальное время публикаций',
+     'Часы максимальной активности аудитории, конкретное расписание и частота публикаций.', 1800),
+    ('engagement', '5. Оценка вовлеченности',
+     'Engagement Rate (ER) = (Реакции + Комментарии + Репосты) / Подписчики * 100%, сравнение с бенчмарками для ниши, '
+     'посты с аномально высокой/низкой вовлеченностью.', 3600),
+    ('forecast', '6. Прогноз роста',
+     'Прогноз на 7/30 дней по текущим метрикам, потенциал вирального роста, привлечение новой аудитории, '
+     'инструменты для автоматизации аналитики.', 6 * 3600),
+    ('revival', '7. Рекомендации по возобновлению активности',
+     'Потенциал возобновления канала, стратегия возврата аудитории, риски и возможности.', 6 * 3600)
+)
+AI_SECTION_CONCURRENCY = int(os.getenv('AI_SECTION_CONCURRENCY', 3))
+AI_SECTION_MIN_TOKENS = 800
+AI_REPORT_MODE = os.getenv('AI_REPORT_MODE', 'monolithic')  # monolithic или sections (нужна migrations/ai_reports_section.sql)
+AI_CACHE_TTL = 3600  # Срок кэша цельного отчета
+
+# Источник ответов ИИ: http - OpenRouter (или совместимый адрес), record - http с записью ответов,
+# replay - ответы из записи без сети
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'http')
+LLM_RECORD_FILE = os.getenv('LLM_RECORD_FILE', 'llm_recordings.jsonl')
+LLM_REPLAY_LATENCY = os.getenv('LLM_REPLAY_LATENCY', '0') == '1'  # Воспроизводить исходную задержку ответов
+
+# Лимит ответа ИИ по длине периода анализа: (часов не более, max_tokens)
+AI_MAX_TOKENS_BY_PERIOD = ((24, 3000), (72, 4000), (168, 5000), (720, 6500))
+AI_MAX_TOKENS_FALLBACK = 4000
+AI_TOP_POSTS = 5
+AI_POST_PREVIEW = 60  # Символов текста топ-поста в промпте
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов: кириллица ~2.8 символа на токен, латиница и цифры ~4"""
+    cyrillic = sum(1 for char in text if '\u0400' <= char <= '\u04ff')
+    return int(cyrillic / 2.8 + (len(text) - cyrillic) / 4) + 1
+
+ANALYSIS_MESSAGE_LIMIT = 1000  # Сообщений, читаемых при анализе канала
+
+# Полнотекстовый поиск по загруженным постам
+SEARCH_MAX_DOCS = int(os.getenv('SEARCH_MAX_DOCS', 100000))
+SEARCH_MAX_RESULTS = 100
+
+# Потоковая история канала (/channel_history/stream)
+HISTORY_STREAM_DEFAULT_LIMIT = 1000
+HISTORY_STREAM_MAX_LIMIT = int(os.getenv('HISTORY_STREAM_MAX_LIMIT', 10000))  # Постов за один запрос
+HISTORY_STREAM_MAX_SCAN = int(os.getenv('HISTORY_STREAM_MAX_SCAN', 50000))  # Сообщений, просматриваемых фильтрами за запрос
+HISTORY_STREAM_TIMEOUT = 120  # Секунд на получение одной пачки постов
+EXPORT_MAX_POSTS = int(os.getenv('EXPORT_MAX_POSTS', 100000))  # Постов в одной выгрузке /export
+EXPORT_MAX_SCAN = int(os.getenv('EXPORT_MAX_SCAN', 1000000))  # Сообщений, просматриваемых выгрузкой
+HISTORY_FIELDS = ('id', 'date', 'text', 'text_preview', 'views', 'reactions', 'forwards', 'comments',
+                  'content_type', 'is_group', 'group_size')
+
+# Поиск каналов (/find_channel) по индексу диалогов аккаунта
+DIALOG_INDEX_REFRESH = int(os.getenv('DIALOG_INDEX_REFRESH', 60))  # Секунд между обновлениями недавних диалогов
+DIALOG_INDEX_FULL_REFRESH = int(os.getenv('DIALOG_INDEX_FULL_REFRESH', 3600))  # Секунд между полными сверками
+DIALOG_INDEX_WAIT = 15  # Секунд ожидания первой загрузки индекса запросом
+CHANNEL_SEARCH_MAX_RESULTS = 50
+CHANNEL_SEARCH_MIN_REMOTE_QUERY = 3  # Короче Telegram (contacts.Search) не ищет
+CHANNEL_SEARCH_MISS_TTL = 300  # Секунд, на которые запоминается пустой ответ Telegram
+
+# Метрики (/metrics)
+STAGE_DURATION = registry.histogram('telegram_stage_duration_seconds', 'Длительность этапов анализа канала', ['stage'])
+MESSAGES_FETCHED = registry.counter('telegram_messages_fetched_total', 'Сообщений прочитано из Telegram')
+MESSAGE_TEXT_BYTES = registry.counter('telegram_message_text_bytes_total', 'Байт текста прочитанных сообщений (UTF-8)')
+FLOOD_WAITS = registry.counter('telegram_flood_waits_total', 'Ошибок FloodWait от Telegram', ['operation'])
+FLOOD_WAIT_SECONDS = registry.histogram('telegram_flood_wait_seconds', 'Требуемое ожидание FloodWait', buckets=FLOOD_WAIT_BUCKETS)
+AI_REQUEST_DURATION = registry.histogram('ai_request_duration_seconds', 'Длительность запросов к ИИ', ['status'])
+AI_TOKENS = registry.counter('ai_tokens_total', 'Токены ИИ по данным usage', ['kind'])
+AI_TRUNCATIONS = registry.counter('ai_truncations_total', "Ответов ИИ, обрезанных по max_tokens (finish_reason == 'length')")
+SUPABASE_CACHE = registry.counter('supabase_cache_lookups_total', 'Проверки кэша отчетов ИИ в Supabase', ['kind', 'result'])
+SUPABASE_DURATION = registry.histogram('supabase_request_duration_seconds', 'Длительность запросов к Supabase', ['operation'])
+PDF_RENDER_DURATION = registry.histogram('pdf_render_duration_seconds', 'Длительность сборки PDF')
+PDF_SIZE = registry.histogram('pdf_size_bytes', 'Размер собранных PDF', buckets=SIZE_BUCKETS)
+PDF_CACHE_ENTRIES = registry.gauge('pdf_cache_entries', 'PDF в кэше скачивания', collect=lambda: len(pdf_cache))
+PDF_CACHE_BYTES = registry.gauge('pdf_cache_bytes', 'Размер PDF в кэше скачивания',
+                                 collect=lambda: sum(data.get('size') or 0 for data in list(pdf_cache.values())))
+PDF_CACHE_EVICTIONS = registry.counter('pdf_cache_evictions_total', 'PDF, удаленных из кэша по сроку', ['reason'])
+
+# Трассировка запросов (OTLP/JSON) и профилирование по запросу администратора
+TRACE_FILE = os.getenv('TRACE_FILE')  # Например logs/traces.jsonl; не задан - трассировка выключена
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+ADMIN_KEY = os.getenv('ADMIN_KEY')  # Не задан - профилирование недоступно
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'logs/profiles')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+
+tracer = Tracer(TRACE_FILE, sample_rate=TRACE_SAMPLE_RATE)
+
+def record_flood_wait(error, operation):
+    """Учет FloodWait в метриках"""
+    FLOOD_WAITS.inc(operation=operation)
+    FLOOD_WAIT_SECONDS.observe(error.seconds)
+
+class AICompletionError(Exception):
+    """Ошибка ответа ИИ; текст ошибки показывается пользователю вместо отчета"""
+
+def build_completion_payload(messages, max_tokens):
+    """Тело запроса chat/completions"""
+    return {
+        "model": AI_MODEL,
+        "messages": messages,
+        "temperature": 0.5,
+        "max_tokens": max_tokens,
+        "repetition_penalty": 1.05,
+        "usage": {"include": True},  # Фактические токены и попадание в кэш префикса
+        "stream": False
+    }
+
+def llm_request_key(payload):
+    """Ключ записи ответа: хэш тела запроса"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class HTTPLLMBackend:
+    """Запросы chat/completions по HTTP: OpenRouter или совместимая заглушка"""
+
+    def __init__(self, url, api_key):
+        self.url = url
+        self.api_key = api_key
+
+    def post(self, payload, timeout=120):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://your-domain.com",
+            "X-Title": "Telegram Analytics"
+        }
+        return requests.post(self.url, headers=headers, json=payload, timeout=timeout)
+
+class RecordedResponse:
+    """Сохраненный ответ с теми полями requests.Response, которые использует приложение"""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+class RecordingLLMBackend:
+    """Обертка над HTTP бэкендом, дописывающая каждый ответ в JSONL файл"""
+
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.path = path
+        self.lock = threading.Lock()
+
+    def post(self, payload, timeout=120):
+        started = time.perf_counter()
+        response = self.backend.post(payload, timeout=timeout)
+        record = {
+            'key': llm_request_key(payload),
+            'model': payload.get('model'),
+            'status_code': response.status_code,
+            'text': response.text,
+            'elapsed': round(time.perf_counter() - started, 3),
+            'recorded_at': datetime.now().isoformat()
+        }
+        with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return response
+
+class ReplayLLMBackend:
+    """Ответы из записи RecordingLLMBackend без обращения к сети.
+
+    Несколько записей одного запроса отдаются по кругу; для запроса без записи
+    возвращается 404 в формате ошибки OpenRouter.
+    """
+
+    def __init__(self, path, replay_latency=False):
+        self.replay_latency = replay_latency
+        self.records = defaultdict(list)
+        self.positions = defaultdict(int)
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record['key']].append(record)
+        logger.info(f"Воспроизведение ответов ИИ: {sum(len(items) for items in self.records.values())} записей из {path}")
+
+    def post(self, payload, timeout=120):
+        key = llm_request_key(payload)
+        with self.lock:
+            records = self.records.get(key)
+            if not records:
+                return RecordedResponse(404, json.dumps({'error': {'message': f'Нет записи ответа для запроса {key[:12]}', 'code': 404}}))
+            record = records[self.positions[key] % len(records)]
+            self.positions[key] += 1
+        if self.replay_latency:
+            time.sleep(record['elapsed'])
+        return RecordedResponse(record['status_code'], record['text'])
+
+def create_llm_backend():
+    """Бэкенд ИИ по LLM_BACKEND"""
+    backend = HTTPLLMBackend(OPENROUTER_API_URL, OPENROUTER_API_KEY)
+    if LLM_BACKEND == 'record':
+        return RecordingLLMBackend(backend, LLM_RECORD_FILE)
+    if LLM_BACKEND == 'replay':
+        return ReplayLLMBackend(LLM_RECORD_FILE, replay_latency=LLM_REPLAY_LATENCY)
+    return backend
+
+llm_backend = create_llm_backend()
+
+class AlbumAssembler:
+    """Потоковая сборка альбомов (grouped_id) из сообщений, идущих по убыванию id.
+
+    Telegram выдает части альбома подряд, поэтому открытой бывает только одна
+    группа: она закрывается первым сообщением с другим grouped_id. Память на
+    группу ограничена размером альбома (не более 10 сообщений).
+    """
+
+    def __init__(self, analytics, on_album=None):
+        self.analytics = analytics
+        self.on_album = on_album
+        self.grouped_id = None
+        self.messages = []
+
+    def continues(self, msg):
+        """Относится ли сообщение к открытому альбому"""
+        return self.grouped_id is not None and msg.grouped_id == self.grouped_id
+
+    def feed(self, msg):
+        """Добавление сообщения; возвращает список завершенных постов"""
+        if self.continues(msg):
+            self.messages.append(msg)
+            return []
+
+        finished = self.close()
+        if msg.grouped_id:
+            self.grouped_id = msg.grouped_id
+            self.messages = [msg]
+        else:
+            finished.append(self.analytics._process_single_message(msg))
+        return finished
+
+    def close(self):
+        """Закрытие открытого альбома"""
+        if self.grouped_id is None:
+            return []
+        # Сообщения пришли по убыванию id: разворот дает порядок альбома без сортировки
+        self.messages.reverse()
+        if self.on_album:
+            self.on_album(self.grouped_id, self.messages)
+        post = self.analytics._process_message_group(self.messages)
+        self.grouped_id = None
+        self.messages = []
+        return [post] if post else []
+
+def create_client_factory():
+    """Фабрика клиента Telegram по TELEGRAM_BACKEND; None - обычный TelegramClient"""
+    if TELEGRAM_BACKEND == 'fake':
+        from fake_telegram import FakeTelegramClient
+        logger.warning("Используется тестовый Telegram клиент с синтетическими каналами")
+        return FakeTelegramClient.from_env
+    return None
+
 class TelegramAnalytics:
-    def __init__(self):
+    def __init__(self, client_factory=None):
         self.client = None
+        self.client_factory = client_factory
         self.moscow_tz = pytz.timezone('Europe/Moscow')
         self._loop = None
+        self._init_lock = None
+        self.tracker = None
+        self.backfill = None
+        self.search_index = SearchIndex(max_docs=SEARCH_MAX_DOCS)
+        self.dialog_index = DialogIndex()
+        self._dialog_index_task = None
+        self._dialog_index_ready = None
+        self._dialogs_checked_at = None
+        self.channel_search_misses = {}  # запрос -> время пустого ответа Telegram
+        self._ai_semaphore = None
 
     def get_period_text(self, hours):
         """Получение текстового описания периода"""
@@ -189,6 +666,8 @@ class TelegramAnalytics:
             return "7 дней"
         elif hours == 720:
             return "30 дней"
+        elif hours > 720 and hours % 24 == 0:
+            return f"{hours // 24} дней"
         else:
             return f"{hours} часов"
 
@@ -231,7 +710,11 @@ class TelegramAnalytics:
             session_exists = os.path.exists(SESSION_PATH)
             
             session_str = os.getenv('TELEGRAM_SESSION_STRING')
-            if session_str:
+            if self.client_factory:
+                self.client = self.client_factory()
+                session_exists = True
+                logger.info("Используется клиент из фабрики")
+            elif session_str:
                 from telethon.sessions import StringSession
                 self.client = TelegramClient(
                     StringSession(session_str),
@@ -272,19 +755,142 @@ class TelegramAnalytics:
             logger.error(f"Ошибка инициализации клиента: {str(e)}", exc_info=True)
             return False
     
-    async def get_channel_info(self, channel_identifier):
-        """Получение информации о канале по username или ID"""
+    async def ensure_client(self):
+        """Подключение клиента при необходимости; параллельные вызовы ждут одно подключение"""
+        if self.client and self.client.is_connected():
+            return True
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self.client and self.client.is_connected():
+                return True
+            connected = await self.init_client()
+            if connected and self.tracker:
+                self.tracker.attach(self.client)
+            return connected
+
+    @staticmethod
+    def _dialog_entry(entity, source):
+        """Запись индекса каналов по сущности Telegram"""
+        return {
+            'id': entity.id,
+            'title': getattr(entity, 'title', '') or '',
+            'username': getattr(entity, 'username', None),
+            'participants_count': getattr(entity, 'participants_count', None),
+            'is_megagroup': bool(getattr(entity, 'megagroup', False)),
+            'source': source
+        }
+
+    @tracer.traced()
+    async def refresh_dialog_index(self, full=False):
+        """Обновление индекса каналов: полная сверка диалогов или только недавно активные"""
+        if not await self.ensure_client():
+            return False
+        started = time.time()
+        # Диалоги идут от недавно активных: при частичном обновлении останавливаемся на уже проверенных
+        since = None if full or self._dialogs_checked_at is None else self._dialogs_checked_at - DIALOG_INDEX_REFRESH
+        entries = []
+        with tracer.span('telegram.iter_dialogs', SPAN_KIND_CLIENT, full=since is None):
+            async for dialog in self.client.iter_dialogs():
+                if since is not None and not dialog.pinned and dialog.date and dialog.date.timestamp() < since:
+                    break
+                if dialog.is_channel:
+                    entries.append(self._dialog_entry(dialog.entity, SOURCE_DIALOG))
+
+        if since is None:
+            changed, removed = self.dialog_index.sync_dialogs(entries)
+        else:
+            changed, removed = sum(self.dialog_index.upsert(entry) for entry in entries), 0
+        self._dialogs_checked_at = started
+        if changed or removed:
+            logger.info(f"Индекс каналов обновлен ({'полностью' if since is None else 'частично'}): "
+                        f"изменено {changed}, удалено {removed}, всего {self.dialog_index.stats()['channels']}")
+        return True
+
+    async def dialog_index_loop(self):
+        """Фоновое обновление индекса каналов: недавние диалоги часто, полная сверка реже"""
+        last_full = 0
+        while True:
+            delay = DIALOG_INDEX_REFRESH
+            try:
+                full = time.time() - last_full > DIALOG_INDEX_FULL_REFRESH
+                if await self.refresh_dialog_index(full) and full:
+                    last_full = time.time()
+            except FloodWaitError as e:
+                record_flood_wait(e, 'iter_dialogs')
+                logger.warning(f"Flood wait при обновлении индекса каналов: {e.seconds} секунд")
+                delay = max(delay, e.seconds)
+            except Exception as e:
+                logger.error(f"Ошибка обновления индекса каналов: {str(e)}", exc_info=True)
+            # После первой попытки, даже неудачной, поиск не ждет индекс (есть запасной поиск в Telegram)
+            self._dialog_index_ready.set()
+            await asyncio.sleep(delay)
+
+    async def ensure_dialog_index(self, wait=DIALOG_INDEX_WAIT):
+        """Запуск фонового обновления индекса каналов и ожидание первой загрузки"""
+        if self._dialog_index_task is None:
+            self._dialog_index_ready = asyncio.Event()
+            self._dialog_index_task = asyncio.ensure_future(tracer.detach(self.dialog_index_loop()))
+        if wait:
+            try:
+                await asyncio.wait_for(self._dialog_index_ready.wait(), wait)
+            except asyncio.TimeoutError:
+                logger.warning("Индекс каналов еще не загружен, поиск по неполному индексу")
+        return self.dialog_index.refreshed_at is not None
+
+    @tracer.traced()
+    async def search_telegram_channels(self, query, limit):
+        """Поиск каналов через contacts.Search - только при промахе индекса"""
+        key = query.lower()
+        missed_at = self.channel_search_misses.get(key)
+        if len(query) < CHANNEL_SEARCH_MIN_REMOTE_QUERY or (missed_at and time.time() - missed_at < CHANNEL_SEARCH_MISS_TTL):
+            return []
+        if not await self.ensure_client():
+            return []
         try:
+            with tracer.span('telegram.contacts.Search', SPAN_KIND_CLIENT, query=query):
+                found = await self.client(SearchRequest(q=query, limit=limit))
+        except FloodWaitError as e:
+            record_flood_wait(e, 'contacts_search')
+            logger.warning(f"Flood wait при поиске каналов: {e.seconds} секунд")
+            return []
+
+        results = []
+        for chat in found.chats:
+            if not (getattr(chat, 'broadcast', False) or getattr(chat, 'megagroup', False)):
+                continue
+            entry = self._dialog_entry(chat, SOURCE_SEARCH)
+            self.dialog_index.upsert(entry)  # Повторный запрос найдет канал в индексе
+            results.append(dict(entry, match='telegram', score=None))
+
+        if not results:
+            if len(self.channel_search_misses) > 1000:
+                self.channel_search_misses.clear()
+            self.channel_search_misses[key] = time.time()
+        return results[:limit]
+
+    async def resolve_channel(self, channel_identifier):
+        """Сущность канала по username, ссылке или ID (ValueError - не найден)"""
+        with STAGE_DURATION.time(stage='resolve'), tracer.span('telegram.get_entity', SPAN_KIND_CLIENT, channel=str(channel_identifier)):
             # Определяем тип идентификатора
             if isinstance(channel_identifier, int) or (isinstance(channel_identifier, str) and channel_identifier.startswith('-100')):
-                entity = await self.client.get_entity(PeerChannel(int(channel_identifier)))
-            else:
-                entity = await self.client.get_entity(channel_identifier)
+                return await self.client.get_entity(PeerChannel(int(channel_identifier)))
+            return await self.client.get_entity(channel_identifier)
+
+    @tracer.traced()
+    async def get_channel_info(self, channel_identifier):
+        """Получение информации о канале по username или ID"""
+        try:
+            if not await self.ensure_client():
+                return None
+
+            entity = await self.resolve_channel(channel_identifier)
             
             # Пытаемся получить расширенную информацию о канале
             subscribers = 0
             try:
-                full_channel = await self.client(GetFullChannelRequest(channel=entity))
+                with STAGE_DURATION.time(stage='full_channel'), tracer.span('telegram.GetFullChannelRequest', SPAN_KIND_CLIENT):
+                    full_channel = await self.client(GetFullChannelRequest(channel=entity))
                 subscribers = full_channel.full_chat.participants_count
                 logger.info(f"Получена расширенная информация о канале: {subscribers} подписчиков")
             except Exception as e:
@@ -302,6 +908,10 @@ class TelegramAnalytics:
         except ValueError:
             logger.error(f"Канал '{channel_identifier}' не найден")
             return None
+        except FloodWaitError as e:
+            record_flood_wait(e, 'get_channel_info')
+            logger.error(f"Flood wait при получении информации о канале: {e.seconds} секунд")
+            return None
         except ChannelPrivateError:
             logger.error(f"Приватный канал: {channel_identifier}. Требуется подписка")
             return {
@@ -313,12 +923,12 @@ class TelegramAnalytics:
             return None
 
     # Добавляем метод получения истории постов
+    @tracer.traced()
     async def get_channel_history(self, channel_identifier, limit=30):
         """Получение истории текстовых постов из канала"""
         try:
-            if not self.client or not self.client.is_connected():
-                if not await self.init_client():
-                    return {'error': 'Не удалось подключиться к Telegram'}
+            if not await self.ensure_client():
+                return {'error': 'Не удалось подключиться к Telegram'}
             
             # Получаем информацию о канале
             channel_info = await self.get_channel_info(channel_identifier)
@@ -332,10 +942,11 @@ class TelegramAnalytics:
             all_messages = []
             try:
                 # Получаем больше сообщений, так как будем фильтровать только текстовые
-                all_messages = await self.client.get_messages(
-                    channel_identifier, 
-                    limit=min(limit * 2, 100)  # Берем в 2 раза больше для фильтрации
-                )
+                with tracer.span('telegram.get_messages', SPAN_KIND_CLIENT, limit=min(limit * 2, 100)):
+                    all_messages = await self.client.get_messages(
+                        channel_identifier, 
+                        limit=min(limit * 2, 100)  # Берем в 2 раза больше для фильтрации
+                    )
             except Exception as e:
                 logger.error(f"Ошибка получения сообщений: {str(e)}", exc_info=True)
                 return {'error': f'Ошибка получения сообщений: {str(e)}'}
@@ -370,160 +981,281 @@ class TelegramAnalytics:
             logger.error(f"Ошибка получения истории: {str(e)}", exc_info=True)
             return {'error': f'Ошибка получения истории: {str(e)}'}
     
-    async def generate_ai_analysis(self, report_data):
-        """Генерация ИИ анализа через OpenRouter с поддержкой fallback режима"""
+    async def iter_history(self, entity, limit, before_id=None, after_id=None, date_from=None, date_to=None,
+                           content_types=None, cursor=None, max_scan=HISTORY_STREAM_MAX_SCAN):
+        """Посты канала от курсора с фильтрами, альбомы - одним постом.
+
+        Без after_id история идет от новых к старым (до before_id), с after_id -
+        от старых к новым. Сообщения читаются страницами iter_messages и сразу
+        отдаются, в памяти только открытый альбом. В cursor по окончании:
+        last_id - последнее прочитанное сообщение (курсор следующей страницы),
+        has_more - остановились ли по лимиту, а не в конце истории или диапазона дат.
+        """
+        reverse = after_id is not None
+        cursor = cursor if cursor is not None else {}
+        cursor.update(last_id=None, has_more=False, scanned=0, count=0)
+        assembler = AlbumAssembler(self)
+        started = time.perf_counter()
+
+        if reverse:
+            messages = self.client.iter_messages(entity, reverse=True, offset_id=after_id,
+                                                 offset_date=date_from if not after_id else None)
+        else:
+            messages = self.client.iter_messages(entity, offset_id=before_id or 0,
+                                                 offset_date=date_to if not before_id else None)
+
+        def accept(post):
+            if content_types and post['content_type'] not in content_types:
+                return False
+            post_date = post['date'].replace(tzinfo=pytz.UTC) if post['date'] else None
+            if post_date and ((date_from and post_date < date_from) or (date_to and post_date > date_to)):
+                return False
+            cursor['count'] += 1
+            return True
+
         try:
-            hours_back = report_data['analysis_period']['hours_back']
-            used_fallback = report_data['analysis_period'].get('used_fallback', False)
-            actual_period = report_data['analysis_period'].get('actual_period', '')
-            
-            # Формируем описание периода с учетом fallback
-            if used_fallback:
-                period_text = f"анализ последних 30 постов (канал неактивен, {report_data['analysis_period'].get('fallback_reason', 'последний пост более 30 дней назад')})"
-            else:
-                period_text = self.get_period_text(hours_back)
-                
-            prompt = f"""
-            Ты эксперт по анализу Telegram каналов с опытом в data-driven маркетинге. Проанализируй предоставленные данные за период: {period_text} и дай развернутые рекомендации.
-            
-            {'⚠️ ВНИМАНИЕ: Этот канал неактивен в течение длительного времени. Проанализируй исторические данные и дай рекомендации по возобновлению активности.' if used_fallback else ''}
-
-            Ты не описываешь процесс мышления.
-            Ты сразу выдаёшь готовый, структурированный отчёт на основе данных.
-            Не используй фразы вроде 'начну с', 'теперь проверю', 'я думаю'.
-            Начни ответ с пункта '1. Краткое резюме по каналу'.
-            Ответ должен быть профессиональным, полным и без 'воды'.
-
-            Контекст:
-            - Канал: {report_data['channel_info']['title']}
-            - Подписчиков: {report_data['channel_info']['subscribers']}
-            - Период анализа: {period_text}
-
-            Данные для анализа:
-            {json.dumps(report_data['summary'], indent=2, ensure_ascii=False)}
-
-            Требования к анализу:
-
-            1. Ключевые тенденции:
-            - Проанализируй динамику роста/падения подписчиков
-            - Выяви закономерности в активности аудитории
-            - Определи аномалии в статистике (резкие скачки или падения)
-
-            2. Рекомендации по контенту:
-            - Определи наиболее эффективные форматы контента (текст, видео, опросы и т.д.)
-            - Проанализируй темы с максимальной вовлеченностью
-            - Предложи оптимальное соотношение типов контента
-            - Дай рекомендации по улучшению контент-стратегии
-
-            3. Оптимальное время публикаций:
-            - Определи часы и дни максимальной активности аудитории
-            - Предложи конкретное расписание публикаций
-            - Дай рекомендации по частоте публикаций
-
-            4. Оценка вовлеченности:
-            - Рассчитай Engagement Rate (ER) по формуле: (Реакции + Комментарии + Репосты) / Подписчики * 100%
-            - Сравни показатели с бенчмарками для ниши
-            - Проанализируй CTR и другие метрики вовлеченности
-            - Выяви посты с аномально высокой/низкой вовлеченностью
-
-            5. Прогноз роста:
-            - На основе текущих метрик построй прогноз на 7/30 дней
-            - Оцени потенциал вирального роста
-            - Дай рекомендации по привлечению новой аудитории
-
-            {'6. Рекомендации по возобновлению активности:' if used_fallback else ''}
-            {'- Проанализируй потенциал возобновления канала' if used_fallback else ''}
-            {'- Предложи стратегию возврата аудитории' if used_fallback else ''}
-            {'- Оцени риски и возможности' if used_fallback else ''}
-
-            Дополнительно:
-            - Дай рекомендации по SEO в Telegram
-            - Предложи инструменты для автоматизации аналитики
-
-            Формат вывода:
-            1. Краткое резюме по каналу
-            2. Детальный анализ по каждому пункту, но кратко и по факту изложи его
-            3. Конкретные рекомендации для внедрения
-            4. Прогноз развития на ближайший период
-            {'' if used_fallback else '5. Рекомендации по возобновлению активности (если канал неактивен)'}
-            """
-            
-            # Логируем длину промпта
-            logger.info(f"Длина промпта для ИИ: {len(prompt)} символов")
-            
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://your-domain.com",
-                "X-Title": "Telegram Analytics"
-            }
-            
-            payload = {
-                "model": AI_MODEL,
-                "messages": [
-                    {"role": "system", "content": "Ты эксперт по анализу Telegram каналов с опытом в data-driven маркетинге. Проанализируй предоставленные данные и дай развернутые рекомендации."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.5,
-                "max_tokens": 16000,
-                "repetition_penalty": 1.05,
-                "stream": False
-            }
-            
-            logger.info(f"Отправка запроса к OpenRouter: {OPENROUTER_API_URL}")
-            
-            # Синхронный запрос
-            response = requests.post(
-                OPENROUTER_API_URL,
-                headers=headers,
-                json=payload,
-                timeout=120
+            async for msg in messages:
+                # Сообщение вне диапазона дат в направлении чтения - дальше только такие же
+                msg_date = msg.date.replace(tzinfo=pytz.UTC) if msg.date else None
+                if msg_date and ((reverse and date_to and msg_date > date_to)
+                                 or (not reverse and date_from and msg_date < date_from)) and not assembler.continues(msg):
+                    break
+                pending = 1 if assembler.grouped_id is not None else 0
+                if (cursor['count'] + pending >= limit or cursor['scanned'] >= max_scan) and not assembler.continues(msg):
+                    cursor['has_more'] = True
+                    break
+                cursor['scanned'] += 1
+                cursor['last_id'] = msg.id
+                for post in assembler.feed(msg):
+                    if accept(post):
+                        yield post
+            for post in assembler.close():
+                if accept(post):
+                    yield post
+        finally:
+            STAGE_DURATION.observe(time.perf_counter() - started, stage='history')
+            MESSAGES_FETCHED.inc(cursor['scanned'])
+
+    def _format_report_for_ai(self, report_data):
+        """Компактное табличное представление отчета для промпта"""
+        summary = report_data['summary']
+        engagement = summary.get('engagement_rate', {})
+        lines = [
+            f"Метрики: постов={summary['total_posts']}; просмотров={summary['total_views']}; "
+            f"ср_просмотров={summary['avg_views_per_post']}; реакций={summary['total_reactions']}; "
+            f"комментариев={summary['total_comments']}; репостов={summary['total_forwards']}; "
+            f"ER_просмотры={engagement.get('er_views', 0)}%; ER_подписчики={engagement.get('er_subscribers', 0)}%"
+        ]
+        
+        content_stats = report_data.get('content_analysis') or {}
+        if content_stats:
+            lines.append("Типы контента (тип|посты|ср_просмотры|реакции|комментарии|репосты):")
+            for content_type, stats in sorted(content_stats.items(), key=lambda item: item[1]['count'], reverse=True):
+                avg_views = round(stats['total_views'] / stats['count']) if stats['count'] else 0
+                lines.append(f"{self._format_content_type(content_type)}|{stats['count']}|{avg_views}|"
+                             f"{stats['total_reactions']}|{stats['total_comments']}|{stats['total_forwards']}")
+        
+        hourly_stats = (report_data.get('time_analysis') or {}).get('hourly_stats') or {}
+        if hourly_stats:
+            hours = '; '.join(
+                f"{int(hour)}|{stats['count']}|{round(stats['total_views'] / stats['count']) if stats['count'] else 0}"
+                for hour, stats in sorted(hourly_stats.items(), key=lambda item: int(item[0]))
             )
+            lines.append(f"Часы МСК (час|посты|ср_просмотры): {hours}")
+        
+        top_posts = (report_data.get('top_posts') or [])[:AI_TOP_POSTS]
+        if top_posts:
+            lines.append("Топ постов (дата|тип|просмотры|реакции|репосты|текст):")
+            for post in top_posts:
+                preview = ' '.join((post.get('text_preview') or '').split())[:AI_POST_PREVIEW]
+                lines.append(f"{post['date']}|{post['content_type']}|{post['views']}|{post['reactions']}|{post['forwards']}|{preview}")
+        
+        topic_analysis = report_data.get('topic_analysis')
+        if topic_analysis:
+            lines.append(f"Ключевые слова: {', '.join(topic_analysis['top_terms'])}")
+            if topic_analysis['engagement_terms']:
+                lines.append("Слова постов с просмотрами выше среднего: " + ', '.join(
+                    f"{term['term']}(x{term['lift']})" for term in topic_analysis['engagement_terms']))
+            tiers = topic_analysis['tiers']
+            lines.append(f"Слова по просмотрам: высокие={', '.join(tiers['high'])}; средние={', '.join(tiers['medium'])}; низкие={', '.join(tiers['low'])}")
+            if topic_analysis['clusters']:
+                lines.append("Темы (слова|посты|ср_просмотры): " + '; '.join(
+                    f"{' '.join(cluster['terms'])}|{cluster['posts']}|{round(cluster['avg_views'])}" for cluster in topic_analysis['clusters']))
+        
+        return '\n'.join(lines)
+
+    def _ai_context(self, report_data, revival_point=False):
+        """Описание канала и периода с данными для промпта.
+
+        revival_point - просить пункт о возобновлении неактивного канала (в отчете
+        по разделам для этого есть отдельный раздел revival).
+        """
+        hours_back = report_data['analysis_period']['hours_back']
+        used_fallback = report_data['analysis_period'].get('used_fallback', False)
+        
+        # Формируем описание периода с учетом fallback
+        if used_fallback:
+            period_text = f"анализ последних 30 постов (канал неактивен, {report_data['analysis_period'].get('fallback_reason', 'последний пост более 30 дней назад')})"
+        else:
+            period_text = self.get_period_text(hours_back)
+        
+        parts = [
+            f"Канал: {report_data['channel_info']['title']}; подписчиков={report_data['channel_info']['subscribers']}; период: {period_text}"
+        ]
+        if used_fallback and revival_point:
+            parts.append("⚠️ ВНИМАНИЕ: Этот канал неактивен в течение длительного времени. Проанализируй исторические данные "
+                         "и добавь пункт 6: потенциал возобновления канала, стратегия возврата аудитории, риски и возможности.")
+        elif used_fallback:
+            parts.append("⚠️ ВНИМАНИЕ: Этот канал неактивен в течение длительного времени, данные исторические.")
+        parts.append(self._format_report_for_ai(report_data))
+        return '\n'.join(parts)
+
+    def build_ai_messages(self, report_data):
+        """Сообщения для ИИ: статический системный префикс и компактные данные канала"""
+        return [
+            {"role": "system", "content": AI_SYSTEM_PROMPT},
+            {"role": "user", "content": self._ai_context(report_data, revival_point=True)}
+        ]
+
+    def ai_sections(self, report_data):
+        """Разделы отчета для параллельной генерации (раздел о возобновлении - только для неактивных каналов)"""
+        used_fallback = report_data['analysis_period'].get('used_fallback', False)
+        return [section for section in AI_SECTIONS if section[0] != 'revival' or used_fallback]
+
+    def build_ai_section_messages(self, report_data, section):
+        """Сообщения для одного раздела: общий префикс (система + данные) и задание раздела в конце"""
+        _, title, task, _ = section
+        return [
+            {"role": "system", "content": AI_SECTION_SYSTEM_PROMPT},
+            {"role": "user", "content": f"{self._ai_context(report_data)}\n\nНапиши раздел '{title}'. {task}"}
+        ]
+
+    def ai_max_tokens(self, report_data):
+        """Лимит длины ответа ИИ по периоду анализа"""
+        if report_data['analysis_period'].get('used_fallback'):
+            return AI_MAX_TOKENS_FALLBACK
+        hours_back = report_data['analysis_period']['hours_back']
+        for max_hours, max_tokens in AI_MAX_TOKENS_BY_PERIOD:
+            if hours_back <= max_hours:
+                return max_tokens
+        return AI_MAX_TOKENS_BY_PERIOD[-1][1]
+
+    def _request_completion(self, messages, max_tokens):
+        """Синхронный запрос к OpenRouter: (текст, finish_reason); при ошибке - AICompletionError"""
+        payload = build_completion_payload(messages, max_tokens)
+        
+        logger.info(f"Отправка запроса к ИИ ({LLM_BACKEND}): {OPENROUTER_API_URL}")
+        
+        started = time.perf_counter()
+        with tracer.span('ai.chat_completion', SPAN_KIND_CLIENT, backend=LLM_BACKEND, max_tokens=max_tokens) as span:
+            try:
+                response = llm_backend.post(payload)
+            except Exception:
+                AI_REQUEST_DURATION.observe(time.perf_counter() - started, status='exception')
+                raise
+            AI_REQUEST_DURATION.observe(time.perf_counter() - started, status=response.status_code)
+            span.set_attribute('http.status_code', response.status_code)
+        
+        # Детальное логирование ответа
+        logger.info(f"Статус ответа OpenRouter: {response.status_code}")
+        
+        try:
+            response_data = response.json()
+            ai_logger.info("Тело ответа (первые 500 символов): %.500s", response_data)
             
-            # Детальное логирование ответа
-            logger.info(f"Статус ответа OpenRouter: {response.status_code}")
+            # Проверяем, не был ли ответ обрезан
+            finish_reason = response_data.get('choices', [{}])[0].get('finish_reason', '')
+            if finish_reason == 'length':
+                AI_TRUNCATIONS.inc()
+                logger.warning(f"Ответ ИИ был обрезан из-за ограничения длины токенов (max_tokens={max_tokens})")
             
-            try:
-                response_data = response.json()
-                logger.info(f"Тело ответа (первые 500 символов): {str(response_data)[:500]}")
+            usage = response_data.get('usage') or {}
+            AI_TOKENS.inc(usage.get('prompt_tokens') or 0, kind='prompt')
+            AI_TOKENS.inc((usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0, kind='cached')
+            AI_TOKENS.inc(usage.get('completion_tokens') or 0, kind='completion')
+            ai_logger.info(
+                "Токены ИИ: промпт=%s (кэш=%s), ответ=%s, finish_reason=%s",
+                usage.get('prompt_tokens'), (usage.get('prompt_tokens_details') or {}).get('cached_tokens'),
+                usage.get('completion_tokens'), finish_reason
+            )
                 
-                # Проверяем, не был ли ответ обрезан
-                finish_reason = response_data.get('choices', [{}])[0].get('finish_reason', '')
-                if finish_reason == 'length':
-                    logger.warning("Ответ ИИ был обрезан из-за ограничения длины токенов")
-                    
-            except json.JSONDecodeError:
-                logger.error(f"Не удалось распарсить JSON: {response.text[:500]}")
-                return "Ошибка: неверный формат ответа ИИ"
+        except json.JSONDecodeError:
+            logger.error(f"Не удалось распарсить JSON: {response.text[:500]}")
+            raise AICompletionError("Ошибка: неверный формат ответа ИИ")
+        
+        # Проверяем различные форматы ответа
+        if response.status_code != 200:
+            error_msg = response_data.get('error', {}).get('message', response.text[:200])
+            logger.error(f"OpenRouter API error: {response.status_code} - {error_msg}")
+            raise AICompletionError(f"Ошибка API: {response.status_code} - {error_msg}")
+        
+        # Проверяем возможные форматы ответа
+        if 'choices' in response_data and response_data['choices']:
+            return response_data['choices'][0]['message']['content'], finish_reason
+        elif 'message' in response_data:
+            return response_data['message'], finish_reason
+        elif 'text' in response_data:
+            return response_data['text'], finish_reason
+        elif 'error' in response_data:
+            raise AICompletionError(f"Ошибка ИИ: {response_data['error']}")
+        else:
+            logger.error(f"Неожиданный формат ответа: {json.dumps(response_data, indent=2)[:500]}")
+            raise AICompletionError("Ошибка: неверный формат ответа ИИ")
+
+    @tracer.traced()
+    async def generate_ai_analysis(self, report_data):
+        """Генерация ИИ анализа через OpenRouter с поддержкой fallback режима"""
+        try:
+            messages = self.build_ai_messages(report_data)
+            max_tokens = self.ai_max_tokens(report_data)
             
-            # Проверяем различные форматы ответа
-            if response.status_code != 200:
-                error_msg = response_data.get('error', {}).get('message', response.text[:200])
-                logger.error(f"OpenRouter API error: {response.status_code} - {error_msg}")
-                return f"Ошибка API: {response.status_code} - {error_msg}"
+            # Логируем размер промпта
+            prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+            logger.info(f"Промпт для ИИ: ~{prompt_tokens} токенов (данные: {len(messages[1]['content'])} символов), max_tokens={max_tokens}")
             
-            # Проверяем возможные форматы ответа
-            if 'choices' in response_data and response_data['choices']:
-                content = response_data['choices'][0]['message']['content']
-                # Добавляем предупреждение, если ответ был обрезан
-                if finish_reason == 'length':
-                    content += "\n\n⚠️ Внимание: анализ был сокращен из-за ограничений длины. Для полного анализа используйте платные модели с большим контекстом."
-                return content
-            elif 'message' in response_data:
-                return response_data['message']
-            elif 'text' in response_data:
-                return response_data['text']
-            elif 'error' in response_data:
-                return f"Ошибка ИИ: {response_data['error']}"
-            else:
-                logger.error(f"Неожиданный формат ответа: {json.dumps(response_data, indent=2)[:500]}")
-                return "Ошибка: неверный формат ответа ИИ"
+            # HTTP запрос в пуле потоков, чтобы не блокировать общий event loop
+            loop = asyncio.get_running_loop()
+            content, finish_reason = await loop.run_in_executor(None, tracer.wrap(self._request_completion), messages, max_tokens)
+            
+            # Добавляем предупреждение, если ответ был обрезан
+            if finish_reason == 'length':
+                content += "\n\n⚠️ Внимание: анализ был сокращен из-за ограничений длины. Для полного анализа используйте платные модели с большим контекстом."
+            return content
                 
+        except AICompletionError as e:
+            return str(e)
         except Exception as e:
             logger.error(f"Ошибка ИИ анализа: {str(e)}", exc_info=True)
             return f"Ошибка при генерации ИИ анализа: {str(e)}"
-        finally:
-            pass  # Добавляем блок finally для коррекции синтаксиса
+
+    @tracer.traced()
+    async def generate_ai_sections(self, report_data, section_keys):
+        """Параллельная генерация разделов отчета с ограничением числа одновременных запросов.
+
+        Возвращает {ключ раздела: текст}; разделы с ошибкой в результат не попадают.
+        """
+        if self._ai_semaphore is None:
+            self._ai_semaphore = asyncio.Semaphore(AI_SECTION_CONCURRENCY)
+        sections = [section for section in self.ai_sections(report_data) if section[0] in section_keys]
+        max_tokens = max(AI_SECTION_MIN_TOKENS, self.ai_max_tokens(report_data) * 3 // (2 * len(self.ai_sections(report_data))))
+        loop = asyncio.get_running_loop()
+        
+        async def generate(section):
+            messages = self.build_ai_section_messages(report_data, section)
+            async with self._ai_semaphore:
+                started = time.perf_counter()
+                content, finish_reason = await loop.run_in_executor(None, tracer.wrap(self._request_completion), messages, max_tokens)
+            ai_logger.info("Раздел ИИ %s: %.1f с, finish_reason=%s", section[0], time.perf_counter() - started, finish_reason)
+            return section[0], content
+        
+        results = await asyncio.gather(*(generate(section) for section in sections), return_exceptions=True)
+        contents = {}
+        for section, result in zip(sections, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка генерации раздела ИИ {section[0]}: {str(result)}")
+            else:
+                contents[result[0]] = result[1]
+        return contents
 
     def _get_views(self, message):
         """Безопасное получение количества просмотров"""
@@ -650,7 +1382,8 @@ class TelegramAnalytics:
             'text_preview': text_preview,
             'content_type': content_type,
             'is_group': True,
-            'group_size': len(group_messages)
+            'group_size': len(group_messages),
+            'text': '\n'.join(msg.text for msg in group_messages if msg.text)
         }
 
     def _get_media_types(self, messages):
@@ -677,20 +1410,31 @@ class TelegramAnalytics:
         # Убираем дубликаты
         return list(set(media_types))
     
-    async def analyze_channel(self, channel_identifier, hours_back=24):
+    @tracer.traced()
+    async def analyze_channel(self, channel_identifier, hours_back=24, progress_callback=None):
         """Основной метод анализа канала с автоматическим fallback на последние 30 постов"""
+        def report_progress(stage, **details):
+            if progress_callback:
+                progress_callback(stage, **details)
+
         try:
+            # Отслеживаемый канал: отчет из накопленных событий, без запросов к Telegram
+            tracked = self.tracker.find(channel_identifier) if self.tracker else None
+            if tracked:
+                report_progress('aggregating', messages_fetched=len(tracked.posts))
+                return await self.tracker.build_report(tracked, hours_back)
+            
             # Проверяем подключение клиента
-            if not self.client or not self.client.is_connected():
-                if not await self.init_client():
-                    return {'error': 'Не удалось подключиться к Telegram'}
+            if not await self.ensure_client():
+                return {'error': 'Не удалось подключиться к Telegram'}
             
             # Получаем информацию о канале
+            report_progress('resolving')
             channel_info = await self.get_channel_info(channel_identifier)
             if not channel_info or 'error' in channel_info:
                 return {
                     'error': 'Канал не найден или приватный',
-                    'details': channel_info.get('message', 'Убедитесь что вы подписаны на канал')
+                    'details': (channel_info or {}).get('message', 'Убедитесь что вы подписаны на канал')
                 }
             
             # Временной диапазон для запрошенного периода
@@ -701,21 +1445,31 @@ class TelegramAnalytics:
             logger.info(f"Текущее время сервера: {datetime.now(self.moscow_tz)}")
             logger.info(f"Диапазон анализа: {start_time} - {end_time}")
             
-            # Получаем все доступные сообщения
-            all_messages = []
-            last_message_date = None
+            # Получаем посты потоково: альбомы собираются по мере чтения
             try:
-                all_messages = await self.client.get_messages(
-                    channel_identifier, 
-                    limit=1000
+                report_progress('fetching', messages_fetched=0)
+                all_posts, fetch_info = await self.fetch_posts(
+                    channel_identifier,
+                    on_progress=lambda fetched: report_progress('fetching', messages_fetched=fetched)
                 )
                 
-                logger.info(f"Получено сообщений: {len(all_messages)}")
+                logger.info(f"Получено сообщений: {fetch_info['messages_fetched']}")
+                report_progress('aggregating', messages_fetched=fetch_info['messages_fetched'])
+                newest_message_id = fetch_info['newest_message_id']
+                last_message_date = fetch_info['last_message_date']
+                self.search_index.add_posts(channel_info, all_posts)
                 
-                # Определяем дату последнего поста
-                if all_messages:
-                    last_message_date = max(msg.date.replace(tzinfo=pytz.UTC).astimezone(self.moscow_tz) 
-                                          for msg in all_messages if msg.date)
+                # Период длиннее прочитанных сообщений - более старые посты из архива полной истории
+                archived_posts = 0
+                if self.backfill and all_posts and fetch_info['messages_fetched'] >= ANALYSIS_MESSAGE_LIMIT:
+                    oldest = min(all_posts, key=lambda post: post['id'])
+                    if oldest['date'].replace(tzinfo=pytz.UTC) > start_time:
+                        archived = await self.backfill.load_posts(channel_info['id'], oldest['id'], start_time)
+                        archived_posts = len(archived)
+                        all_posts.extend(archived)
+                        if archived:
+                            logger.info(f"Из архива истории добавлено постов: {archived_posts}")
+                if last_message_date:
                     logger.info(f"Последний пост: {last_message_date}")
                 
             except ChannelPrivateError:
@@ -742,30 +1496,26 @@ class TelegramAnalytics:
                     fallback_reason = f"Последний пост был {days_since_last_post} дней назад"
                     logger.info(f"Используем fallback: {fallback_reason}")
             
-            # Фильтруем сообщения по временному диапазону или используем fallback
-            messages_to_process = []
-            
+            # Фильтруем собранные посты по временному диапазону или используем fallback.
+            # Альбом на границе периода относится к дате своего первого сообщения
             if used_fallback:
                 # Fallback режим: берем последние 30 постов
-                messages_to_process = all_messages[:30]
+                processed_posts = all_posts[:30]
                 actual_period_text = "последние 30 постов"
-                logger.info(f"Fallback режим: анализируем {len(messages_to_process)} постов")
+                logger.info(f"Fallback режим: анализируем {len(processed_posts)} постов")
             else:
                 # Нормальный режим: фильтруем по временному диапазону
-                for msg in all_messages:
-                    if not msg.date:
-                        continue
-                        
-                    msg_time = msg.date.replace(tzinfo=pytz.UTC).astimezone(self.moscow_tz)
-                    if start_time <= msg_time <= end_time:
-                        messages_to_process.append(msg)
+                processed_posts = [
+                    post for post in all_posts
+                    if start_time <= post['date'].replace(tzinfo=pytz.UTC).astimezone(self.moscow_tz) <= end_time
+                ]
                 
-                logger.info(f"Нормальный режим: найдено {len(messages_to_process)} постов за период")
+                logger.info(f"Нормальный режим: найдено {len(processed_posts)} постов за период")
             
             # Если в нормальном режиме нет постов, но канал активный (последний пост < 30 дней)
             # то все равно показываем, что постов нет за период
-            if not used_fallback and not messages_to_process:
-                return {
+            if not used_fallback and not processed_posts:
+                return self._with_version({
                     'channel_info': channel_info,
                     'analysis_period': {
                         'hours_back': hours_back,
@@ -777,25 +1527,13 @@ class TelegramAnalytics:
                     'total_posts': 0,
                     'message': 'Нет постов за указанный период',
                     'last_message_date': last_message_date.strftime('%Y-%m-%d %H:%M') if last_message_date else 'Неизвестно'
-                }
-            
-            # Группируем сообщения по grouped_id
-            grouped_messages = defaultdict(list)
-            single_messages = []
-            
-            for msg in messages_to_process:
-                if not msg.date:
-                    continue
-                    
-                if hasattr(msg, 'grouped_id') and msg.grouped_id:
-                    grouped_messages[msg.grouped_id].append(msg)
-                else:
-                    single_messages.append(msg)
+                }, newest_message_id)
             
-            logger.info(f"Обработано постов: {len(messages_to_process)} (групп: {len(grouped_messages)}, одиночных: {len(single_messages)})")
+            groups_processed = sum(1 for post in processed_posts if post['is_group'])
+            single_messages = len(processed_posts) - groups_processed
             
-            if not messages_to_process:
-                return {
+            if not processed_posts:
+                return self._with_version({
                     'channel_info': channel_info,
                     'analysis_period': {
                         'hours_back': hours_back,
@@ -807,159 +1545,246 @@ class TelegramAnalytics:
                     'total_posts': 0,
                     'message': 'Нет постов для анализа',
                     'last_message_date': last_message_date.strftime('%Y-%m-%d %H:%M') if last_message_date else 'Неизвестно'
-                }
-            
-            # Обрабатываем группы сообщений
-            processed_posts = []
-            
-            # Обрабатываем группы
-            for group_id, messages in grouped_messages.items():
-                group_post = self._process_message_group(messages)
-                if group_post:
-                    processed_posts.append(group_post)
-            
-            # Обрабатываем одиночные сообщения
-            for msg in single_messages:
-                moscow_time = msg.date.replace(tzinfo=pytz.UTC).astimezone(self.moscow_tz)
-                text_preview = (msg.text[:100] + '...') if msg.text and len(msg.text) > 100 else msg.text or 'Медиа контент'
-                
-                processed_posts.append({
-                    'id': msg.id,
-                    'date': msg.date,
-                    'views': self._get_views(msg),
-                    'reactions': self._get_reactions(msg),
-                    'forwards': self._get_forwards(msg),
-                    'comments': self._get_comments(msg),
-                    'text_preview': text_preview,
-                    'content_type': self._categorize_single_content(msg),
-                    'is_group': False,
-                    'group_size': 1
-                })
-            
-            logger.info(f"Обработано постов: {len(processed_posts)} (групп: {len(grouped_messages)}, одиночных: {len(single_messages)})")
-            
-            # Анализируем данные с использованием безопасных методов
-            total_posts = len(processed_posts)
-            total_views = sum(post['views'] for post in processed_posts)
-            total_reactions = sum(post['reactions'] for post in processed_posts)
-            total_comments = sum(post['comments'] for post in processed_posts)
-            total_forwards = sum(post['forwards'] for post in processed_posts)
-            
-            # Анализ по типам контента
-            content_stats = {}
-            for post in processed_posts:
-                content_type = post['content_type']
-                if content_type not in content_stats:
-                    content_stats[content_type] = {
-                        'count': 0, 
-                        'total_views': 0, 
-                        'total_reactions': 0,
-                        'total_comments': 0,
-                        'total_forwards': 0
-                    }
-                content_stats[content_type]['count'] += 1
-                content_stats[content_type]['total_views'] += post['views']
-                content_stats[content_type]['total_reactions'] += post['reactions']
-                content_stats[content_type]['total_comments'] += post['comments']
-                content_stats[content_type]['total_forwards'] += post['forwards']
-            
-            # ТОП постов
-            top_posts = sorted(processed_posts, key=lambda x: x['views'], reverse=True)[:5]
-            top_posts_data = []
-            for post in top_posts:
-                moscow_time = post['date'].replace(tzinfo=pytz.UTC).astimezone(self.moscow_tz)
-                
-                post_type = post['content_type']
-                if post['is_group']:
-                    post_type = f"{post_type} (альбом из {post['group_size']})"
-                
-                top_posts_data.append({
-                    'id': post['id'],
-                    'date': moscow_time.strftime('%d.%m.%Y %H:%M'),
-                    'views': post['views'],
-                    'reactions': post['reactions'],
-                    'forwards': post['forwards'],
-                    'text_preview': post['text_preview'],
-                    'content_type': post_type,
-                    'is_group': post['is_group'],
-                    'group_size': post['group_size']
-                })
+                }, newest_message_id)
             
-            # Анализ времени
-            time_analysis = self.get_time_analysis(processed_posts)
+            logger.info(f"Обработано постов: {len(processed_posts)} (групп: {groups_processed}, одиночных: {single_messages})")
             
-            # Расчет engagement rate
-            subscribers = channel_info.get('subscribers', 0)
-            avg_engagement = self.calculate_engagement_rate(
-                total_views, total_reactions, total_comments, 
-                total_forwards, subscribers
-            )
-            
-            # Генерируем рекомендации
-            recommendations = self.generate_recommendations(
-                content_stats, time_analysis, avg_engagement, total_posts, hours_back
-            )
-            
-            # Формируем итоговый отчет
-            report = {
-                'channel_info': channel_info,
-                'analysis_period': {
-                    'hours_back': hours_back,
-                    'start_time': start_time.strftime('%d.%m.%Y %H:%M') if not used_fallback else None,
-                    'end_time': end_time.strftime('%d.%m.%Y %H:%M') if not used_fallback else None,
-                    'actual_period': actual_period_text,
-                    'used_fallback': used_fallback,
-                    'fallback_reason': fallback_reason
-                },
-                'summary': {
-                    'total_posts': total_posts,
-                    'total_views': total_views,
-                    'avg_views_per_post': round(total_views / total_posts, 1) if total_posts > 0 else 0,
-                    'total_reactions': total_reactions,
-                    'total_comments': total_comments,
-                    'total_forwards': total_forwards,
-                    'engagement_rate': avg_engagement
-                },
-                'content_analysis': content_stats,
-                'time_analysis': time_analysis,
-                'top_posts': top_posts_data,
-                'recommendations': recommendations,
-                'generated_at': datetime.now(self.moscow_tz).strftime('%d.%m.%Y %H:%M:%S'),
-                'group_processing_info': {
-                    'groups_processed': len(grouped_messages),
-                    'single_messages': len(single_messages)
-                },
-                'last_message_date': last_message_date.strftime('%Y-%m-%d %H:%M') if last_message_date else 'Неизвестно'
+            analysis_period = {
+                'hours_back': hours_back,
+                'start_time': start_time.strftime('%d.%m.%Y %H:%M') if not used_fallback else None,
+                'end_time': end_time.strftime('%d.%m.%Y %H:%M') if not used_fallback else None,
+                'actual_period': actual_period_text,
+                'used_fallback': used_fallback,
+                'fallback_reason': fallback_reason,
+                'archived_posts': archived_posts
             }
+            report = self.build_report(
+                channel_info, processed_posts, analysis_period, last_message_date,
+                groups_processed, single_messages
+            )
+            await self.add_topics(report, processed_posts)
             
-            return report
+            return self._with_version(report, newest_message_id)
             
         except FloodWaitError as e:
+            record_flood_wait(e, 'analyze')
             logger.error(f"Flood wait error: {e.seconds} seconds")
             return {'error': f'Превышен лимит запросов. Попробуйте через {e.seconds} секунд'}
         except Exception as e:
             logger.error(f"Ошибка анализа канала: {str(e)}", exc_info=True)
             return {'error': f'Ошибка анализа: {str(e)}'}
     
-    def _categorize_single_content(self, message):
-        """Категоризация типа контента для одиночных сообщений"""
-        if message.media:
-            if isinstance(message.media, MessageMediaPhoto):
-                return 'photo'
-            elif isinstance(message.media, MessageMediaDocument):
-                if message.media.document:
-                    mime_type = message.media.document.mime_type
-                    if mime_type.startswith('video/'):
-                        return 'video'
-                    elif mime_type.startswith('audio/'):
-                        return 'audio'
-                    else:
-                        return 'document'
-            else:
-                return 'media'
-        elif message.text:
-            return 'text'
-        else:
+    def _process_single_message(self, msg):
+        """Обработка одиночного сообщения как поста"""
+        text_preview = (msg.text[:100] + '...') if msg.text and len(msg.text) > 100 else msg.text or 'Медиа контент'
+        
+        return {
+            'id': msg.id,
+            'date': msg.date,
+            'views': self._get_views(msg),
+            'reactions': self._get_reactions(msg),
+            'forwards': self._get_forwards(msg),
+            'comments': self._get_comments(msg),
+            'text_preview': text_preview,
+            'content_type': self._categorize_single_content(msg),
+            'is_group': False,
+            'group_size': 1,
+            'text': msg.text or ''
+        }
+
+    @tracer.traced()
+    async def fetch_posts(self, channel_identifier, limit=ANALYSIS_MESSAGE_LIMIT, on_progress=None, on_album=None):
+        """Чтение последних сообщений канала с потоковой сборкой альбомов.
+
+        Альбом, попавший на границу лимита, дочитывается целиком.
+        """
+        assembler = AlbumAssembler(self, on_album=on_album)
+        posts = []
+        info = {'messages_fetched': 0, 'newest_message_id': 0, 'last_message_date': None}
+        started = time.perf_counter()
+        grouping_seconds = 0.0
+        text_bytes = 0
+        
+        try:
+            async for msg in self.client.iter_messages(channel_identifier):
+                if info['messages_fetched'] >= limit and not assembler.continues(msg):
+                    break
+                info['messages_fetched'] += 1
+                text_bytes += len((getattr(msg, 'message', None) or '').encode('utf-8'))
+                if on_progress and info['messages_fetched'] % 100 == 0:
+                    on_progress(info['messages_fetched'])
+                
+                info['newest_message_id'] = max(info['newest_message_id'], msg.id)
+                if not msg.date:
+                    continue
+                
+                msg_time = msg.date.replace(tzinfo=pytz.UTC).astimezone(self.moscow_tz)
+                if info['last_message_date'] is None or msg_time > info['last_message_date']:
+                    info['last_message_date'] = msg_time
+                grouping_started = time.perf_counter()
+                posts.extend(assembler.feed(msg))
+                grouping_seconds += time.perf_counter() - grouping_started
+            
+            posts.extend(assembler.close())
+        finally:
+            tracer.current_span().set_attributes(messages_fetched=info['messages_fetched'], posts=len(posts),
+                                                 grouping_ms=round(grouping_seconds * 1000, 1))
+            # Чтение и сборка альбомов чередуются, поэтому время сборки считается отдельно и вычитается
+            STAGE_DURATION.observe(time.perf_counter() - started - grouping_seconds, stage='fetch')
+            STAGE_DURATION.observe(grouping_seconds, stage='grouping')
+            MESSAGES_FETCHED.inc(info['messages_fetched'])
+            MESSAGE_TEXT_BYTES.inc(text_bytes)
+        return posts, info
+
+    @tracer.traced()
+    def build_report(self, channel_info, processed_posts, analysis_period, last_message_date, groups_processed, single_messages):
+        """Агрегация обработанных постов в итоговый отчет (без запросов к Telegram)"""
+        started = time.perf_counter()
+        hours_back = analysis_period['hours_back']
+        
+        # Анализируем данные с использованием безопасных методов
+        total_posts = len(processed_posts)
+        total_views = sum(post['views'] for post in processed_posts)
+        total_reactions = sum(post['reactions'] for post in processed_posts)
+        total_comments = sum(post['comments'] for post in processed_posts)
+        total_forwards = sum(post['forwards'] for post in processed_posts)
+        
+        # Анализ по типам контента
+        content_stats = {}
+        for post in processed_posts:
+            content_type = post['content_type']
+            if content_type not in content_stats:
+                content_stats[content_type] = {
+                    'count': 0, 
+                    'total_views': 0, 
+                    'total_reactions': 0,
+                    'total_comments': 0,
+                    'total_forwards': 0
+                }
+            content_stats[content_type]['count'] += 1
+            content_stats[content_type]['total_views'] += post['views']
+            content_stats[content_type]['total_reactions'] += post['reactions']
+            content_stats[content_type]['total_comments'] += post['comments']
+            content_stats[content_type]['total_forwards'] += post['forwards']
+        
+        # ТОП постов
+        top_posts = sorted(processed_posts, key=lambda x: x['views'], reverse=True)[:5]
+        top_posts_data = []
+        for post in top_posts:
+            moscow_time = post['date'].replace(tzinfo=pytz.UTC).astimezone(self.moscow_tz)
+            
+            post_type = post['content_type']
+            if post['is_group']:
+                post_type = f"{post_type} (альбом из {post['group_size']})"
+            
+            top_posts_data.append({
+                'id': post['id'],
+                'date': moscow_time.strftime('%d.%m.%Y %H:%M'),
+                'views': post['views'],
+                'reactions': post['reactions'],
+                'forwards': post['forwards'],
+                'text_preview': post['text_preview'],
+                'content_type': post_type,
+                'is_group': post['is_group'],
+                'group_size': post['group_size']
+            })
+        
+        # Анализ времени
+        time_analysis = self.get_time_analysis(processed_posts)
+        
+        # Расчет engagement rate
+        subscribers = channel_info.get('subscribers', 0)
+        avg_engagement = self.calculate_engagement_rate(
+            total_views, total_reactions, total_comments, 
+            total_forwards, subscribers
+        )
+        
+        # Генерируем рекомендации
+        recommendations = self.generate_recommendations(
+            content_stats, time_analysis, avg_engagement, total_posts, hours_back
+        )
+        
+        # Формируем итоговый отчет
+        report = {
+            'channel_info': channel_info,
+            'analysis_period': analysis_period,
+            'summary': {
+                'total_posts': total_posts,
+                'total_views': total_views,
+                'avg_views_per_post': round(total_views / total_posts, 1) if total_posts > 0 else 0,
+                'total_reactions': total_reactions,
+                'total_comments': total_comments,
+                'total_forwards': total_forwards,
+                'engagement_rate': avg_engagement
+            },
+            'content_analysis': content_stats,
+            'time_analysis': time_analysis,
+            'top_posts': top_posts_data,
+            'recommendations': recommendations,
+            'generated_at': datetime.now(self.moscow_tz).strftime('%d.%m.%Y %H:%M:%S'),
+            'group_processing_info': {
+                'groups_processed': groups_processed,
+                'single_messages': single_messages
+            },
+            'last_message_date': last_message_date.strftime('%Y-%m-%d %H:%M') if last_message_date else 'Неизвестно'
+        }
+        
+        STAGE_DURATION.observe(time.perf_counter() - started, stage='aggregation')
+        
+        return report
+
+    async def add_topics(self, report, processed_posts):
+        """Темы и ключевые слова по текстам постов; TF-IDF и k-means - в пуле потоков, не на event loop"""
+        loop = asyncio.get_running_loop()
+        with STAGE_DURATION.time(stage='topics'), tracer.span('topics.extract_topics', posts=len(processed_posts)):
+            topic_analysis = await loop.run_in_executor(None, topics.extract_topics, processed_posts)
+        if topic_analysis:
+            report['topic_analysis'] = topic_analysis
+        return report
+
+    def _with_version(self, report, newest_message_id):
+        """Добавление версии отчета: (id канала, id последнего сообщения, хэш счетчиков)"""
+        counters = {
+            'summary': report.get('summary'),
+            'content_analysis': report.get('content_analysis'),
+            'total_posts': report.get('total_posts')
+        }
+        counters_hash = hashlib.sha1(json.dumps(counters, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        version_source = f"{report['channel_info']['id']}:{newest_message_id}:{report['analysis_period']['hours_back']}:{counters_hash}"
+        report['newest_message_id'] = newest_message_id
+        report['version'] = hashlib.sha1(version_source.encode('utf-8')).hexdigest()[:32]
+        return report
+
+    @tracer.traced()
+    async def get_latest_message_id(self, channel_identifier):
+        """Дешевая проверка изменений канала: id последнего сообщения (один запрос)"""
+        tracked = self.tracker.find(channel_identifier) if self.tracker else None
+        if tracked:
+            return tracked.newest_message_id
+        if not await self.ensure_client():
+            return None
+        messages = await self.client.get_messages(channel_identifier, limit=1)
+        return messages[0].id if messages else 0
+
+    def _categorize_single_content(self, message):
+        """Категоризация типа контента для одиночных сообщений"""
+        if message.media:
+            if isinstance(message.media, MessageMediaPhoto):
+                return 'photo'
+            elif isinstance(message.media, MessageMediaDocument):
+                if message.media.document:
+                    mime_type = message.media.document.mime_type
+                    if mime_type.startswith('video/'):
+                        return 'video'
+                    elif mime_type.startswith('audio/'):
+                        return 'audio'
+                    else:
+                        return 'document'
+            else:
+                return 'media'
+        elif message.text:
+            return 'text'
+        else:
             return 'other'
     
     def get_time_analysis(self, posts):
@@ -1056,7 +1881,324 @@ class TelegramAnalytics:
         return recommendations
 
 # Создаем экземпляр аналитики
-analytics = TelegramAnalytics()
+analytics = TelegramAnalytics(client_factory=create_client_factory())
+
+# =============================================
+# СЕРИАЛИЗАЦИЯ И СЖАТИЕ ОТВЕТОВ API
+# =============================================
+COMPRESS_MIN_SIZE = 1024  # Ответы меньше этого размера не сжимаем
+COMPRESS_CHUNK = 64 * 1024  # Размер порции при потоковом сжатии
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'application/msgpack', 'text/csv')
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def _serialize_default(obj):
+    """Преобразование типов, которые не умеют сериализовать JSON/MessagePack"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    raise TypeError(f"Тип {type(obj).__name__} не сериализуется")
+
+def dumps_json(data):
+    """Быстрая сериализация в JSON (UTF-8 байты); ключи-числа, как в jsonify, становятся строками"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_serialize_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_serialize_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def wants_msgpack():
+    """Клиент явно запросил MessagePack через Accept"""
+    if msgpack is None:
+        return False
+    best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES)
+    return best in MSGPACK_MIMETYPES
+
+def api_response(data, status=200):
+    """Ответ API: MessagePack по запросу клиента, иначе быстрый JSON"""
+    if wants_msgpack():
+        body = msgpack.packb(data, default=_serialize_default, use_bin_type=True)
+        return Response(body, status=status, mimetype='application/msgpack')
+    return Response(dumps_json(data), status=status, mimetype='application/json')
+
+def choose_response_encoding():
+    """Выбор сжатия ответа по Accept-Encoding"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def iter_compressed(chunks, encoding):
+    """Потоковое сжатие тела ответа порциями"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 - формат gzip
+        compress, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def iter_body_chunks(body, size=COMPRESS_CHUNK):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+@app.after_request
+def compress_response(response):
+    """Сжатие крупных ответов API (включая потоковые) gzip или brotli"""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = choose_response_encoding()
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = iter_compressed(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.response = iter_compressed(iter_body_chunks(body), encoding)
+
+    response.headers.pop('Content-Length', None)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # Сжатое тело - другое представление: сильный ETag не должен совпадать с несжатым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+# Трассировка и профилирование запросов
+PROFILE_ID_RE = re.compile(r'^[0-9a-f]{16,32}$')
+
+def is_admin_request():
+    """Запрос с ключом администратора (заголовок X-Admin-Key или параметр admin_key)"""
+    key = request.headers.get('X-Admin-Key') or request.args.get('admin_key')
+    return bool(ADMIN_KEY and key and hmac.compare_digest(key, ADMIN_KEY))
+
+def profiling_requested():
+    return request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+
+def save_profile(profiler, profile_id):
+    """Сводка (JSON) и стеки (folded) профиля запроса в PROFILE_DIR"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    summary = profiler.summary()
+    summary['request'] = f"{request.method} {request.full_path.rstrip('?')}"
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), 'w', encoding='utf-8') as f:
+        f.write(profiler.folded())
+    logger.info(f"Профиль запроса {summary['request']} сохранен: {profile_id} ({summary['samples']} выборок)")
+
+@app.before_request
+def start_request_tracing():
+    """Корневой спан запроса и профилировщик по запросу администратора"""
+    route = request.url_rule.rule if request.url_rule else request.path
+    span = tracer.start_span(f"{request.method} {route}", SPAN_KIND_SERVER, {
+        'http.method': request.method,
+        'http.route': route,
+        'http.target': request.full_path.rstrip('?')
+    }, traceparent=request.headers.get('traceparent'))
+    g.trace_span = span
+    g.trace_token = tracer.activate(span)
+
+    if profiling_requested():
+        if not is_admin_request():
+            return jsonify({'error': 'Профилирование доступно только администратору'}), 403
+        # Работа запроса идет и в общем event loop, поэтому его поток тоже семплируется
+        get_background_loop()
+        threads = {'request': threading.get_ident(), 'telegram-loop': loop_thread.ident}
+        g.profiler = SamplingProfiler(threads, interval=PROFILE_INTERVAL).start()
+
+@app.after_request
+def finish_request_tracing(response):
+    span = g.get('trace_span')
+    if span is not None and span.recording:
+        span.set_attribute('http.status_code', response.status_code)
+        response.headers['X-Trace-Id'] = span.trace_id
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profile_id = span.trace_id if span is not None and span.recording else os.urandom(8).hex()
+        save_profile(profiler.stop(), profile_id)
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+@app.teardown_request
+def end_request_span(error=None):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()  # Запрос завершился исключением до after_request
+    span = g.pop('trace_span', None)
+    if span is not None:
+        tracer.end_span(span, error)
+    token = g.pop('trace_token', None)
+    if token is not None:
+        try:
+            tracer.deactivate(token)
+        except ValueError:
+            pass  # Потоковый ответ завершается в другом контексте
+
+@app.route('/debug/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Профиль запроса по X-Profile-Id: сводка JSON или ?format=folded для flamegraph"""
+    if not is_admin_request():
+        return jsonify({'error': 'Доступно только администратору'}), 403
+    if not PROFILE_ID_RE.match(profile_id):
+        return jsonify({'error': 'Некорректный id профиля'}), 400
+
+    folded = request.args.get('format') == 'folded'
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{'folded' if folded else 'json'}")
+    if not os.path.exists(path):
+        return jsonify({'error': 'Профиль не найден'}), 404
+    return send_file(os.path.abspath(path), mimetype='text/plain' if folded else 'application/json')
+
+# Маршруты с Telegram клиентом в режиме нескольких воркеров
+def telegram_route(view):
+    """Пометка маршрута, которому нужен Telegram клиент: в воркерах без клиента он пересылается владельцу"""
+    view.telegram_route = True
+    return view
+
+@app.before_request
+def forward_to_telegram_owner():
+    """Пересылка запроса воркеру-владельцу Telegram клиента через Unix сокет"""
+    if TELEGRAM_OWNER_MODE != 'shared' or telegram_owner.is_owner:
+        return None
+    if not getattr(app.view_functions.get(request.endpoint), 'telegram_route', False):
+        return None
+
+    headers = [(name, value) for name, value in request.headers.items()
+               if name.lower() not in ('traceparent', ADMISSION_FORWARD_HEADER.lower())]
+    headers.append((ADMISSION_FORWARD_HEADER, admission_client_id()))
+    span = tracer.current_span()
+    if span.recording:
+        headers.append(('traceparent', f"00-{span.trace_id}-{span.span_id}-01"))
+    try:
+        status, response_headers, body = forward_request(
+            TELEGRAM_OWNER_SOCKET, request.method, request.full_path.rstrip('?'), headers,
+            request.get_data(), TELEGRAM_FORWARD_TIMEOUT
+        )
+    except OSError as e:
+        # Владелец завершился или еще не запущен - пробуем стать им сами
+        if telegram_owner.try_acquire():
+            logger.warning(f"Владелец Telegram клиента недоступен ({str(e)}), воркер {os.getpid()} становится владельцем")
+            start_telegram_owner()
+            return None
+        logger.error(f"Не удалось переслать запрос владельцу Telegram клиента: {str(e)}")
+        response = jsonify({'error': 'Сервис Telegram временно недоступен, повторите запрос позже'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    # CORS заголовки добавит after_request этого воркера
+    response_headers = [(name, value) for name, value in response_headers if not name.lower().startswith('access-control-')]
+    return Response(body, status=status, headers=response_headers)
+
+# =============================================
+# ДОПУСК ЗАПРОСОВ К ДОРОГИМ ЭНДПОИНТАМ
+# =============================================
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 15))  # Сколько секунд запрос может ждать слота
+ADMISSION_PER_CLIENT = int(os.getenv('ADMISSION_PER_CLIENT', 3))  # Запросов одного клиента к эндпоинту (выполняемых и ожидающих)
+ADMISSION_CLIENT_HEADER = os.getenv('ADMISSION_CLIENT_HEADER')  # Заголовок с id клиента за прокси (иначе адрес клиента)
+ADMISSION_FORWARD_HEADER = 'X-Admission-Client'  # Клиент пересланного владельцу запроса
+
+admission = {
+    'analyze': AdmissionController(
+        'analyze',
+        max_concurrent=int(os.getenv('ADMISSION_ANALYZE_CONCURRENCY', 2)),
+        max_queue=int(os.getenv('ADMISSION_ANALYZE_QUEUE', 8)),
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+        per_client=ADMISSION_PER_CLIENT,
+        service_time=10.0
+    ),
+    'ai_analyze': AdmissionController(
+        'ai_analyze',
+        max_concurrent=int(os.getenv('ADMISSION_AI_CONCURRENCY', 4)),
+        max_queue=int(os.getenv('ADMISSION_AI_QUEUE', 8)),
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+        per_client=ADMISSION_PER_CLIENT,
+        service_time=30.0
+    ),
+    'generate_pdf': AdmissionController(
+        'generate_pdf',
+        max_concurrent=int(os.getenv('ADMISSION_PDF_CONCURRENCY', 2)),
+        max_queue=int(os.getenv('ADMISSION_PDF_QUEUE', 8)),
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+        per_client=ADMISSION_PER_CLIENT,
+        service_time=3.0
+    ),
+}
+
+ADMISSION_ACTIVE = registry.gauge('admission_active_requests', 'Выполняемых запросов дорогих эндпоинтов', ['endpoint'],
+                                  collect=lambda: {(name,): controller.active for name, controller in admission.items()})
+ADMISSION_QUEUED = registry.gauge('admission_queued_requests', 'Запросов в очереди ожидания слота', ['endpoint'],
+                                  collect=lambda: {(name,): len(controller.waiters) for name, controller in admission.items()})
+ADMISSION_REJECTED = registry.counter('admission_rejected_total', 'Запросов, отклоненных при перегрузке', ['endpoint', 'reason'])
+
+def admission_client_id():
+    """Клиент для квот: заголовок ADMISSION_CLIENT_HEADER или адрес клиента"""
+    if not request.remote_addr or request.remote_addr == '<local>':
+        # Запрос через Unix сокет владельца: клиента передал пересылающий воркер
+        forwarded = request.headers.get(ADMISSION_FORWARD_HEADER)
+        if forwarded:
+            return forwarded
+    if ADMISSION_CLIENT_HEADER:
+        client = request.headers.get(ADMISSION_CLIENT_HEADER)
+        if client:
+            return client[:128]
+    return request.remote_addr or 'unknown'
+
+def admission_slot(endpoint):
+    """Слот выполнения дорогой работы текущего запроса; при перегрузке - Overloaded"""
+    return admission[endpoint].slot(admission_client_id())
+
+def admission_hold(endpoint):
+    """Слот для работы, которая завершится в другом потоке (фоновая задача).
+
+    Не ждет в очереди: если свободного слота нет, сразу Overloaded.
+    Возвращает функцию освобождения слота.
+    """
+    controller = admission[endpoint]
+    client = admission_client_id()
+    controller.acquire(client, block=False)
+    started = time.monotonic()
+    return lambda: controller.release(client, time.monotonic() - started)
+
+def overloaded_response(e):
+    """Ответ 429/503 с Retry-After на отклоненный запрос"""
+    ADMISSION_REJECTED.inc(endpoint=e.endpoint, reason=e.reason)
+    logger.warning(f"Запрос к {e.endpoint} отклонен ({e.reason}), клиент {admission_client_id()}, Retry-After {e.retry_after} с")
+    response = jsonify({'error': str(e), 'reason': e.reason, 'retry_after': e.retry_after})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
 # Flask маршруты
 @app.route('/health', methods=['GET'])
@@ -1067,16 +2209,99 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+# Последние отчеты по каналам для условных GET запросов
+REPORT_VERSION_CACHE_SIZE = 200
+REPORT_VERSION_MAX_AGE = int(os.getenv('REPORT_VERSION_MAX_AGE', 300))  # Просмотры растут и без новых постов, поэтому отчет не вечен
+
+if TELEGRAM_OWNER_MODE == 'shared':
+    # Отчеты переживают смену воркера-владельца Telegram клиента
+    report_versions = StoreMapping(shared_store, 'report_version:', ttl=REPORT_VERSION_MAX_AGE)
+else:
+    # Один процесс: LRU в памяти, без сериализации отчета на диск при каждом анализе
+    report_versions = OrderedDict()
+report_versions_lock = threading.Lock()
+
+def report_cache_key(channel_identifier, hours_back):
+    return f"{str(channel_identifier).strip().lstrip('@').lower()}:{hours_back}"
+
+def remember_report(channel_identifier, hours_back, report):
+    """Сохранение версии отчета для последующих условных запросов"""
+    if 'error' in report or 'version' not in report:
+        return
+    key = report_cache_key(channel_identifier, hours_back)
+    entry = {
+        'report': report,
+        'version': report['version'],
+        'newest_message_id': report['newest_message_id'],
+        'timestamp': time.time()
+    }
+    with report_versions_lock:
+        report_versions[key] = entry
+        if isinstance(report_versions, OrderedDict):
+            report_versions.move_to_end(key)
+            while len(report_versions) > REPORT_VERSION_CACHE_SIZE:
+                report_versions.popitem(last=False)
+
+def get_remembered_report(channel_identifier, hours_back):
+    """Свежая сохраненная версия отчета или None"""
+    with report_versions_lock:
+        entry = report_versions.get(report_cache_key(channel_identifier, hours_back))
+    if entry and time.time() - entry['timestamp'] <= REPORT_VERSION_MAX_AGE:
+        return entry
+    return None
+
+def versioned_response(report):
+    """Ответ с отчетом и ETag по его версии (сжатие добавит к ETag compress_response)"""
+    response = api_response(report)
+    if 'version' in report:
+        # У представлений с разными байтами разные сильные ETag
+        response.set_etag(report['version'] if response.mimetype == 'application/json' else f"{report['version']}-msgpack")
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def matching_report_etag(version):
+    """ETag из If-None-Match с этой версией отчета (в любом формате и сжатии) или None"""
+    if request.if_none_match.star_tag:
+        return version
+    for etag in request.if_none_match.as_set(include_weak=True):
+        if etag == version or etag.startswith(f"{version}-"):
+            return etag
+    return None
+
+def not_modified_response(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def parse_analysis_params(data):
+    """Извлечение канала и периода анализа из параметров запроса"""
+    channel_identifier = data.get('channel_username') or data.get('channel_id')
+    hours_back = data.get('hours_back', 24)
+    
+    # Добавляем проверку типа hours_back
+    try:
+        hours_back = int(hours_back)
+    except (ValueError, TypeError):
+        hours_back = 24
+    
+    return channel_identifier, hours_back
+
 @app.route('/analyze', methods=['POST'])
+@telegram_route
 def perform_analysis():
     try:
         # Проверяем, есть ли данные
         if not request.data:
             return jsonify({'error': 'No data provided'}), 400
             
-        # Логируем сырые данные для отладки
-        raw_data = request.data.decode('utf-8')
-        logger.info(f"Received raw data: {raw_data}")
+        # Логируем сырые данные для отладки (сэмплируется)
+        request_logger.info("Received raw data: %s", request.get_data(as_text=True))
         
         try:
             data = request.get_json()
@@ -1084,36 +2309,1103 @@ def perform_analysis():
             logger.error(f"JSON parsing error: {str(e)}")
             return jsonify({'error': 'Invalid JSON format'}), 400
         
-        channel_identifier = data.get('channel_username') or data.get('channel_id')
-        hours_back = data.get('hours_back', 24)
+        channel_identifier, hours_back = parse_analysis_params(data)
         
         if not channel_identifier:
             return jsonify({'error': 'Не указан username или ID канала'}), 400
         
-        # Добавляем проверку типа hours_back
-        try:
-            hours_back = int(hours_back)
-        except (ValueError, TypeError):
-            hours_back = 24
-        
-        # Получаем глобальный event loop
-        loop = current_app.config['GLOBAL_EVENT_LOOP']
-        
         # Запускаем анализ
-        result = loop.run_until_complete(analytics.analyze_channel(channel_identifier, hours_back))
+        with admission_slot('analyze'):
+            result = run_async(analytics.analyze_channel(channel_identifier, hours_back))
+
+        # Заранее отрисовываем графики для PDF в фоне
+        if 'error' not in result:
+            schedule_report_charts(result)
+            remember_report(channel_identifier, hours_back, result)
         
         # # Если нет ошибки, добавляем ИИ анализ
         # if 'error' not in result:
             # logger.info("Запуск ИИ анализа...")
-            # ai_report = loop.run_until_complete(analytics.generate_ai_analysis(result))
+            # ai_report = run_async(analytics.generate_ai_analysis(result))
             # logger.info(f"ИИ анализ завершен, длина: {len(ai_report)} символов")
             # result['ai_report'] = ai_report
         
-        return jsonify(result)
+        return versioned_response(result)
         
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении анализа: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analyze', methods=['GET'])
+@telegram_route
+def conditional_analysis():
+    """Анализ канала через GET с поддержкой If-None-Match.
+
+    Если для канала есть свежий отчет и id последнего сообщения не изменился,
+    отвечаем 304 (или сохраненным отчетом) без загрузки истории и агрегации.
+    """
+    try:
+        channel_identifier, hours_back = parse_analysis_params(request.args)
+        
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+        
+        cached = get_remembered_report(channel_identifier, hours_back)
+        if cached:
+            # Дешевая проверка: один запрос последнего сообщения
+            try:
+                latest_id = run_async(analytics.get_latest_message_id(channel_identifier))
+            except Exception as e:
+                logger.warning(f"Не удалось проверить последнее сообщение канала: {str(e)}")
+                latest_id = None
+            
+            if latest_id is not None and latest_id == cached['newest_message_id']:
+                etag = matching_report_etag(cached['version'])
+                if etag:
+                    return not_modified_response(etag)
+                return versioned_response(cached['report'])
+        
+        # Канал изменился или отчета нет - полный анализ
+        with admission_slot('analyze'):
+            result = run_async(analytics.analyze_channel(channel_identifier, hours_back))
+        
+        if 'error' not in result:
+            schedule_report_charts(result)
+            remember_report(channel_identifier, hours_back, result)
+            etag = matching_report_etag(result['version'])
+            if etag:
+                return not_modified_response(etag)
+        
+        return versioned_response(result)
+        
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении анализа: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# =============================================
+# ФОНОВЫЕ ЗАДАЧИ АНАЛИЗА
+# =============================================
+JOB_TTL = int(os.getenv('JOB_TTL', 900))  # Сколько секунд хранить завершенные задачи
+JOB_MAX_COUNT = int(os.getenv('JOB_MAX_COUNT', 100))  # Максимум задач в таблице
+JOB_MAX_WAIT = 30  # Максимальное время long-poll ожидания в секундах
+JOB_SHARED_POLL_INTERVAL = 0.25  # Шаг опроса общего хранилища при long-poll задачи другого воркера
+
+class AnalysisJobs:
+    """Ограниченная таблица фоновых задач анализа с TTL и дедупликацией по (канал, период)"""
+    def __init__(self, max_jobs=JOB_MAX_COUNT, ttl=JOB_TTL):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.jobs = OrderedDict()
+        self.keys = {}
+        self.on_finish = {}  # id задачи -> функция, вызываемая по ее завершении (освобождение слота допуска)
+        self.condition = threading.Condition()
+
+    def _job_key(self, channel_identifier, hours_back):
+        return (str(channel_identifier).strip().lstrip('@').lower(), hours_back)
+
+    def _is_finished(self, job):
+        return job['status'] in ('done', 'error')
+
+    def _cleanup(self):
+        """Удаление устаревших задач и освобождение места под новые"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if self._is_finished(job) and now - job['finished_at'] > self.ttl:
+                self._remove(job_id)
+
+        # Таблица переполнена - вытесняем самые старые завершенные задачи
+        for job_id, job in list(self.jobs.items()):
+            if len(self.jobs) < self.max_jobs:
+                break
+            if self._is_finished(job):
+                self._remove(job_id)
+
+    def _remove(self, job_id):
+        job = self.jobs.pop(job_id, None)
+        if job and self.keys.get(job['key']) == job_id:
+            del self.keys[job['key']]
+
+    def find(self, channel_identifier, hours_back):
+        """Существующая задача для того же канала и периода или None"""
+        with self.condition:
+            self._cleanup()
+            return self.jobs.get(self.keys.get(self._job_key(channel_identifier, hours_back)))
+
+    def submit(self, channel_identifier, hours_back, on_finish=None):
+        """Создание задачи или возврат уже существующей для того же канала и периода.
+
+        on_finish вызывается по завершении созданной задачи; если задача не создана, не вызывается.
+        """
+        key = self._job_key(channel_identifier, hours_back)
+        with self.condition:
+            self._cleanup()
+
+            job_id = self.keys.get(key)
+            if job_id in self.jobs:
+                return self.jobs[job_id], False
+
+            if len(self.jobs) >= self.max_jobs:
+                return None, False
+
+            now = time.time()
+            job = {
+                'id': uuid.uuid4().hex,
+                'key': key,
+                'channel': channel_identifier,
+                'hours_back': hours_back,
+                'status': 'queued',
+                'progress': {'stage': 'queued', 'messages_fetched': 0},
+                'result': None,
+                'version': 0,
+                'created_at': now,
+                'updated_at': now,
+                'finished_at': None
+            }
+            self.jobs[job['id']] = job
+            self.keys[key] = job['id']
+            if on_finish is not None:
+                self.on_finish[job['id']] = on_finish
+            self._share(job)
+
+        # Задача переживает запрос: у нее своя трасса
+        asyncio.run_coroutine_threadsafe(tracer.detach(self._run(job['id']), 'analysis_job', job_id=job['id']),
+                                         get_background_loop())
+        return job, True
+
+    def update(self, job_id, **fields):
+        """Обновление задачи с пробуждением ожидающих long-poll запросов"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields)
+            job['version'] += 1
+            job['updated_at'] = time.time()
+            if self._is_finished(job):
+                job['finished_at'] = job['updated_at']
+            self._share(job)
+            self.condition.notify_all()
+
+    def _share(self, job):
+        """Копия задачи в общем хранилище: ее статус отдают и воркеры без Telegram клиента"""
+        try:
+            shared_store.set_json(f"job:{job['id']}", self.serialize(job), self.ttl + JOB_MAX_WAIT)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить задачу {job['id']} в общее хранилище: {str(e)}")
+
+    async def _run(self, job_id):
+        """Выполнение анализа в общем event loop"""
+        try:
+            await self._analyze(job_id)
+        finally:
+            on_finish = self.on_finish.pop(job_id, None)
+            if on_finish:
+                on_finish()
+
+    async def _analyze(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job:
+            return
+
+        def on_progress(stage, **details):
+            self.update(job_id, status='running', progress={'stage': stage, 'messages_fetched': details.get('messages_fetched', 0)})
+
+        try:
+            self.update(job_id, status='running', progress={'stage': 'started', 'messages_fetched': 0})
+            result = await analytics.analyze_channel(job['channel'], job['hours_back'], progress_callback=on_progress)
+            if 'error' in result:
+                self.update(job_id, status='error', result=result, progress=dict(job['progress'], stage='failed'))
+            else:
+                schedule_report_charts(result)
+                remember_report(job['channel'], job['hours_back'], result)
+                self.update(job_id, status='done', result=result, progress=dict(job['progress'], stage='done'))
+        except Exception as e:
+            logger.error(f"Ошибка фоновой задачи анализа {job_id}: {str(e)}", exc_info=True)
+            self.update(job_id, status='error', result={'error': f'Ошибка анализа: {str(e)}'})
+
+    def get(self, job_id, wait=0, since_version=None):
+        """Получение задачи; с wait ждет изменения версии или завершения (long-poll)"""
+        deadline = time.time() + wait
+        if job_id not in self.jobs:
+            return self._get_shared(job_id, deadline, since_version)
+        with self.condition:
+            while True:
+                job = self.jobs.get(job_id)
+                if not job:
+                    return None
+                changed = since_version is not None and job['version'] > since_version
+                remaining = deadline - time.time()
+                if self._is_finished(job) or changed or remaining <= 0:
+                    return self.serialize(job)
+                self.condition.wait(remaining)
+
+    def _get_shared(self, job_id, deadline, since_version):
+        """Задача другого воркера из общего хранилища; long-poll - опросом"""
+        while True:
+            data = shared_store.get_json(f"job:{job_id}")
+            if data is None:
+                return None
+            changed = since_version is not None and data['version'] > since_version
+            if data['status'] in ('done', 'error') or changed or time.time() >= deadline:
+                return data
+            time.sleep(JOB_SHARED_POLL_INTERVAL)
+
+    def serialize(self, job):
+        """Представление задачи для ответа API"""
+        data = {
+            'job_id': job['id'],
+            'status': job['status'],
+            'channel': job['channel'],
+            'hours_back': job['hours_back'],
+            'progress': dict(job['progress']),
+            'version': job['version'],
+            'created_at': datetime.fromtimestamp(job['created_at']).isoformat()
+        }
+        if self._is_finished(job):
+            data['result'] = job['result']
+        return data
+
+analysis_jobs = AnalysisJobs()
+
+@app.route('/jobs/analyze', methods=['POST'])
+@telegram_route
+def submit_analysis_job():
+    """Запуск анализа в фоне: возвращает id задачи (202).
+
+    Задача занимает слот допуска анализа; если свободного слота нет, сразу 429/503 с Retry-After.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        channel_identifier, hours_back = parse_analysis_params(data)
+
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+
+        # Задача занимает слот анализа до своего завершения, но запрос не ждет в очереди допуска
+        job, created = analysis_jobs.find(channel_identifier, hours_back), False
+        if job is None:
+            release = admission_hold('analyze')
+            job, created = analysis_jobs.submit(channel_identifier, hours_back, on_finish=release)
+            if not created:
+                release()
+        if job is None:
+            return jsonify({'error': 'Слишком много задач анализа, попробуйте позже'}), 503
+
+        status_url = f"/jobs/{job['id']}"
+        response = jsonify({
+            'job_id': job['id'],
+            'status': job['status'],
+            'deduplicated': not created,
+            'status_url': status_url
+        })
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Ошибка создания задачи анализа: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    """Статус задачи анализа; ?wait=N включает long-poll до N секунд, ?since=версия - ждать изменений"""
+    try:
+        try:
+            wait = min(max(float(request.args.get('wait', 0)), 0), JOB_MAX_WAIT)
+        except ValueError:
+            wait = 0
+        since_version = request.args.get('since', type=int)
+
+        job = analysis_jobs.get(job_id, wait=wait, since_version=since_version)
+        if not job:
+            return jsonify({'error': 'Задача не найдена или срок ее хранения истек'}), 404
+
+        return api_response(job)
+
+    except Exception as e:
+        logger.error(f"Ошибка получения задачи анализа: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# =============================================
+# ОТСЛЕЖИВАНИЕ КАНАЛОВ В РЕАЛЬНОМ ВРЕМЕНИ
+# =============================================
+
+TRACK_MAX_CHANNELS = int(os.getenv('TRACK_MAX_CHANNELS', 20))
+TRACK_RETENTION_HOURS = int(os.getenv('TRACK_RETENTION_HOURS', 24 * 31))  # Максимальный период анализа - 30 дней
+TRACK_FALLBACK_POSTS = 30
+TRACK_REFRESH_INTERVAL = int(os.getenv('TRACK_REFRESH_INTERVAL', 300))  # Просмотры и реакции не приходят событиями
+TRACK_REFRESH_HOURS = int(os.getenv('TRACK_REFRESH_HOURS', 72))
+ALBUM_FLUSH_DELAY = float(os.getenv('ALBUM_FLUSH_DELAY', 1.5))  # Части альбома приходят отдельными событиями
+
+class TrackedChannel:
+    """Состояние отслеживаемого канала: посты и собранные из событий альбомы"""
+
+    def __init__(self, entity, channel_info):
+        self.entity = entity
+        self.channel_info = channel_info
+        self.posts = {}  # id поста (первого сообщения альбома) -> обработанный пост
+        self.albums = {}  # grouped_id -> {id сообщения: сообщение}
+        self.album_posts = {}  # grouped_id -> id поста
+        self.pending_albums = {}  # grouped_id -> отложенная сборка альбома
+        self.newest_message_id = 0
+        self.events_processed = 0
+        self.handlers = []
+        self.refresh_task = None
+        self.started_at = time.time()
+        self.updated_at = self.started_at
+
+    def upsert_post(self, post):
+        """Добавление или замена поста"""
+        self.posts[post['id']] = post
+        self.newest_message_id = max(self.newest_message_id, post['id'])
+        self.updated_at = time.time()
+
+    def remove_post(self, post_id):
+        self.posts.pop(post_id, None)
+
+    def prune(self, now):
+        """Удаление постов старше срока хранения (последние посты для fallback сохраняются)"""
+        threshold = now - timedelta(hours=TRACK_RETENTION_HOURS)
+        newest_ids = set(sorted(self.posts, reverse=True)[:TRACK_FALLBACK_POSTS])
+        expired = [post_id for post_id, post in self.posts.items()
+                   if post_id not in newest_ids and post['date'].replace(tzinfo=pytz.UTC) < threshold]
+        for post_id in expired:
+            self.remove_post(post_id)
+        expired_albums = [grouped_id for grouped_id, post_id in self.album_posts.items() if post_id not in self.posts]
+        for grouped_id in expired_albums:
+            self.album_posts.pop(grouped_id, None)
+            self.albums.pop(grouped_id, None)
+
+    def totals(self):
+        """Суммы метрик по всем хранимым постам"""
+        totals = {'posts': len(self.posts), 'views': 0, 'reactions': 0, 'comments': 0, 'forwards': 0}
+        for post in self.posts.values():
+            for field in ('views', 'reactions', 'comments', 'forwards'):
+                totals[field] += post[field]
+        return totals
+
+    def status(self):
+        """Представление состояния для ответа API"""
+        return {
+            'channel_info': self.channel_info,
+            'posts_tracked': len(self.posts),
+            'pending_albums': len(self.pending_albums),
+            'events_processed': self.events_processed,
+            'newest_message_id': self.newest_message_id,
+            'totals': self.totals(),
+            'tracking_since': datetime.fromtimestamp(self.started_at).isoformat(),
+            'updated_at': datetime.fromtimestamp(self.updated_at).isoformat()
+        }
+
+class ChannelTracker:
+    """Push-обновления каналов через события Telethon.
+
+    Новые и отредактированные сообщения обрабатываются по мере поступления,
+    поэтому отчет по отслеживаемому каналу собирается без запросов к Telegram.
+    Все методы выполняются в общем event loop клиента.
+    """
+
+    def __init__(self, analytics):
+        self.analytics = analytics
+        self.channels = {}  # id канала -> TrackedChannel
+        self.aliases = {}  # username / id в разных формах -> id канала
+        self.track_locks = {}  # id канала -> asyncio.Lock начала отслеживания
+        self._client = None
+        analytics.tracker = self
+
+    @staticmethod
+    def _alias(channel_identifier):
+        value = str(channel_identifier).strip().lower()
+        if value.startswith('https://t.me/'):
+            value = value[len('https://t.me/'):]
+        value = value.lstrip('@')
+        if value.startswith('-100'):
+            value = value[4:]
+        return value
+
+    def find(self, channel_identifier):
+        """Отслеживаемый канал по username или ID (без запросов к Telegram)"""
+        channel_id = self.aliases.get(self._alias(channel_identifier))
+        return self.channels.get(channel_id) if channel_id is not None else None
+
+    async def track(self, channel_identifier):
+        """Начало отслеживания: однократная загрузка истории и подписка на события"""
+        tracked = self.find(channel_identifier)
+        if tracked:
+            return tracked.status()
+        if len(self.channels) >= TRACK_MAX_CHANNELS:
+            return {'error': f'Можно отслеживать не более {TRACK_MAX_CHANNELS} каналов'}
+
+        channel_info = await self.analytics.get_channel_info(channel_identifier)
+        if not channel_info or 'error' in channel_info:
+            return {'error': 'Канал не найден или приватный'}
+
+        # Параллельный запрос мог начать отслеживание, пока шли запросы к Telegram
+        lock = self.track_locks.setdefault(channel_info['id'], asyncio.Lock())
+        async with lock:
+            tracked = self.channels.get(channel_info['id'])
+            if tracked:
+                self.aliases[self._alias(channel_identifier)] = channel_info['id']
+                return tracked.status()
+            if len(self.channels) >= TRACK_MAX_CHANNELS:
+                return {'error': f'Можно отслеживать не более {TRACK_MAX_CHANNELS} каналов'}
+            return await self._start_tracking(channel_identifier, channel_info)
+
+    async def _start_tracking(self, channel_identifier, channel_info):
+        """Загрузка истории, подписка на события и фоновое обновление канала"""
+        client = self.analytics.client
+        entity = await client.get_entity(PeerChannel(channel_info['id']))
+        tracked = TrackedChannel(entity, channel_info)
+
+        # Начальное состояние - та же выборка, что и при обычном анализе
+        def on_album(grouped_id, messages):
+            tracked.albums[grouped_id] = {msg.id: msg for msg in messages}
+            tracked.album_posts[grouped_id] = messages[0].id
+
+        posts, _ = await self.analytics.fetch_posts(entity, on_album=on_album)
+        for post in posts:
+            tracked.upsert_post(post)
+        self.analytics.search_index.add_posts(channel_info, posts)
+        tracked.prune(datetime.now(pytz.UTC))
+
+        self.channels[channel_info['id']] = tracked
+        self.aliases[self._alias(channel_info['id'])] = channel_info['id']
+        self.aliases[self._alias(channel_identifier)] = channel_info['id']
+        if channel_info.get('username'):
+            self.aliases[self._alias(channel_info['username'])] = channel_info['id']
+
+        self._subscribe(client, tracked)
+        tracked.refresh_task = asyncio.ensure_future(tracer.detach(self._refresh_loop(tracked)))
+        logger.info(f"Отслеживание канала {channel_info['title']}: загружено постов {len(tracked.posts)}")
+        return tracked.status()
+
+    async def untrack(self, channel_identifier):
+        """Остановка отслеживания канала"""
+        tracked = self.find(channel_identifier)
+        if not tracked:
+            return False
+        self._unsubscribe(tracked)
+        if tracked.refresh_task:
+            tracked.refresh_task.cancel()
+        for handle in tracked.pending_albums.values():
+            handle.cancel()
+        channel_id = tracked.channel_info['id']
+        self.channels.pop(channel_id, None)
+        self.track_locks.pop(channel_id, None)
+        self.aliases = {alias: value for alias, value in self.aliases.items() if value != channel_id}
+        logger.info(f"Отслеживание канала {tracked.channel_info['title']} остановлено")
+        return True
+
+    def attach(self, client):
+        """Перерегистрация обработчиков после переподключения клиента"""
+        if client is self._client:
+            return
+        for tracked in self.channels.values():
+            self._unsubscribe(tracked)
+            self._subscribe(client, tracked)
+        self._client = client
+
+    def _subscribe(self, client, tracked):
+        self._client = client
+
+        async def on_new_message(event):
+            self._handle_message(tracked, event.message)
+
+        async def on_message_edited(event):
+            self._handle_message(tracked, event.message)
+
+        handlers = [
+            (on_new_message, events.NewMessage(chats=tracked.entity)),
+            (on_message_edited, events.MessageEdited(chats=tracked.entity))
+        ]
+        for callback, event in handlers:
+            client.add_event_handler(callback, event)
+        tracked.handlers = [(client, callback) for callback, _ in handlers]
+
+    def _unsubscribe(self, tracked):
+        for client, callback in tracked.handlers:
+            client.remove_event_handler(callback)
+        tracked.handlers = []
+
+    def _handle_message(self, tracked, msg):
+        """Обработка нового или отредактированного сообщения"""
+        if not msg or not msg.date:
+            return
+        tracked.events_processed += 1
+
+        if not msg.grouped_id:
+            self._store(tracked, self.analytics._process_single_message(msg))
+            return
+
+        # Части альбома приходят отдельными событиями: копим и собираем пост после паузы
+        tracked.albums.setdefault(msg.grouped_id, {})[msg.id] = msg
+        handle = tracked.pending_albums.pop(msg.grouped_id, None)
+        if handle:
+            handle.cancel()
+        loop = asyncio.get_running_loop()
+        tracked.pending_albums[msg.grouped_id] = loop.call_later(
+            ALBUM_FLUSH_DELAY, self._flush_album, tracked, msg.grouped_id
+        )
+
+    def _flush_album(self, tracked, grouped_id):
+        """Сборка поста из накопленных частей альбома"""
+        tracked.pending_albums.pop(grouped_id, None)
+        messages = tracked.albums.get(grouped_id)
+        if not messages:
+            return
+        post = self.analytics._process_message_group(list(messages.values()))
+        previous_id = tracked.album_posts.get(grouped_id)
+        if previous_id is not None and previous_id != post['id']:
+            tracked.remove_post(previous_id)
+            self.analytics.search_index.remove_post(tracked.channel_info['id'], previous_id)
+        tracked.album_posts[grouped_id] = post['id']
+        self._store(tracked, post)
+
+    def _store(self, tracked, post):
+        """Сохранение поста в состоянии канала и в поисковом индексе"""
+        tracked.upsert_post(post)
+        self.analytics.search_index.add_posts(tracked.channel_info, [post])
+
+    def _store_refreshed(self, tracked, messages):
+        """Обновление метрик хранимых постов по результатам периодического опроса.
+
+        Опрос - не событие канала: счетчик событий не растет, а ожидающая
+        сборка альбома не откладывается - она сама возьмет обновленные части.
+        """
+        refreshed_albums = set()
+        for msg in messages:
+            if not msg or not msg.date:
+                continue
+            if not msg.grouped_id:
+                self._store(tracked, self.analytics._process_single_message(msg))
+                continue
+            tracked.albums.setdefault(msg.grouped_id, {})[msg.id] = msg
+            if msg.grouped_id not in tracked.pending_albums:
+                refreshed_albums.add(msg.grouped_id)
+        for grouped_id in refreshed_albums:
+            self._flush_album(tracked, grouped_id)
+
+    async def _refresh_loop(self, tracked):
+        """Периодическое обновление просмотров и реакций свежих постов.
+
+        Счетчики просмотров Telegram не присылает событиями, поэтому они
+        обновляются в фоне пакетами, а не во время запроса отчета.
+        """
+        while True:
+            await asyncio.sleep(TRACK_REFRESH_INTERVAL)
+            try:
+                now = datetime.now(pytz.UTC)
+                threshold = now - timedelta(hours=TRACK_REFRESH_HOURS)
+                album_ids = {post_id: list(tracked.albums.get(grouped_id, ()))
+                             for grouped_id, post_id in tracked.album_posts.items()}
+                recent_ids = []
+                for post in tracked.posts.values():
+                    if post['date'].replace(tzinfo=pytz.UTC) >= threshold:
+                        recent_ids.extend(album_ids.get(post['id']) or [post['id']])
+
+                for i in range(0, len(recent_ids), 100):
+                    messages = await self.analytics.client.get_messages(tracked.entity, ids=recent_ids[i:i + 100])
+                    self._store_refreshed(tracked, messages)
+
+                channel_info = await self.analytics.get_channel_info(tracked.channel_info['id'])
+                if channel_info and 'error' not in channel_info:
+                    tracked.channel_info = channel_info
+                tracked.prune(now)
+            except asyncio.CancelledError:
+                raise
+            except FloodWaitError as e:
+                record_flood_wait(e, 'track_refresh')
+                logger.warning(f"Обновление отслеживаемого канала отложено: flood wait {e.seconds} секунд")
+                await asyncio.sleep(e.seconds)
+            except Exception as e:
+                logger.error(f"Ошибка обновления отслеживаемого канала: {str(e)}", exc_info=True)
+
+    async def build_report(self, tracked, hours_back):
+        """Отчет по накопленным постам: та же агрегация, что и в analyze_channel, без RPC"""
+        moscow_tz = self.analytics.moscow_tz
+        end_time = datetime.now(moscow_tz)
+        start_time = end_time - timedelta(hours=hours_back)
+        actual_period_text = self.analytics.get_period_text(hours_back)
+
+        posts = sorted(tracked.posts.values(), key=lambda post: post['id'], reverse=True)
+        last_message_date = max((post['date'].replace(tzinfo=pytz.UTC).astimezone(moscow_tz) for post in posts), default=None)
+
+        used_fallback = False
+        fallback_reason = None
+        if last_message_date:
+            days_since_last_post = (end_time - last_message_date).days
+            if days_since_last_post > 30:
+                used_fallback = True
+                fallback_reason = f"Последний пост был {days_since_last_post} дней назад"
+
+        if used_fallback:
+            processed_posts = posts[:TRACK_FALLBACK_POSTS]
+            actual_period_text = f"последние {TRACK_FALLBACK_POSTS} постов"
+        else:
+            processed_posts = [
+                post for post in posts
+                if start_time <= post['date'].replace(tzinfo=pytz.UTC).astimezone(moscow_tz) <= end_time
+            ]
+
+        if not processed_posts:
+            return self.analytics._with_version({
+                'channel_info': tracked.channel_info,
+                'analysis_period': {
+                    'hours_back': hours_back,
+                    'start_time': start_time.strftime('%d.%m.%Y %H:%M'),
+                    'end_time': end_time.strftime('%d.%m.%Y %H:%M'),
+                    'actual_period': actual_period_text,
+                    'used_fallback': used_fallback
+                },
+                'total_posts': 0,
+                'message': 'Нет постов за указанный период' if not used_fallback else 'Нет постов для анализа',
+                'last_message_date': last_message_date.strftime('%Y-%m-%d %H:%M') if last_message_date else 'Неизвестно'
+            }, tracked.newest_message_id)
+
+        groups_processed = sum(1 for post in processed_posts if post['is_group'])
+        analysis_period = {
+            'hours_back': hours_back,
+            'start_time': start_time.strftime('%d.%m.%Y %H:%M') if not used_fallback else None,
+            'end_time': end_time.strftime('%d.%m.%Y %H:%M') if not used_fallback else None,
+            'actual_period': actual_period_text,
+            'used_fallback': used_fallback,
+            'fallback_reason': fallback_reason
+        }
+        report = self.analytics.build_report(
+            tracked.channel_info, processed_posts, analysis_period, last_message_date,
+            groups_processed, len(processed_posts) - groups_processed
+        )
+        await self.analytics.add_topics(report, processed_posts)
+        report['realtime'] = True
+        return self.analytics._with_version(report, tracked.newest_message_id)
+
+channel_tracker = ChannelTracker(analytics)
+
+@app.route('/track', methods=['POST'])
+@telegram_route
+def track_channel():
+    """Включение push-обновлений канала: отчеты по нему не требуют запросов к Telegram"""
+    try:
+        data = request.get_json(silent=True) or {}
+        channel_identifier, _ = parse_analysis_params(data)
+
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+
+        result = run_async(channel_tracker.track(channel_identifier))
+        if 'error' in result:
+            return jsonify(result), 400
+
+        return api_response(result)
+
+    except Exception as e:
+        logger.error(f"Ошибка включения отслеживания канала: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/track', methods=['GET'])
+@telegram_route
+def list_tracked_channels():
+    """Список отслеживаемых каналов"""
+    return api_response({'channels': [tracked.status() for tracked in list(channel_tracker.channels.values())]})
+
+@app.route('/track', methods=['DELETE'])
+@telegram_route
+def untrack_channel():
+    """Отключение push-обновлений канала"""
+    try:
+        data = request.get_json(silent=True) or request.args
+        channel_identifier, _ = parse_analysis_params(data)
+
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+
+        if not run_async(channel_tracker.untrack(channel_identifier)):
+            return jsonify({'error': 'Канал не отслеживается'}), 404
+
+        return jsonify({'status': 'untracked'})
+
+    except Exception as e:
+        logger.error(f"Ошибка отключения отслеживания канала: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# =============================================
+# ПОЛНАЯ ИСТОРИЯ КАНАЛОВ (BACKFILL)
+# =============================================
+HISTORY_DB = os.getenv('HISTORY_DB', 'history.db')  # Локальный архив постов (SQLite)
+BACKFILL_RPC_PER_MINUTE = int(os.getenv('BACKFILL_RPC_PER_MINUTE', 30))  # Общий бюджет запросов всех обходов
+BACKFILL_PAGE_SIZE = 100  # Сообщений за один запрос GetHistory
+BACKFILL_ACTIVE_STATUSES = ('queued', 'running', 'waiting')
+
+class ChannelBackfill:
+    """Обход всей истории каналов в фоне с сохранением в локальный архив.
+
+    История читается страницами по убыванию id; после каждой страницы посты
+    и курсор сохраняются одной транзакцией, поэтому обход продолжается после
+    перезапуска или FloodWait с последней сохраненной страницы. Запросы идут
+    не чаще BACKFILL_RPC_PER_MINUTE и не мешают интерактивным запросам.
+    Повторный запуск для пройденного канала дочитывает новые посты сверху.
+    Все методы, кроме чтения состояния, выполняются в общем event loop.
+    """
+
+    def __init__(self, analytics, store, budget):
+        self.analytics = analytics
+        self.store = store
+        self.budget = budget
+        self.tasks = {}  # id канала -> asyncio.Task
+        analytics.backfill = self
+
+    def status(self, channel_identifier):
+        """Состояние обхода канала по username или ID (без запросов к Telegram)"""
+        value = ChannelTracker._alias(channel_identifier)
+        for state in self.store.states():
+            if str(state['channel_id']) == value or (state.get('username') or '').lower() == value:
+                return state
+        return None
+
+    async def start(self, channel_identifier):
+        """Запуск или продолжение обхода канала; возвращает состояние"""
+        channel_info = await self.analytics.get_channel_info(channel_identifier)
+        if not channel_info or 'error' in channel_info:
+            return {'error': 'Канал не найден или приватный'}
+
+        channel_id = channel_info['id']
+        state = self.store.get_state(channel_id) or {
+            'channel_id': channel_id,
+            'cursor': 0,  # Следующая страница старой истории: сообщения с id меньше курсора
+            'tail_done': False,  # Дошли до первого сообщения канала
+            'head_cursor': 0,  # Дочитывание новых постов сверху до newest_id
+            'newest_id': None,
+            'messages': 0,
+            'posts': 0,
+            'rpc_calls': 0,
+            'flood_waits': 0,
+            'created_at': time.time(),
+            'completed_at': None
+        }
+        state.update(identifier=channel_identifier, username=channel_info.get('username'), title=channel_info['title'])
+        if channel_id in self.tasks and not self.tasks[channel_id].done():
+            return state
+
+        # Новые посты дочитываются сверху до уже сохраненных, старая история - с курсора
+        if state.get('head_floor') is None and state['newest_id'] is not None:
+            state['head_floor'] = state['newest_id']
+            state['head_cursor'] = 0
+        state.update(status='queued', last_error=None, wait_until=None, updated_at=time.time())
+        self.store.save_state(channel_id, state)
+        self._spawn(state)
+        return state
+
+    async def resume(self):
+        """Продолжение обходов, прерванных перезапуском"""
+        for state in self.store.states():
+            if state['status'] in BACKFILL_ACTIVE_STATUSES and state['channel_id'] not in self.tasks:
+                logger.info(f"Продолжение обхода истории {state['title']} с id {state['cursor'] or 'начала'}")
+                self._spawn(state)
+
+    async def pause(self, channel_identifier):
+        """Остановка обхода; продолжается повторным start"""
+        state = self.status(channel_identifier)
+        if not state:
+            return None
+        task = self.tasks.pop(state['channel_id'], None)
+        if task:
+            task.cancel()
+        state = self.store.get_state(state['channel_id'])
+        if state['status'] in BACKFILL_ACTIVE_STATUSES:
+            state.update(status='paused', updated_at=time.time())
+            self.store.save_state(state['channel_id'], state)
+        return state
+
+    def _spawn(self, state):
+        self.tasks[state['channel_id']] = asyncio.ensure_future(tracer.detach(self._run(state)))
+
+    async def _rpc(self, state):
+        """Ожидание бюджета перед запросом к Telegram"""
+        await self.budget.acquire()
+        state['rpc_calls'] += 1
+
+    async def _run(self, state):
+        channel_id = state['channel_id']
+        try:
+            while True:
+                wait_until = state.get('wait_until')
+                if wait_until and wait_until > time.time():
+                    await asyncio.sleep(wait_until - time.time())
+                try:
+                    if not await self.analytics.ensure_client():
+                        raise RuntimeError('Не удалось подключиться к Telegram')
+                    await self._rpc(state)
+                    entity = await self.analytics.resolve_channel(state['identifier'])
+                    state.update(status='running', wait_until=None, updated_at=time.time())
+                    if state.get('head_floor') is not None:
+                        await self._walk(entity, state, head=True)
+                    if not state['tail_done']:
+                        await self._walk(entity, state, head=False)
+                    break
+                except FloodWaitError as e:
+                    # Курсор уже сохранен: ждем и продолжаем с той же страницы
+                    record_flood_wait(e, 'backfill')
+                    logger.warning(f"Flood wait при обходе истории {state['title']}: {e.seconds} секунд")
+                    state['flood_waits'] += 1
+                    state.update(status='waiting', wait_until=time.time() + e.seconds + 1, updated_at=time.time())
+                    self.store.save_state(channel_id, state)
+
+            state.update(status='done', completed_at=time.time(), updated_at=time.time())
+            self.store.save_state(channel_id, state)
+            logger.info(f"Обход истории {state['title']} завершен: {state['posts']} постов, {state['rpc_calls']} запросов")
+        except asyncio.CancelledError:
+            raise  # Пауза или остановка приложения - состояние сохранено после последней страницы
+        except Exception as e:
+            logger.error(f"Ошибка обхода истории {state.get('title')}: {str(e)}", exc_info=True)
+            state.update(status='error', last_error=str(e), updated_at=time.time())
+            self.store.save_state(channel_id, state)
+        finally:
+            if self.tasks.get(channel_id) is asyncio.current_task():
+                del self.tasks[channel_id]
+
+    async def _walk(self, entity, state, head):
+        """Чтение страниц по убыванию id: старой истории (от cursor) или новых постов (до head_floor)"""
+        cursor_key = 'head_cursor' if head else 'cursor'
+        min_id = state['head_floor'] if head else 0
+        offset_id = state[cursor_key]
+        assembler = AlbumAssembler(self.analytics)
+        with tracer.span('backfill.walk', channel=state['channel_id'], head=head):
+            while True:
+                await self._rpc(state)
+                with STAGE_DURATION.time(stage='backfill_page'):
+                    messages = await self.analytics.client.get_messages(
+                        entity, limit=BACKFILL_PAGE_SIZE, offset_id=offset_id, min_id=min_id
+                    )
+                messages = [msg for msg in messages if msg is not None]
+                MESSAGES_FETCHED.inc(len(messages))
+
+                posts = []
+                for msg in messages:
+                    if msg.date:
+                        posts.extend(assembler.feed(msg))
+                if messages:
+                    state['newest_id'] = max(state['newest_id'] or 0, messages[0].id)
+                    offset_id = messages[-1].id
+                    # В сохраненном курсоре незакрытый альбом не пройден: после перезапуска он читается заново
+                    state[cursor_key] = assembler.messages[0].id + 1 if assembler.grouped_id is not None else offset_id
+                finished = len(messages) < BACKFILL_PAGE_SIZE
+                if finished:
+                    posts.extend(assembler.close())
+                    if head:
+                        state['head_floor'] = None
+                    else:
+                        state['tail_done'] = True
+
+                state['messages'] += len(messages)
+                state['posts'] += len(posts)
+                state['updated_at'] = time.time()
+                self.store.save_page(state['channel_id'], posts, state)
+                if finished:
+                    return
+
+    async def load_posts(self, channel_id, before_id, since):
+        """Посты архива старше before_id за период (чтение SQLite - в пуле потоков)"""
+        if not self.store.get_state(channel_id):
+            return []
+        def loader():
+            return list(self.store.iter_posts(channel_id, before_id=before_id, since=since))
+        return await asyncio.get_running_loop().run_in_executor(None, tracer.wrap(loader))
+
+message_store = MessageStore(HISTORY_DB)
+channel_backfill = ChannelBackfill(analytics, message_store, RpcBudget(BACKFILL_RPC_PER_MINUTE))
+
+def backfill_status_json(state):
+    """Состояние обхода для ответа API с данными архива"""
+    count, oldest, newest = message_store.stats(state['channel_id'])
+    return {
+        **{key: value for key, value in state.items() if key not in ('head_cursor', 'head_floor')},
+        'stored_posts': count,
+        'oldest_post': oldest.astimezone(analytics.moscow_tz).strftime('%Y-%m-%d %H:%M') if oldest else None,
+        'newest_post': newest.astimezone(analytics.moscow_tz).strftime('%Y-%m-%d %H:%M') if newest else None
+    }
+
+@app.route('/backfill', methods=['POST'])
+@telegram_route
+def start_backfill():
+    """Запуск (или продолжение) обхода всей истории канала в фоне"""
+    try:
+        data = request.get_json(silent=True) or {}
+        channel_identifier, _ = parse_analysis_params(data)
+
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+
+        result = run_async(channel_backfill.start(channel_identifier))
+        if 'error' in result:
+            return jsonify(result), 400
+
+        return api_response(backfill_status_json(result), status=202)
+
+    except Exception as e:
+        logger.error(f"Ошибка запуска обхода истории: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/backfill', methods=['GET'])
+@telegram_route
+def get_backfill_status():
+    """Состояние обхода канала (channel_username) или всех обходов"""
+    channel_identifier = request.args.get('channel_username') or request.args.get('channel_id')
+    if not channel_identifier:
+        return api_response({'channels': [backfill_status_json(state) for state in message_store.states()]})
+    state = channel_backfill.status(channel_identifier)
+    if not state:
+        return jsonify({'error': 'Обход истории канала не запускался'}), 404
+    return api_response(backfill_status_json(state))
+
+@app.route('/backfill', methods=['DELETE'])
+@telegram_route
+def pause_backfill():
+    """Остановка обхода истории; архив сохраняется, продолжение - повторным POST"""
+    try:
+        data = request.get_json(silent=True) or request.args
+        channel_identifier, _ = parse_analysis_params(data)
+
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+
+        state = run_async(channel_backfill.pause(channel_identifier))
+        if not state:
+            return jsonify({'error': 'Обход истории канала не запускался'}), 404
+
+        return api_response(backfill_status_json(state))
+
+    except Exception as e:
+        logger.error(f"Ошибка остановки обхода истории: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# Колонка section в ai_reports (migrations/ai_reports_section.sql): None - еще не проверялась,
+# False - миграция не применена, цельные отчеты ищутся без фильтра по разделам
+ai_section_column = None
+
+def section_column_missing(response):
+    """Ответ PostgREST на фильтр по несуществующей колонке section"""
+    return response.status_code == 400 and '42703' in response.text and 'section' in response.text
+
+def fetch_cached_ai_report(channel_id, hours_back):
+    """Запрос последнего цельного ИИ отчета из Supabase; строки разделов не учитываются"""
+    global ai_section_column
+    url = f"{SUPABASE_URL}/rest/v1/ai_reports?channel_id=eq.{channel_id}&hours_back=eq.{hours_back}&order=created_at.desc&limit=1"
+    if ai_section_column is not False:
+        response = requests.get(f"{url}&section=is.null", headers=SUPABASE_HEADERS, timeout=5)
+        if not section_column_missing(response):
+            if response.status_code == 200:
+                ai_section_column = True
+            return response
+        ai_section_column = False
+        logger.warning("В таблице ai_reports нет колонки section: примените migrations/ai_reports_section.sql, "
+                       "до этого кэш разделов ИИ не работает")
+    return requests.get(url, headers=SUPABASE_HEADERS, timeout=5)
+
+def fetch_cached_ai_sections(channel_id, hours_back, sections):
+    """Свежие разделы ИИ отчета из Supabase: {ключ раздела: текст}"""
+    keys = [section[0] for section in sections]
+    ttls = {section[0]: section[3] for section in sections}
+    with SUPABASE_DURATION.time(operation='cache_get'), tracer.span('supabase.cache_get', SPAN_KIND_CLIENT):
+        response = requests.get(
+            f"{SUPABASE_URL}/rest/v1/ai_reports?channel_id=eq.{channel_id}&hours_back=eq.{hours_back}"
+            f"&section=in.({','.join(keys)})&order=created_at.desc&limit={len(keys) * 5}",
+            headers=SUPABASE_HEADERS,
+            timeout=5
+        )
+    if response.status_code != 200:
+        logger.warning(f"Supabase section cache check failed: {response.status_code} - {response.text[:200]}")
+        return {}
+    
+    now_utc = datetime.now(pytz.UTC)
+    cached = {}
+    for row in response.json():
+        key = row['section']
+        if key in cached:
+            continue  # Строки отсортированы по убыванию даты - первая самая свежая
+        created_at = datetime.fromisoformat(row['created_at'].replace('Z', '+00:00'))
+        if (now_utc - created_at).total_seconds() < ttls[key]:
+            cached[key] = row['report_data']
+    return cached
+
+def save_ai_sections(channel_id, hours_back, contents):
+    """Сохранение сгенерированных разделов в Supabase одним запросом"""
+    with SUPABASE_DURATION.time(operation='cache_save'), tracer.span('supabase.cache_save', SPAN_KIND_CLIENT):
+        response = requests.post(
+            f"{SUPABASE_URL}/rest/v1/ai_reports",
+            headers=SUPABASE_HEADERS,
+            json=[{
+                'channel_id': channel_id,
+                'report_data': content,
+                'hours_back': hours_back,
+                'section': key
+            } for key, content in contents.items()],
+            timeout=10
+        )
+    if response.status_code not in (200, 201):
+        logger.warning(f"Supabase section save error: {response.status_code} - {response.text[:200]}")
+
+def parse_refresh_sections(value):
+    """Множество известных ключей разделов из параметра refresh (строка или список); None - неверный тип"""
+    if not value:
+        return set()
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        return None
+    known = {section[0] for section in AI_SECTIONS}
+    return {key for key in value if isinstance(key, str) and key in known}
+
+def generate_sectioned_ai_report(report_data, refresh=()):
+    """ИИ отчет по разделам: свежие разделы из кэша, остальные генерируются параллельно.
+
+    refresh - ключи разделов, которые нужно перегенерировать независимо от кэша.
+    """
+    channel_id = report_data['channel_info']['id']
+    hours_back = report_data['analysis_period']['hours_back']
+    sections = analytics.ai_sections(report_data)
+    
+    try:
+        cached = fetch_cached_ai_sections(channel_id, hours_back, sections)
     except Exception as e:
-        logger.error(f"Ошибка при выполнении анализа: {str(e)}", exc_info=True)
-        return jsonify({'error': str(e)}), 500
+        SUPABASE_CACHE.inc(kind='section', result='error')
+        logger.warning(f"Не удалось проверить кэш разделов Supabase: {str(e)}")
+        cached = {}
+    cached = {key: content for key, content in cached.items() if key not in refresh}
+    
+    missing = [section[0] for section in sections if section[0] not in cached]
+    SUPABASE_CACHE.inc(len(sections) - len(missing), kind='section', result='hit')
+    SUPABASE_CACHE.inc(len(missing), kind='section', result='miss')
+    generated = {}
+    if missing:
+        logger.info(f"Генерация разделов ИИ: {', '.join(missing)} (из кэша: {len(cached)})")
+        with admission_slot('ai_analyze'):
+            generated = run_async(analytics.generate_ai_sections(report_data, missing))
+        if generated:
+            try:
+                save_ai_sections(channel_id, hours_back, generated)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить разделы в БД: {str(e)}")
+    
+    contents = dict(cached, **generated)
+    ai_report = '\n\n'.join(contents[section[0]] for section in sections if section[0] in contents)
+    failed = [key for key in missing if key not in generated]
+    if failed:
+        ai_report += f"\n\n⚠️ Не удалось сгенерировать разделы: {', '.join(failed)}. Повторите запрос позже."
+    
+    return {
+        'ai_report': ai_report,
+        'sections': {
+            'cached': [key for key in cached if key in contents],
+            'generated': list(generated),
+            'failed': failed
+        }
+    }
 
 @app.route('/ai_analyze', methods=['POST'])
 def ai_analyze():
@@ -1135,14 +3427,18 @@ def ai_analyze():
         
         channel_id = report_data['channel_info']['id']
         
+        # Режим по разделам: параллельная генерация и кэш каждого раздела отдельно
+        if data.get('mode', AI_REPORT_MODE) == 'sections':
+            refresh = parse_refresh_sections(data.get('refresh'))
+            if refresh is None:
+                return jsonify({'error': 'refresh должен быть списком ключей разделов'}), 400
+            return api_response(generate_sectioned_ai_report(report_data, refresh))
+        
         # Проверяем кэш в Supabase с учетом периода анализа
         try:
             logger.info(f"Проверка кэша в Supabase для channel_id: {channel_id}, период: {hours_back} часов")
-            response = requests.get(
-                f"{SUPABASE_URL}/rest/v1/ai_reports?channel_id=eq.{channel_id}&hours_back=eq.{hours_back}&order=created_at.desc&limit=1",
-                headers=SUPABASE_HEADERS,
-                timeout=5
-            )
+            with SUPABASE_DURATION.time(operation='cache_get'), tracer.span('supabase.cache_get', SPAN_KIND_CLIENT):
+                response = fetch_cached_ai_report(channel_id, hours_back)
             
             if response.status_code == 200:
                 cached_data = response.json()
@@ -1155,9 +3451,10 @@ def ai_analyze():
                         now_utc = datetime.now(pytz.UTC)
                         
                         # Проверяем разницу во времени
-                        if (now_utc - created_at).total_seconds() < 3600:
+                        if (now_utc - created_at).total_seconds() < AI_CACHE_TTL:
+                            SUPABASE_CACHE.inc(kind='report', result='hit')
                             logger.info(f"Найден свежий кэш в Supabase (created_at: {created_at})")
-                            return jsonify({
+                            return api_response({
                                 'ai_report': cached_data[0]['report_data'],
                                 'cached': True
                             })
@@ -1165,32 +3462,34 @@ def ai_analyze():
                             logger.info(f"Кэш устарел (разница: {(now_utc - created_at).total_seconds()/60:.1f} минут)")
                     except Exception as e:
                         logger.error(f"Ошибка парсинга даты: {str(e)}")
+                SUPABASE_CACHE.inc(kind='report', result='miss')
             else:
+                SUPABASE_CACHE.inc(kind='report', result='error')
                 logger.warning(f"Supabase cache check failed: {response.status_code} - {response.text[:200]}")
         except Exception as e:
+            SUPABASE_CACHE.inc(kind='report', result='error')
             logger.warning(f"Не удалось проверить кэш Supabase: {str(e)}")
         
-        # Получаем глобальный event loop
-        loop = current_app.config['GLOBAL_EVENT_LOOP']
-        
         # Запускаем ИИ анализ через event loop
         logger.info("Запуск ИИ анализа...")
-        ai_report = loop.run_until_complete(analytics.generate_ai_analysis(report_data))
+        with admission_slot('ai_analyze'):
+            ai_report = run_async(analytics.generate_ai_analysis(report_data))
         logger.info("ИИ анализ завершен")
         
         # Сохраняем в Supabase с указанием периода анализа
         try:
             logger.info("Сохранение результата в Supabase...")
-            response = requests.post(
-                f"{SUPABASE_URL}/rest/v1/ai_reports",
-                headers=SUPABASE_HEADERS,
-                json={
-                    'channel_id': channel_id,
-                    'report_data': ai_report,
-                    'hours_back': hours_back  # Добавляем период анализа
-                },
-                timeout=10
-            )
+            with SUPABASE_DURATION.time(operation='cache_save'), tracer.span('supabase.cache_save', SPAN_KIND_CLIENT):
+                response = requests.post(
+                    f"{SUPABASE_URL}/rest/v1/ai_reports",
+                    headers=SUPABASE_HEADERS,
+                    json={
+                        'channel_id': channel_id,
+                        'report_data': ai_report,
+                        'hours_back': hours_back  # Добавляем период анализа
+                    },
+                    timeout=10
+                )
             
             if response.status_code in (200, 201):
                 logger.info("Результат успешно сохранен в Supabase")
@@ -1199,13 +3498,16 @@ def ai_analyze():
         except Exception as e:
             logger.warning(f"Не удалось сохранить в БД: {str(e)}")
         
-        return jsonify({'ai_report': ai_report})
+        return api_response({'ai_report': ai_report})
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Ошибка ИИ анализа: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/channel_subscribers', methods=['POST'])
+@telegram_route
 def get_channel_subscribers():
     """Получение количества подписчиков"""
     try:
@@ -1215,11 +3517,8 @@ def get_channel_subscribers():
         if not channel_identifier:
             return jsonify({'error': 'Не указан username или ID канала'}), 400
         
-        # Получаем глобальный event loop
-        loop = current_app.config['GLOBAL_EVENT_LOOP']
-        
         # Получаем информацию о канале
-        result = loop.run_until_complete(analytics.get_channel_info(channel_identifier))
+        result = run_async(analytics.get_channel_info(channel_identifier))
         
         if result and 'error' not in result:
             return jsonify({
@@ -1235,53 +3534,48 @@ def get_channel_subscribers():
         logger.error(f"Ошибка в channel_subscribers: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/find_channel', methods=['POST'])
-async def search_channels(query):
-    """Поиск каналов по запросу"""
-    if not analytics.client or not analytics.client.is_connected():
-        await analytics.init_client()
-    
-    results = []
-    
+@app.route('/find_channel', methods=['GET', 'POST'])
+@telegram_route
+def search_channels():
+    """Поиск каналов по названию или username: индекс диалогов, при промахе - поиск Telegram"""
     try:
-        # Попробуем найти канал напрямую по username
+        data = request.get_json(silent=True) or {}
+        query = str(data.get('query') or request.args.get('q') or '').strip()
         try:
-            entity = await analytics.client.get_entity(query)
-            if entity and (isinstance(entity, Channel) or isinstance(entity, ChannelForbidden)):
-                results.append({
-                    'id': entity.id,
-                    'title': entity.title,
-                    'username': getattr(entity, 'username', None),
-                    'is_channel': True
-                })
-                return results
-        except Exception:
-            pass
-        
-        # Если прямой поиск не дал результатов, ищем в диалогах
-        async for dialog in analytics.client.iter_dialogs():
-            if dialog.is_channel:
-                # Проверяем несколько вариантов совпадения
-                title_match = query.lower() in dialog.name.lower()
-                username_match = False
-                
-                # Проверяем username канала
-                if hasattr(dialog.entity, 'username') and dialog.entity.username:
-                    username_match = query.lower() == dialog.entity.username.lower()
-                
-                if title_match or username_match:
-                    results.append({
-                        'id': dialog.entity.id,
-                        'title': dialog.name,
-                        'username': getattr(dialog.entity, 'username', None),
-                        'is_channel': True
-                    })
+            limit = min(max(int(data.get('limit') or request.args.get('limit', 10)), 1), CHANNEL_SEARCH_MAX_RESULTS)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit должен быть целым числом'}), 400
+
+        if not query:
+            return jsonify({'error': 'Не указан поисковый запрос'}), 400
+
+        if analytics.dialog_index.refreshed_at is None:
+            run_async(analytics.ensure_dialog_index(), timeout=DIALOG_INDEX_WAIT + 5)
+
+        started = time.perf_counter()
+        results = analytics.dialog_index.search(query, limit)
+        source = 'index'
+        if not any(result['match'] != 'fuzzy' for result in results):
+            # Промах индекса (нет точных совпадений) - ищем в Telegram, похожие из индекса идут следом
+            found = run_async(analytics.search_telegram_channels(query, limit))
+            if found:
+                found_ids = {result['id'] for result in found}
+                results = (found + [result for result in results if result['id'] not in found_ids])[:limit]
+                source = 'telegram'
+
+        return api_response({
+            'query': query,
+            'results': results,
+            'source': source,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+
     except Exception as e:
         logger.error(f"Ошибка поиска канала: {str(e)}", exc_info=True)
-    
-    return results
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/channel_history', methods=['POST'])
+@telegram_route
 def get_channel_history():
     """Получение истории постов из канала (последние 20-30 текстовых постов)"""
     try:
@@ -1292,385 +3586,673 @@ def get_channel_history():
         if not channel_identifier:
             return jsonify({'error': 'Не указан username или ID канала'}), 400
 
-        # Получаем глобальный event loop
-        loop = current_app.config['GLOBAL_EVENT_LOOP']
-        
         # Запускаем получение истории
-        result = loop.run_until_complete(analytics.get_channel_history(channel_identifier, limit))
+        result = run_async(analytics.get_channel_history(channel_identifier, limit))
         
-        return jsonify(result)
+        return api_response(result)
         
     except Exception as e:
         logger.error(f"Ошибка при получении истории канала: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+def parse_history_date(value, end_of_day=False):
+    """Дата фильтра истории: ISO дата или дата-время (без пояса - московское время) в UTC"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if len(value) == 10 and end_of_day:
+        parsed += timedelta(days=1, microseconds=-1)
+    if parsed.tzinfo is None:
+        parsed = analytics.moscow_tz.localize(parsed)
+    return parsed.astimezone(pytz.UTC)
+
+def history_post_json(post, fields):
+    """Строка NDJSON с выбранными полями поста"""
+    if post.get('date'):
+        post['date'] = post['date'].replace(tzinfo=pytz.UTC).astimezone(analytics.moscow_tz).isoformat()
+    return dumps_json({field: post.get(field) for field in fields}) + b'\n'
+
+@app.route('/channel_history/stream', methods=['GET'])
+@telegram_route
+def stream_channel_history():
+    """Постраничная история канала в NDJSON: курсоры before_id/after_id, фильтры и выбор полей.
+
+    Каждая строка - пост; последняя строка - {"cursor": {...}} с курсором
+    следующей страницы (или {"error": ...}, если чтение прервалось).
+    """
+    try:
+        channel_identifier = request.args.get('channel_username') or request.args.get('channel_id')
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+
+        limit = min(max(request.args.get('limit', HISTORY_STREAM_DEFAULT_LIMIT, type=int), 1), HISTORY_STREAM_MAX_LIMIT)
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
+        if before_id is not None and after_id is not None:
+            return jsonify({'error': 'Укажите только один курсор: before_id или after_id'}), 400
+
+        fields = [field.strip() for field in request.args.get('fields', ','.join(HISTORY_FIELDS)).split(',') if field.strip()]
+        unknown = [field for field in fields if field not in HISTORY_FIELDS]
+        if unknown or not fields:
+            return jsonify({'error': f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(HISTORY_FIELDS)}"}), 400
+
+        content_types = {value.strip() for value in request.args.get('content_type', '').split(',') if value.strip()}
+        try:
+            date_from = parse_history_date(request.args.get('date_from'))
+            date_to = parse_history_date(request.args.get('date_to'), end_of_day=True)
+        except ValueError:
+            return jsonify({'error': 'Даты указываются в формате ISO: 2024-05-01 или 2024-05-01T12:00'}), 400
+
+        if not run_async(analytics.ensure_client(), timeout=30):
+            return jsonify({'error': 'Не удалось подключиться к Telegram'}), 503
+        try:
+            entity = run_async(analytics.resolve_channel(channel_identifier), timeout=30)
+        except ValueError:
+            return jsonify({'error': 'Канал не найден'}), 404
+        except ChannelPrivateError:
+            return jsonify({'error': 'Приватный канал', 'message': 'Требуется подписка на канал'}), 403
+
+        cursor = {}
+        posts = analytics.iter_history(entity, limit, before_id=before_id, after_id=after_id, date_from=date_from,
+                                       date_to=date_to, content_types=content_types, cursor=cursor)
+
+        def generate():
+            try:
+                for post in iter_async(posts, timeout=HISTORY_STREAM_TIMEOUT):
+                    yield history_post_json(post, fields)
+            except Exception as e:
+                logger.error(f"Ошибка потоковой выдачи истории {channel_identifier}: {str(e)}", exc_info=True)
+                yield dumps_json({'error': str(e), 'cursor': cursor}) + b'\n'
+                return
+            next_cursor = {'has_more': cursor['has_more'], 'count': cursor['count'], 'scanned': cursor['scanned']}
+            if cursor['last_id'] is not None:
+                next_cursor['after_id' if after_id is not None else 'before_id'] = cursor['last_id']
+            yield dumps_json({'cursor': next_cursor}) + b'\n'
+
+        response = Response(generate(), mimetype='application/x-ndjson')
+        response.headers['X-Channel-Id'] = str(entity.id)
+        return response
+
+    except Exception as e:
+        logger.error(f"Ошибка потоковой выдачи истории: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export', methods=['GET'])
+@telegram_route
+def export_posts():
+    """Выгрузка метрик постов канала за период в CSV, NDJSON или Parquet потоком.
+
+    В конце файла - итог выгрузки (см. export_formats); при has_more следующая
+    часть запрашивается с before_id из итога.
+    """
+    try:
+        channel_identifier = request.args.get('channel_username') or request.args.get('channel_id')
+        if not channel_identifier:
+            return jsonify({'error': 'Не указан username или ID канала'}), 400
+
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in available_formats():
+            return jsonify({'error': f"Неподдерживаемый формат. Доступны: {', '.join(available_formats())}"}), 400
+
+        try:
+            date_from = parse_history_date(request.args.get('date_from'))
+            date_to = parse_history_date(request.args.get('date_to'), end_of_day=True)
+        except ValueError:
+            return jsonify({'error': 'Даты указываются в формате ISO: 2024-05-01 или 2024-05-01T12:00'}), 400
+        hours_back = request.args.get('hours_back', type=int)
+        if hours_back and not date_from:
+            date_from = datetime.now(pytz.UTC) - timedelta(hours=hours_back)
+        limit = min(max(request.args.get('limit', EXPORT_MAX_POSTS, type=int), 1), EXPORT_MAX_POSTS)
+        before_id = request.args.get('before_id', type=int)  # Продолжение обрезанной выгрузки
+
+        if not run_async(analytics.ensure_client(), timeout=30):
+            return jsonify({'error': 'Не удалось подключиться к Telegram'}), 503
+        try:
+            entity = run_async(analytics.resolve_channel(channel_identifier), timeout=30)
+        except ValueError:
+            return jsonify({'error': 'Канал не найден'}), 404
+        except ChannelPrivateError:
+            return jsonify({'error': 'Приватный канал', 'message': 'Требуется подписка на канал'}), 403
+
+        cursor = {}
+        posts = analytics.iter_history(entity, limit, before_id=before_id, date_from=date_from, date_to=date_to,
+                                       cursor=cursor, max_scan=EXPORT_MAX_SCAN)
+        # Итог для конца файла: обрезана ли выгрузка лимитом и с какого поста продолжать
+        summary = {}
+
+        def rows():
+            exported = 0
+            completed = False
+            started = time.perf_counter()
+            try:
+                for post in iter_async(posts, timeout=HISTORY_STREAM_TIMEOUT):
+                    exported += 1
+                    row = {column: post[column] for column in EXPORT_COLUMNS}
+                    row['date'] = post['date'].replace(tzinfo=pytz.UTC).astimezone(analytics.moscow_tz)
+                    yield row
+                completed = True
+            finally:
+                # Оборванная ошибкой выгрузка тоже продолжается с before_id
+                summary.update(has_more=cursor.get('has_more', False) or not completed, count=exported,
+                               scanned=cursor.get('scanned', 0))
+                if cursor.get('last_id') is not None:
+                    summary['before_id'] = cursor['last_id']
+                logger.info(f"Экспорт {channel_identifier} ({export_format}): {exported} постов за {time.perf_counter() - started:.2f} с"
+                            f"{', обрезан лимитом' if cursor.get('has_more') else ''}")
+
+        def generate():
+            try:
+                yield from EXPORT_WRITERS[export_format](rows(), summary)
+            except Exception as e:
+                # Заголовки уже отправлены: писатель отметил ошибку в конце файла (Parquet остается без footer)
+                logger.error(f"Ошибка выгрузки {channel_identifier}: {str(e)}", exc_info=True)
+
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        filename = f"{getattr(entity, 'username', None) or entity.id}_{datetime.now(analytics.moscow_tz):%Y%m%d_%H%M}.{extension}"
+        response = Response(generate(), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['X-Channel-Id'] = str(entity.id)
+        return response
+
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки постов: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search', methods=['GET'])
+@telegram_route
+def search_posts():
+    """Полнотекстовый поиск по загруженным постам (без запросов к Telegram)"""
+    try:
+        query = request.args.get('q', '').strip()
+        channel_identifier = request.args.get('channel_username') or request.args.get('channel_id')
+        limit = min(max(request.args.get('limit', 20, type=int), 1), SEARCH_MAX_RESULTS)
+        
+        if not query:
+            return jsonify({'error': 'Не указан поисковый запрос'}), 400
+        
+        channel_id = None
+        if channel_identifier:
+            channel_id = analytics.search_index.find_channel_id(channel_identifier)
+            if channel_id is None:
+                return jsonify({'error': 'Канал еще не проиндексирован. Сначала выполните анализ канала'}), 404
+        
+        started = time.perf_counter()
+        total, results = analytics.search_index.search(query, channel_id=channel_id, limit=limit)
+        for result in results:
+            if result['date']:
+                result['date'] = result['date'].replace(tzinfo=pytz.UTC).astimezone(analytics.moscow_tz).strftime('%Y-%m-%d %H:%M')
+        
+        return api_response({
+            'query': query,
+            'total': total,
+            'results': results,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+        
+    except Exception as e:
+        logger.error(f"Ошибка поиска по постам: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/download_pdf', methods=['GET'])
 def download_pdf():
     """Прямое скачивание PDF файла для мобильных устройств"""
     try:
         # Получаем параметры из запроса
         cache_key = request.args.get('key')
-        
+
         if not cache_key:
             logger.error("Не указан ключ доступа для скачивания PDF")
             return jsonify({'error': 'Не указан ключ доступа'}), 400
-        
-        logger.info(f"Запрос на скачивание PDF с ключом: {cache_key}")
-        logger.info(f"Доступные ключи в кэше: {list(pdf_cache.keys())}")
-        
+
+        pdf_logger.info("Запрос на скачивание PDF с ключом: %s", cache_key)
+        pdf_logger.info("Доступные ключи в кэше: %s", list(pdf_cache.keys()))
+
         # Проверяем наличие PDF в кэше
         if cache_key not in pdf_cache:
             logger.error(f"PDF с ключом {cache_key} не найден в кэше")
             return jsonify({'error': 'PDF не найден или срок действия ссылки истек'}), 404
-        
+
         cached_data = pdf_cache[cache_key]
-        
+        cached_data['path'] = ensure_local_pdf(cache_key, cached_data['path'])
+
         # Проверяем не истекло ли время кэша
-        if time.time() - cached_data['timestamp'] > CACHE_EXPIRY:
+        if time.time() - cached_data['timestamp'] > CACHE_EXPIRY or not os.path.exists(cached_data['path']):
             # Удаляем из кэша
-            del pdf_cache[cache_key]
+            remove_cached_pdf(cache_key)
+            PDF_CACHE_EVICTIONS.inc(reason='expired_on_download')
             logger.error(f"Срок действия ключа {cache_key} истек")
             return jsonify({'error': 'Срок действия ссылки истек'}), 404
-        
-        # Возвращаем PDF как файл для скачивания
-        response = make_response(cached_data['pdf_data'])
-        response.headers['Content-Type'] = 'application/pdf'
-        
-        # Безопасное имя файла
+
+        # Отдаем PDF потоком из файла, не загружая его в память
         safe_filename = get_safe_filename(cached_data['filename'])
-        response.headers['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
-        
+        response = send_file(
+            cached_data['path'],
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=safe_filename
+        )
+
         logger.info(f"PDF успешно отправлен: {cached_data['filename']}")
-        
+
         return response
-        
+
     except Exception as e:
         logger.error(f"Ошибка скачивания PDF: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+# =============================================
+# СБОРКА PDF ОТЧЕТА
+# =============================================
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'telegram_analytics_pdf'))
+PDF_STREAM_CHUNK = 3 * 64 * 1024  # Кратно 3, чтобы base64 кодировался по частям без склейки
+PDF_WARMUP = os.getenv('PDF_WARMUP', 'true').lower() == 'true'  # Загружать ReportLab в фоне после старта
+PDF_WARMUP_DELAY = 3  # Секунд после старта до фоновой загрузки ReportLab
+
+def get_pdf_engine():
+    """Модуль сборки PDF: ReportLab и шрифты загружаются при первом обращении"""
+    import pdf_report
+    return pdf_report
+
+def warm_up_pdf_engine(delay=PDF_WARMUP_DELAY):
+    """Фоновая загрузка ReportLab, чтобы первый запрос PDF не ждал импорта"""
+    def warm_up():
+        time.sleep(delay)
+        started = time.time()
+        try:
+            get_pdf_engine()
+            logger.info(f"ReportLab загружен в фоне за {time.time() - started:.2f} с")
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить ReportLab в фоне: {str(e)}")
+
+    threading.Thread(target=warm_up, name='pdf-warmup', daemon=True).start()
+
+def iter_file_chunks(path, chunk_size=PDF_STREAM_CHUNK):
+    """Чтение файла порциями"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def iter_pdf_json_response(path, filename, cache_key):
+    """Потоковая отдача JSON ответа с PDF в base64 без загрузки файла целиком"""
+    yield '{"pdf_base64": "'
+    for chunk in iter_file_chunks(path):
+        yield base64.b64encode(chunk).decode('ascii')
+    yield f'", "filename": {json.dumps(filename)}, "cache_key": {json.dumps(cache_key)}}}'
+
+# =============================================
+# ГРАФИКИ ДЛЯ PDF ОТЧЕТА
+# =============================================
+CHART_CACHE_SIZE = 64  # Сколько отрисованных графиков держим в памяти
+CHART_RENDER_TIMEOUT = 10  # Сколько секунд ждем отрисовку графиков при сборке PDF
+CHART_WIDTH = 520  # Ширина рамки страницы за вычетом отступов
+CHART_HEIGHT = 180
+
+chart_cache = OrderedDict()
+chart_cache_lock = threading.Lock()
+chart_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='pdf-charts')
+
+def extract_chart_specs(report_data):
+    """Подготовка данных для графиков из уже посчитанного отчета"""
+    specs = []
+
+    # Средние просмотры по часам публикации
+    hourly_stats = (report_data.get('time_analysis') or {}).get('hourly_stats') or {}
+    if hourly_stats:
+        values = [0] * 24
+        for hour, stats in hourly_stats.items():
+            # После JSON ключи часов приходят строками
+            if stats.get('count'):
+                values[int(hour) % 24] = round(stats['total_views'] / stats['count'], 1)
+        specs.append(('hourly', 'Средние просмотры по часам публикации (МСК)', {
+            'labels': [str(h) for h in range(24)],
+            'values': values
+        }))
+
+    # Сравнение типов контента по среднему охвату
+    content_stats = report_data.get('content_analysis') or {}
+    content_rows = sorted(
+        ((ctype, stats['total_views'] / stats['count']) for ctype, stats in content_stats.items() if stats.get('count')),
+        key=lambda x: x[1],
+        reverse=True
+    )
+    if content_rows:
+        specs.append(('content', 'Средние просмотры по типам контента', {
+            'labels': [analytics._format_content_type(ctype) for ctype, _ in content_rows],
+            'values': [round(avg, 1) for _, avg in content_rows]
+        }))
+
+    # Топ постов по просмотрам
+    top_posts = report_data.get('top_posts') or []
+    if top_posts:
+        specs.append(('top_posts', 'Топ постов по просмотрам', {
+            'labels': [f"#{i} {post.get('date', '')[:5]}" for i, post in enumerate(top_posts, 1)],
+            'values': [post.get('views', 0) for post in top_posts]
+        }))
+
+    return specs
+
+def _chart_cache_key(kind, data):
+    """Ключ кэша графика - хэш его входных данных"""
+    payload = json.dumps([kind, data], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def render_chart(kind, data):
+    """Отрисовка графика в потоке пула (там же при необходимости загружается ReportLab)"""
+    return get_pdf_engine().render_chart(kind, data)
+
+def schedule_report_charts(report_data):
+    """Постановка графиков отчета в фоновую отрисовку с кэшем по хэшу данных"""
+    scheduled = []
+    with chart_cache_lock:
+        for kind, title, data in extract_chart_specs(report_data):
+            key = _chart_cache_key(kind, data)
+            future = chart_cache.get(key)
+            if future is not None and future.done() and (future.cancelled() or future.exception() is not None):
+                # Неудачная отрисовка не кэшируется: график рисуется заново
+                chart_cache.pop(key)
+                future = None
+            if future is None:
+                future = chart_executor.submit(render_chart, kind, data)
+                chart_cache[key] = future
+                if len(chart_cache) > CHART_CACHE_SIZE:
+                    chart_cache.popitem(last=False)
+            else:
+                chart_cache.move_to_end(key)
+            scheduled.append((title, future))
+    return scheduled
+
+def get_report_charts(report_data, timeout=CHART_RENDER_TIMEOUT):
+    """Получение готовых графиков для PDF; не успевшие отрисоваться пропускаются"""
+    deadline = time.time() + timeout
+    charts = []
+    for title, future in schedule_report_charts(report_data):
+        try:
+            charts.append((title, future.result(timeout=max(0, deadline - time.time()))))
+        except Exception as e:
+            logger.warning(f"График '{title}' не добавлен в PDF: {str(e)}")
+    return charts
+
 @app.route('/generate_pdf', methods=['POST'])
 def generate_pdf():
     """Генерация PDF отчета с поддержкой кириллицы"""
     try:
-        # Добавляем импорт Paragraph
-        from reportlab.platypus import Paragraph
-        
-        # Используем шрифты с поддержкой кириллицы
-        if CYRILLIC_FONT_AVAILABLE:
-            base_font = 'DejaVuSans'
-            bold_font = 'DejaVuSans-Bold'
-        else:
-            # Fallback на стандартные шрифты
-            base_font = 'Helvetica'
-            bold_font = 'Helvetica-Bold'
-
         data = request.get_json()
         report_data = data.get('report')
         ai_report = data.get('ai_report', '')
-        
+
         if not report_data:
             return jsonify({'error': 'No report data provided'}), 400
 
-        # Создаем буфер для PDF
-        buffer = BytesIO()
-        
-        # Инициализация документа с UTF-8 кодировкой
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=letter,
-            rightMargin=30,
-            leftMargin=30,
-            topMargin=30,
-            bottomMargin=30,
-            encoding='utf-8'
-        )
-        
-        # Стили для текста
-        styles = getSampleStyleSheet()
-        
-        # Переопределяем стандартные стили для поддержки кириллицы
-        styles['Normal'].fontName = base_font
-        styles['BodyText'].fontName = base_font
-        styles['Italic'].fontName = base_font
-        styles['Heading1'].fontName = bold_font
-        styles['Heading2'].fontName = bold_font
-        styles['Heading3'].fontName = bold_font
-        
-        # Основные стили
-        styles.add(ParagraphStyle(
-            name='NormalRU',
-            fontName=base_font,
-            fontSize=10,
-            leading=12,
-            spaceAfter=6
-        ))
-        
-        styles.add(ParagraphStyle(
-            name='HeaderRU',
-            fontName=bold_font,
-            fontSize=14,
-            textColor=colors.HexColor('#3B82F6'),
-            spaceAfter=12
-        ))
-        
-        styles.add(ParagraphStyle(
-            name='SubheaderRU', 
-            fontName=bold_font,
-            fontSize=12,
-            textColor=colors.HexColor('#2563EB'),
-            spaceAfter=8
-        ))
-
-        styles.add(ParagraphStyle(
-            name='SmallRU',
-            fontName=base_font,
-            fontSize=8,
-            textColor=colors.HexColor('#666666'),
-            spaceAfter=4,
-            leading=10
-        ))
-        
-        # Добавляем стиль для жирного текста
-        styles.add(ParagraphStyle(
-            name='BoldRU',
-            fontName=bold_font,
-            fontSize=11,
-            leading=13,
-            spaceAfter=8,
-            spaceBefore=12
-        ))
-
         # Определяем стили для мобильных устройств
         user_agent = request.headers.get('User-Agent', '')
         is_mobile = any(device in user_agent.lower() for device in ['mobile', 'android', 'iphone', 'ipad'])
 
         if is_mobile:
             logger.info("Mobile device detected - adjusting font sizes")
-            styles['NormalRU'].fontSize = 9
-            styles['HeaderRU'].fontSize = 12
-            styles['SubheaderRU'].fontSize = 10
-            styles['SmallRU'].fontSize = 7
-
-        elements = []
-        
-        # Заголовок - сохраняем смайлы как есть
-        title = report_data['channel_info']['title']
-        elements.append(Paragraph(
-            f"Аналитический отчет: {title}",
-            styles['HeaderRU']
-        ))
-        
-        # Период анализа
-        elements.append(Paragraph(
-            f"Период анализа: {report_data['analysis_period']['hours_back']} часов",
-            styles['NormalRU']
-        ))
-        elements.append(Spacer(1, 20))
-        
-        # Основные метрики
-        metrics = [
-            ['Метрика', 'Значение'],
-            ['Подписчиков', str(report_data['channel_info']['subscribers'])],
-            ['Всего постов', str(report_data['summary']['total_posts'])],
-            ['Всего просмотров', str(report_data['summary']['total_views'])],
-            ['Средний охват', str(round(report_data['summary']['avg_views_per_post'], 1))],
-            ['ER (просмотры)', f"{report_data['summary']['engagement_rate']['er_views']}%"],
-            ['ER (подписчики)', f"{report_data['summary']['engagement_rate']['er_subscribers']}%"]
-        ]
-        
-        metrics_table = Table(metrics, colWidths=[200, 100])
-        metrics_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F3F4F6')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#1F2937')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), bold_font),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#E5E7EB')),
-            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#E5E7EB')),
-            ('FONTNAME', (0, 1), (-1, -1), base_font),
-            ('WORDWRAP', (0, 0), (-1, -1), True)
-        ]))
-        
-        elements.append(metrics_table)
-        elements.append(Spacer(1, 30))
-        
-        # Рекомендации - сохраняем смайлы как есть
-        elements.append(Paragraph("Рекомендации", styles['HeaderRU']))
-        for rec in report_data.get('recommendations', []):
-            # Только заменяем названия типов контента, смайлы оставляем
-            rec = rec.replace('mixed_media_with_text', 'текст + медиа')
-            rec = rec.replace('text', 'текст')
-            rec = rec.replace('photo', 'фото')
-            rec = rec.replace('video', 'видео')
-            rec = rec.replace('media', 'медиа')
-            
-            elements.append(Paragraph(f"• {rec}", styles['NormalRU']))
-        elements.append(Spacer(1, 20))
-        
-        # Анализ ИИ - сохраняем смайлы как есть
-        # Замените блок обработки AI-отчета на этот:
-
-        if ai_report:
-            elements.append(Paragraph("ИИ Анализ", styles['HeaderRU']))
-            elements.append(Spacer(1, 12))
-
-            # Если есть пометка о кэше — добавляем её
-            if "кэша" in ai_report:
-                cache_line = ai_report.split('\n')[0]  # Берём первую строку (кэш)
-                elements.append(Paragraph(cache_line, styles['SmallRU']))
-                elements.append(Spacer(1, 12))
-                # Убираем строку кэша из основного отчёта
-                ai_report = '\n'.join(ai_report.split('\n')[1:])
-
-            # Обрабатываем AI отчет - заменяем англоязычные термины
-            ai_report = ai_report.replace('mixed_media_with_text', 'текст + медиа')
-            ai_report = ai_report.replace('text', 'текст')
-            ai_report = ai_report.replace('photo', 'фото')
-            ai_report = ai_report.replace('video', 'видео')
-            ai_report = ai_report.replace('media', 'медиа')
-
-            # Разделяем отчет на секции по двойным переносам
-            sections = ai_report.split('\n\n')
-
-            for section in sections:
-                section = section.strip()
-                if not section:
-                    continue
-
-                # Удаляем все ** из секции
-                section = section.replace('**', '')
 
-                # Разделяем секцию на строки
-                lines = section.split('\n')
-                
-                # Проверяем, является ли первая строка заголовком (начинается с цифры)
-                if lines and re.match(r'^\d+\.', lines[0].strip()):
-                    # Это заголовок - делаем жирным
-                    elements.append(Paragraph(lines[0].strip(), styles['BoldRU']))
-                    elements.append(Spacer(1, 8))
-                    
-                    # Обрабатываем остальные строки как обычный текст
-                    for line in lines[1:]:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        if line.startswith('-'):
-                            # Элемент списка
-                            elements.append(Paragraph(f"• {line[1:].strip()}", styles['NormalRU']))
-                        else:
-                            # Обычная строка
-                            elements.append(Paragraph(line, styles['NormalRU']))
-                else:
-                    # Вся секция - обычный текст
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        if line.startswith('-'):
-                            # Элемент списка
-                            elements.append(Paragraph(f"• {line[1:].strip()}", styles['NormalRU']))
-                        else:
-                            # Обычная строка
-                            elements.append(Paragraph(line, styles['NormalRU']))
-                
-                elements.append(Spacer(1, 8))
-        
-        # Топ постов - сохраняем смайлы как есть
-        if report_data.get('top_posts'):
-            elements.append(Paragraph("Топ постов", styles['HeaderRU']))
-            elements.append(Spacer(1, 10))
-            
-            # Упрощенный формат списка вместо таблицы
-            for i, post in enumerate(report_data['top_posts'][:3], 1):
-                content_type = post.get('content_type', '')
-                content_type = content_type.replace('mixed_media_with_text', 'текст + медиа')
-                content_type = content_type.replace('text', 'текст')
-                content_type = content_type.replace('photo', 'фото')
-                content_type = content_type.replace('video', 'видео')
-                
-                preview = post.get('text_preview', '')
-                # Сохраняем смайлы в превью
-                if len(preview) > 60:
-                    preview = preview[:57] + '...'
-                
-                # Используем простой список вместо таблицы
-                post_info = f"{i}. {post.get('date', '')} - {post.get('views', 0)} просмотров"
-                elements.append(Paragraph(post_info, styles['NormalRU']))
-                elements.append(Paragraph(f"   Тип: {content_type}", styles['SmallRU']))
-                if preview:
-                    elements.append(Paragraph(f"   {preview}", styles['SmallRU']))
-                elements.append(Spacer(1, 10))
-        
-        # Создаем PDF
-        doc.build(elements)
-        
-        # Подготовка ответа
-        buffer.seek(0)
-        pdf_data = buffer.getvalue()
-        buffer.close()
-        
         filename = get_safe_filename(report_data['channel_info'])
-        
+
         # Создаем ключ для кэша
         cache_key = hashlib.md5(f"{report_data['channel_info']['title']}_{time.time()}".encode()).hexdigest()
-        
+
+        # Собираем PDF сразу в файл, а не в буфер в памяти
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        pdf_path = os.path.join(PDF_CACHE_DIR, f"{cache_key}.pdf")
+        with admission_slot('generate_pdf'):
+            charts = get_report_charts(report_data)
+            with PDF_RENDER_DURATION.time(), tracer.span('pdf.render', ai_report_chars=len(ai_report)):
+                pdf_size = get_pdf_engine().render_pdf_report(report_data, ai_report, pdf_path, is_mobile, charts)
+        PDF_SIZE.observe(pdf_size)
+        if shared_store.shared_across_hosts:
+            # Воркеры других машин не видят PDF_CACHE_DIR - содержимое тоже кладем в хранилище
+            with open(pdf_path, 'rb') as f:
+                shared_store.set(f"pdf_data:{cache_key}", f.read(), CACHE_EXPIRY * 2)
+
         pdf_cache[cache_key] = {
-            'pdf_data': pdf_data,
+            'path': pdf_path,
             'filename': filename,
+            'size': pdf_size,
             'timestamp': time.time()
         }
-        
-        logger.info(f"PDF сохранен в кэше с ключом: {cache_key}")
+
+        pdf_logger.info("PDF сохранен в кэше с ключом: %s (%s байт)", cache_key, pdf_size)
         cleanup_pdf_cache()
-        
+
         is_direct_download = request.args.get('direct') == 'true'
-        
+
         if is_direct_download:
-            response = make_response(pdf_data)
-            response.headers['Content-Type'] = 'application/pdf'
-            response.headers['Content-Disposition'] = f'attachment; filename="{get_safe_filename(filename)}"'
-            return response
+            return send_file(
+                pdf_path,
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=get_safe_filename(filename)
+            )
         else:
-            return jsonify({
-                'pdf_base64': base64.b64encode(pdf_data).decode('utf-8'),
-                'filename': filename,
-                'cache_key': cache_key
-            })
-    
+            return Response(
+                stream_with_context(iter_pdf_json_response(pdf_path, filename, cache_key)),
+                mimetype='application/json'
+            )
+
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Ошибка генерации PDF: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
- 
+
+def ensure_local_pdf(cache_key, path):
+    """Путь к PDF на этой машине: собранный на другой машине PDF берется из общего хранилища"""
+    if os.path.exists(path) or not shared_store.shared_across_hosts:
+        return path
+    data = shared_store.get(f"pdf_data:{cache_key}")
+    if data is None:
+        return path
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    local_path = os.path.join(PDF_CACHE_DIR, f"{cache_key}.pdf")
+    with open(local_path, 'wb') as f:
+        f.write(data)
+    return local_path
+
+def remove_cached_pdf(cache_key):
+    """Удаление PDF из кэша вместе с файлом"""
+    data = pdf_cache.pop(cache_key, None)
+    if shared_store.shared_across_hosts:
+        shared_store.delete(f"pdf_data:{cache_key}")
+    if data:
+        try:
+            os.remove(data['path'])
+        except OSError:
+            pass
+
 def cleanup_pdf_cache():
     """Очистка устаревших PDF из кэша (только для подстраховки)"""
     current_time = time.time()
     keys_to_delete = []
-    
-    for key, data in pdf_cache.items():
+
+    for key, data in list(pdf_cache.items()):
         if current_time - data['timestamp'] > CACHE_EXPIRY:
             keys_to_delete.append(key)
-    
+
     for key in keys_to_delete:
-        del pdf_cache[key]
-    
+        remove_cached_pdf(key)
+    PDF_CACHE_EVICTIONS.inc(len(keys_to_delete), reason='expired')
+
     if keys_to_delete:
         logger.info(f"Очищено {len(keys_to_delete)} устаревших PDF из кэша")
  
+# =============================================
+# СТАТИКА ФРОНТЕНДА
+# =============================================
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_COMPRESSIBLE = ('.html', '.js', '.css', '.svg', '.json', '.txt', '.ttf')
+STATIC_MIN_COMPRESS_SIZE = 512  # Файлы меньше этого размера не сжимаем
+STATIC_BROTLI_MAX_QUALITY_SIZE = 256 * 1024  # До этого размера brotli сжимает с максимальным качеством
+STATIC_IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'  # Для адресов с хэшем содержимого
+STATIC_REVALIDATE_CACHE = 'no-cache'  # Для обычных адресов: всегда проверка по ETag
+
+STATIC_HASHED_NAME_RE = re.compile(r'^(?P<base>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)?$')  # Имя вида app.<хэш>.js
+
+class StaticAssets:
+    """Предсжатая статика с сильными ETag и адресами с хэшем содержимого.
+
+    Файлы читаются и сжимаются (gzip и brotli) один раз - при фоновом прогреве
+    на старте или при первом обращении, дальше отдаются из памяти.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.assets = {}
+        self.hashed_names = {}
+        self.lock = threading.Lock()
+
+    def _hashed_name(self, name, digest):
+        base, ext = os.path.splitext(name)
+        return f"{base}.{digest[:12]}{ext}"
+
+    def _build(self, name):
+        """Чтение файла и подготовка всех вариантов кодирования"""
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        digest = hashlib.sha256(data).hexdigest()
+        variants = {'identity': data}
+        if name.lower().endswith(STATIC_COMPRESSIBLE) and len(data) >= STATIC_MIN_COMPRESS_SIZE:
+            gzipped = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gzipped) < len(data):
+                variants['gzip'] = gzipped
+            if brotli is not None:
+                # Максимальное качество дорого для больших файлов (шрифты), для них берем среднее
+                quality = 11 if len(data) <= STATIC_BROTLI_MAX_QUALITY_SIZE else 6
+                compressed = brotli.compress(data, quality=quality)
+                if len(compressed) < len(data):
+                    variants['br'] = compressed
+
+        return {
+            'name': name,
+            'hash': digest,
+            'hashed_name': self._hashed_name(name, digest),
+            'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            'variants': variants
+        }
+
+    def _register(self, asset):
+        self.assets[asset['name']] = asset
+        self.hashed_names[asset['hashed_name']] = asset['name']
+
+    def load(self):
+        """Подготовка всех файлов статики (вызывается в фоне при старте)"""
+        started = time.time()
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                name = os.path.relpath(os.path.join(root, filename), self.directory).replace(os.sep, '/')
+                with self.lock:
+                    if name in self.assets:
+                        continue
+                try:
+                    asset = self._build(name)
+                except OSError as e:
+                    logger.warning(f"Не удалось подготовить статический файл {name}: {str(e)}")
+                    continue
+                with self.lock:
+                    self._register(asset)
+        logger.info(f"Статика подготовлена: {len(self.assets)} файлов за {time.time() - started:.2f} с")
+
+    def get(self, name):
+        """Поиск файла по обычному имени или имени с хэшем; возвращает (файл, адрес_с_хэшем)"""
+        name = name.lstrip('/')
+        with self.lock:
+            if name in self.hashed_names:
+                return self.assets[self.hashed_names[name]], True
+            if name in self.assets:
+                return self.assets[name], False
+
+        # Файл еще не подготовлен прогревом - готовим только его
+        asset = self._load_file(name)
+        if asset:
+            return asset, False
+        # Имя с хэшем известно только после подготовки файла: убираем хэш и готовим исходный
+        match = STATIC_HASHED_NAME_RE.match(name)
+        if match:
+            asset = self._load_file(match['base'] + (match['ext'] or ''))
+            if asset:
+                # Устаревший хэш (HTML до обновления файла) - текущий файл без долгого кэширования
+                return asset, asset['hashed_name'] == name
+        return None, False
+
+    def _load_file(self, name):
+        """Подготовка одного файла по обычному имени; None если файла нет или его не прочитать"""
+        with self.lock:
+            if name in self.assets:
+                return self.assets[name]
+        path = os.path.realpath(os.path.join(self.directory, name))
+        if not path.startswith(os.path.realpath(self.directory) + os.sep) or not os.path.isfile(path):
+            return None
+        try:
+            asset = self._build(name)
+        except OSError as e:
+            logger.warning(f"Не удалось подготовить статический файл {name}: {str(e)}")
+            return None
+        with self.lock:
+            self._register(asset)
+        return asset
+
+    def url(self, name):
+        """Адрес файла с хэшем содержимого для долгого кэширования"""
+        asset, _ = self.get(name)
+        return f"/{asset['hashed_name']}" if asset else f"/{name}"
+
+    def manifest(self):
+        """Соответствие обычных имен адресам с хэшем"""
+        with self.lock:
+            return {name: f"/{asset['hashed_name']}" for name, asset in sorted(self.assets.items())}
+
+static_assets = StaticAssets(STATIC_DIR)
+
+def choose_encoding(asset):
+    """Выбор лучшего доступного сжатия по Accept-Encoding"""
+    for encoding in ('br', 'gzip'):
+        if encoding in asset['variants'] and request.accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+def serve_asset(name):
+    """Отдача статического файла с учетом Accept-Encoding, ETag и If-None-Match"""
+    asset, is_hashed = static_assets.get(name)
+    if not asset:
+        abort(404)
+
+    encoding = choose_encoding(asset)
+    # Сильный ETag на каждое представление: хэш содержимого + кодирование
+    etag = f"{asset['hash'][:32]}-{encoding}"
+    cache_control = STATIC_IMMUTABLE_CACHE if is_hashed else STATIC_REVALIDATE_CACHE
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(asset['variants'][encoding], mimetype=asset['mimetype'])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 # Отдача фронтенда
 @app.route('/')
 def home():
-    # Создаем базовый HTML файл если его нет
-    if not os.path.exists('static/index.html'):
-        create_basic_html()
-    return send_from_directory('static', 'index.html')
+    return serve_asset('index.html')
+
+@app.route('/asset-manifest.json')
+def asset_manifest():
+    """Адреса статики с хэшем содержимого для долгого кэширования на клиенте"""
+    return jsonify(static_assets.manifest())
 
 @app.route('/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('static', filename)
+    return serve_asset(filename)
 
 @app.after_request
 def after_request(response):
@@ -1679,43 +4261,79 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
+def check_supabase_connection():
+    """Проверка подключения к Supabase (выполняется в фоне)"""
+    logger.info("Проверка подключения к Supabase...")
+    try:
+        response = requests.get(
+            f"{SUPABASE_URL}/rest/v1/ai_reports?select=*&limit=1",
+            headers=SUPABASE_HEADERS,
+            timeout=10
+        )
+        if response.status_code == 401:
+            logger.error("ОШИБКА: Неверные учетные данные Supabase!")
+        elif response.status_code == 200:
+            logger.info("Подключение к Supabase успешно")
+        else:
+            logger.error(f"Ошибка подключения к Supabase: {response.status_code} - {response.text}")
+    except Exception as e:
+        logger.error(f"Ошибка подключения к Supabase: {str(e)}")
+
+def connect_telegram_client(loop):
+    """Инициализация клиента Telegram параллельно со стартом Flask"""
+    logger.info("Инициализация Telegram клиента в фоне...")
+    def on_telegram_ready(future):
+        try:
+            if not future.result():
+                logger.warning("Не удалось инициализировать Telegram клиент. Будет инициализирован при первом запросе.")
+                return
+            # Индекс каналов для /find_channel загружается в фоне
+            asyncio.run_coroutine_threadsafe(tracer.detach(analytics.ensure_dialog_index(wait=0)), loop)
+            # Обходы истории, прерванные перезапуском
+            asyncio.run_coroutine_threadsafe(tracer.detach(channel_backfill.resume()), loop)
+        except Exception as e:
+            logger.error(f"Ошибка инициализации Telegram клиента: {str(e)}", exc_info=True)
+    asyncio.run_coroutine_threadsafe(tracer.detach(analytics.ensure_client()), loop).add_done_callback(on_telegram_ready)
+
+def start_telegram_owner():
+    """Службы воркера-владельца: Unix сокет для остальных воркеров и подключение клиента"""
+    serve_unix_socket(app, TELEGRAM_OWNER_SOCKET)
+    logger.info(f"Воркер {os.getpid()} - владелец Telegram клиента (IPC: {TELEGRAM_OWNER_SOCKET})")
+    connect_telegram_client(get_background_loop())
+
+def start_background_services():
+    """Запуск фоновой инициализации, не блокирующей старт Flask"""
+    loop = get_background_loop()
+
+    # Проверка Supabase
+    threading.Thread(target=check_supabase_connection, name='supabase-check', daemon=True).start()
+
+    # Предварительное сжатие статики
+    threading.Thread(target=static_assets.load, name='static-assets', daemon=True).start()
+
+    # Telegram клиент: в режиме нескольких воркеров только у владельца
+    if TELEGRAM_OWNER_MODE != 'shared':
+        connect_telegram_client(loop)
+    elif telegram_owner.try_acquire():
+        start_telegram_owner()
+    else:
+        logger.info(f"Воркер {os.getpid()}: запросы к Telegram пересылаются владельцу через {TELEGRAM_OWNER_SOCKET}")
+
+    # Прогрев генерации PDF
+    if PDF_WARMUP:
+        warm_up_pdf_engine()
+
+    return loop
+
 if __name__ == '__main__':
-    # Создаем event loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    loop = None
     
     try:
         # Создаем папки
         os.makedirs('static/fonts', exist_ok=True)
         
-        # Сохраняем loop в конфиг приложения
-        app.config['GLOBAL_EVENT_LOOP'] = loop
-        
-        # Проверка подключения к Supabase
-        logger.info("Проверка подключения к Supabase...")
-        try:
-            response = requests.get(
-                f"{SUPABASE_URL}/rest/v1/ai_reports?select=*&limit=1",
-                headers=SUPABASE_HEADERS,
-                timeout=10
-            )
-            if response.status_code == 401:
-                logger.error("ОШИБКА: Неверные учетные данные Supabase!")
-            elif response.status_code == 200:
-                logger.info("Подключение к Supabase успешно")
-            else:
-                logger.error(f"Ошибка подключения к Supabase: {response.status_code} - {response.text}")
-        except Exception as e:
-            logger.error(f"Ошибка подключения к Supabase: {str(e)}")
-            
-        # Инициализация клиента Telegram
-        logger.info("Инициализация Telegram клиента...")
-        try:
-            init_result = loop.run_until_complete(analytics.init_client())
-            if not init_result:
-                logger.warning("Не удалось инициализировать Telegram клиент. Будет инициализирован при первом запросе.")
-        except Exception as e:
-            logger.error(f"Ошибка инициализации Telegram клиента: {str(e)}", exc_info=True)
+        # Общий event loop, Telegram и Supabase стартуют в фоне
+        loop = start_background_services()
         
         # Получаем порт из переменных окружения
         port = int(os.getenv('PORT', 5050))
@@ -1729,6 +4347,6 @@ if __name__ == '__main__':
     finally:
         logger.info("Завершение работы приложения...")
         # Корректно закрываем event loop
-        if loop:
-            loop.run_until_complete(loop.shutdown_asyncgens())
-            loop.close()
\ No newline at end of file
+        if loop and loop.is_running():
+            run_async(loop.shutdown_asyncgens(), timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,123 @@
+"""Допуск запросов к дорогим эндпоинтам (admission control).
+
+У каждого дорогого эндпоинта свой контроллер: одновременно выполняется не
+больше max_concurrent запросов, еще не больше max_queue ждут в очереди и
+каждый ждет не дольше queue_timeout секунд. Остальные сразу получают отказ
+с рекомендуемым Retry-After, а не копятся на event loop и Telegram аккаунте.
+
+Справедливость между клиентами: у одного клиента не больше per_client
+запросов (выполняемых и ожидающих), а освободившийся слот получает ожидающий
+клиент с наименьшим числом выполняемых запросов, при равенстве - пришедший
+раньше.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Причины отказа
+REJECT_CLIENT_QUOTA = 'client_quota'
+REJECT_QUEUE_FULL = 'queue_full'
+REJECT_QUEUE_TIMEOUT = 'queue_timeout'
+REJECT_NO_SLOT = 'no_slot'
+
+class Overloaded(Exception):
+    """Запрос не допущен: status 429 (квота клиента) или 503 (перегрузка), retry_after в секундах"""
+
+    def __init__(self, endpoint, reason, status, retry_after, message):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Слоты выполнения и ограниченная очередь ожидания одного эндпоинта"""
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, per_client, service_time=5.0, max_retry_after=120):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.per_client = max(1, per_client)
+        self.service_time = service_time  # Скользящее среднее длительности запроса - для Retry-After
+        self.max_retry_after = max_retry_after
+        self.active = 0
+        self.active_by_client = {}
+        self.waiters = []  # [клиент, слот выдан] в порядке прихода
+        self.condition = threading.Condition()
+
+    def retry_after(self):
+        """Оценка, через сколько секунд освободится место: очередь впереди и слоты"""
+        rounds = (len(self.waiters) + 1) / self.max_concurrent
+        return min(self.max_retry_after, max(1, math.ceil(self.service_time * rounds)))
+
+    def _reject(self, reason, status, message):
+        return Overloaded(self.name, reason, status, self.retry_after(), message)
+
+    def _grant(self, client):
+        self.active += 1
+        self.active_by_client[client] = self.active_by_client.get(client, 0) + 1
+
+    def _dispatch(self):
+        """Раздача свободных слотов ожидающим: сначала клиентам с меньшим числом выполняемых"""
+        granted = False
+        while self.active < self.max_concurrent and self.waiters:
+            waiter = min(self.waiters, key=lambda item: self.active_by_client.get(item[0], 0))
+            self.waiters.remove(waiter)
+            waiter[1] = True
+            self._grant(waiter[0])
+            granted = True
+        if granted:
+            self.condition.notify_all()
+
+    def acquire(self, client, block=True):
+        """Получение слота или Overloaded; ждет в очереди не дольше queue_timeout, без block - не ждет"""
+        with self.condition:
+            held = self.active_by_client.get(client, 0) + sum(1 for waiter in self.waiters if waiter[0] == client)
+            if held >= self.per_client:
+                raise self._reject(REJECT_CLIENT_QUOTA, 429, 'Слишком много одновременных запросов от клиента')
+            if self.active < self.max_concurrent and not self.waiters:
+                self._grant(client)
+                return
+            if not block:
+                raise self._reject(REJECT_NO_SLOT, 503, 'Нет свободных слотов, повторите запрос позже')
+            if len(self.waiters) >= self.max_queue:
+                raise self._reject(REJECT_QUEUE_FULL, 503, 'Сервис перегружен, повторите запрос позже')
+
+            waiter = [client, False]
+            self.waiters.append(waiter)
+            deadline = time.monotonic() + self.queue_timeout
+            while not waiter[1]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiters.remove(waiter)
+                    raise self._reject(REJECT_QUEUE_TIMEOUT, 503, 'Сервис перегружен, повторите запрос позже')
+                self.condition.wait(remaining)
+
+    def release(self, client, duration=None):
+        with self.condition:
+            self.active -= 1
+            count = self.active_by_client.get(client, 0) - 1
+            if count > 0:
+                self.active_by_client[client] = count
+            else:
+                self.active_by_client.pop(client, None)
+            if duration is not None:
+                self.service_time = 0.8 * self.service_time + 0.2 * duration
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, client):
+        """Выполнение блока с занятым слотом"""
+        self.acquire(client)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(client, time.monotonic() - started)
+
+    def stats(self):
+        with self.condition:
+            return {'active': self.active, 'queued': len(self.waiters), 'max_concurrent': self.max_concurrent,
+                    'max_queue': self.max_queue, 'service_time': round(self.service_time, 3)}
@@ -0,0 +1,107 @@
+"""Бенчмарк промпта ИИ анализа: размер промпта, задержка и доля обрезанных ответов.
+
+Запуск: python benchmarks/bench_ai_prompt.py [--live 3] [--fake]
+Без --live считает размер промпта (символы и оценку токенов) и max_tokens
+для отчетов за разные периоды. С --live N отправляет по N запросов на период
+через бэкенд ИИ приложения (LLM_BACKEND: OpenRouter, запись или воспроизведение)
+и выводит задержку, фактические токены, попадание в кэш префикса и долю
+ответов с finish_reason == 'length'. --fake поднимает fake_openrouter.py
+в процессе бенчмарка, сеть и ключ не нужны.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_serialization import WORDS, make_analysis_report, make_text
+
+PERIODS = (24, 72, 168, 720, None)  # None - fallback режим
+
+def make_report(rng, hours_back):
+    """Отчет /analyze за период вместе с анализом тем"""
+    from topics import extract_topics
+
+    report = make_analysis_report(rng)
+    if hours_back is None:
+        report['analysis_period'].update({'hours_back': 24, 'used_fallback': True, 'actual_period': 'последние 30 постов',
+                                          'fallback_reason': 'Последний пост был 45 дней назад'})
+    else:
+        report['analysis_period']['hours_back'] = hours_back
+
+    posts = [{'text': make_text(rng, rng.randint(20, 120)) + ' ' + rng.choice(WORDS), 'views': rng.randint(1000, 90000)}
+             for _ in range(report['summary']['total_posts'])]
+    topic_analysis = extract_topics(posts)
+    if topic_analysis:
+        report['topic_analysis'] = topic_analysis
+    return report
+
+def start_fake_openrouter():
+    """Заглушка OpenRouter в фоновом потоке; адрес передается приложению до его импорта"""
+    from fake_openrouter import create_server
+
+    server = create_server(port=0, latency=0.2, tokens_per_second=2000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['OPENROUTER_API_URL'] = f"http://127.0.0.1:{server.server_port}/api/v1/chat/completions"
+    os.environ['LLM_BACKEND'] = 'http'
+    return server
+
+def send(analytics, report):
+    """Один запрос через бэкенд ИИ приложения: (секунды, finish_reason, usage)"""
+    from AppAI import llm_backend, build_completion_payload
+
+    payload = build_completion_payload(analytics.build_ai_messages(report), analytics.ai_max_tokens(report))
+    started = time.perf_counter()
+    response = llm_backend.post(payload, timeout=300)
+    elapsed = time.perf_counter() - started
+    data = response.json()
+    finish_reason = (data.get('choices') or [{}])[0].get('finish_reason')
+    return elapsed, finish_reason, data.get('usage') or {}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--live', type=int, default=0, help='запросов к ИИ на каждый период')
+    parser.add_argument('--fake', action='store_true', help='использовать локальную заглушку OpenRouter')
+    args = parser.parse_args()
+
+    if args.fake:
+        start_fake_openrouter()
+
+    from AppAI import analytics, estimate_tokens, OPENROUTER_API_KEY, LLM_BACKEND
+
+    rng = random.Random(42)
+    reports = {hours: make_report(rng, hours) for hours in PERIODS}
+
+    print(f"{'период':<10}{'символов':>10}{'~токенов':>10}{'из них система':>16}{'max_tokens':>12}")
+    for hours, report in reports.items():
+        messages = analytics.build_ai_messages(report)
+        chars = sum(len(message['content']) for message in messages)
+        tokens = sum(estimate_tokens(message['content']) for message in messages)
+        system_tokens = estimate_tokens(messages[0]['content'])
+        label = f"{hours}ч" if hours else 'fallback'
+        print(f"{label:<10}{chars:>10}{tokens:>10}{system_tokens:>16}{analytics.ai_max_tokens(report):>12}")
+
+    if not args.live:
+        return
+    if not OPENROUTER_API_KEY and LLM_BACKEND == 'http' and not args.fake:
+        sys.exit('Для --live нужен OPENROUTER_API_KEY, --fake или LLM_BACKEND=replay')
+
+    print(f"\n{'период':<10}{'p50 с':>8}{'max с':>8}{'промпт':>8}{'кэш':>8}{'ответ':>8}{'обрезано':>10}")
+    for hours, report in reports.items():
+        results = [send(analytics, report) for _ in range(args.live)]
+        latencies = [elapsed for elapsed, _, _ in results]
+        truncated = sum(1 for _, finish_reason, _ in results if finish_reason == 'length')
+        usage = results[-1][2]
+        cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens', '-')
+        label = f"{hours}ч" if hours else 'fallback'
+        print(f"{label:<10}{statistics.median(latencies):>8.1f}{max(latencies):>8.1f}"
+              f"{usage.get('prompt_tokens', '-'):>8}{cached:>8}{usage.get('completion_tokens', '-'):>8}"
+              f"{truncated / len(results):>10.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Бенчмарк генерации PDF для длинных отчетов ИИ (1k/10k/50k строк).
+
+Запуск: python benchmarks/bench_pdf.py [--sizes 1000,10000,50000]
+Каждый размер собирается в отдельном процессе, чтобы пиковая память
+(tracemalloc и maxrss) не смешивалась между прогонами.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+def make_ai_report(lines):
+    """Синтетический markdown отчет ИИ заданной длины"""
+    out = []
+    section = 0
+    while len(out) < lines:
+        section += 1
+        out.append(f"{section}. **Раздел анализа {section}**")
+        for i in range(8):
+            if i % 3 == 0:
+                out.append(f"- Рекомендация {i}: публикуйте video и photo контент чаще, ER растет на {i * 1.5:.1f}%")
+            else:
+                out.append(f"Наблюдение {i}: средний охват text постов составил {1000 + i * 37} просмотров в вечерние часы.")
+        out.append("")
+    return '\n'.join(out[:lines])
+
+def make_report_data():
+    """Минимальный отчет анализа канала для заголовка и таблиц PDF"""
+    return {
+        'channel_info': {'id': 1, 'title': 'Бенчмарк канал', 'username': 'bench', 'subscribers': 12345},
+        'analysis_period': {'hours_back': 168},
+        'summary': {
+            'total_posts': 120,
+            'total_views': 456789,
+            'avg_views_per_post': 3806.6,
+            'engagement_rate': {'er_views': 2.4, 'er_subscribers': 8.1}
+        },
+        'recommendations': ['🎯 Наиболее эффективный тип контента: video (среднее 5000 просмотров)'],
+        'top_posts': [
+            {'date': '01.01.2026 12:00', 'views': 9000, 'content_type': 'photo', 'text_preview': 'Пример поста'}
+        ]
+    }
+
+def run_single(lines):
+    """Один прогон в текущем процессе"""
+    from pdf_report import render_pdf_report
+
+    ai_report = make_ai_report(lines)
+    report_data = make_report_data()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'report.pdf')
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = render_pdf_report(report_data, ai_report, path)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'lines': lines,
+        'seconds': round(elapsed, 3),
+        'pdf_bytes': size,
+        'tracemalloc_peak_mb': round(peak / 1024 / 1024, 2),
+        'maxrss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single)))
+        return
+
+    results = []
+    for lines in (int(s) for s in args.sizes.split(',')):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--single', str(lines)],
+            capture_output=True, text=True, check=True, cwd=ROOT
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{result['lines']:>6} строк: {result['seconds']:>7} с, PDF {result['pdf_bytes'] / 1024:.0f} КБ, "
+              f"пик tracemalloc {result['tracemalloc_peak_mb']} МБ, maxrss {result['maxrss_mb']} МБ")
+    return results
+
+if __name__ == '__main__':
+    main()
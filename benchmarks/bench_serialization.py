@@ -0,0 +1,114 @@
+"""Бенчмарк сериализации отчетов: время кодирования и байты на проводе.
+
+Запуск: python benchmarks/bench_serialization.py [--repeat 200]
+Сравнивает json (как jsonify), быстрый JSON приложения (orjson при наличии)
+и MessagePack, а также размер после gzip и brotli для отчета /analyze,
+ответа /channel_history с 50 полными постами и отчета /ai_analyze.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ('канал', 'новости', 'рынок', 'аналитика', 'реклама', 'подписчики', 'охват', 'видео', 'обзор',
+         'запуск', 'продукт', 'стратегия', 'контент', 'аудитория', 'рост', 'telegram', 'ai', 'крипто')
+
+def make_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def make_analysis_report(rng):
+    """Отчет в форме ответа /analyze"""
+    content_types = ['text', 'photo', 'video', 'photo_with_text', 'video_with_text',
+                     'mixed_media_with_text', 'media_album', 'document', 'audio']
+    return {
+        'channel_info': {'id': 1234567890, 'title': 'Бенчмарк канал', 'username': 'bench',
+                         'subscribers': 154321, 'description': make_text(rng, 40)},
+        'analysis_period': {'hours_back': 720, 'start_time': '01.09.2026 00:00', 'end_time': '01.10.2026 00:00',
+                            'actual_period': '30 дней', 'used_fallback': False, 'fallback_reason': None},
+        'summary': {'total_posts': 412, 'total_views': 9876543, 'avg_views_per_post': 23972.2,
+                    'total_reactions': 45678, 'total_comments': 3456, 'total_forwards': 7890,
+                    'engagement_rate': {'er_views': 0.58, 'er_subscribers': 37.3, 'er_quality': 'normal'}},
+        'content_analysis': {
+            ctype: {'count': rng.randint(1, 80), 'total_views': rng.randint(10000, 900000),
+                    'total_reactions': rng.randint(10, 9000), 'total_comments': rng.randint(0, 900),
+                    'total_forwards': rng.randint(0, 1500)}
+            for ctype in content_types
+        },
+        'time_analysis': {
+            'hourly_stats': {hour: {'count': rng.randint(1, 40), 'total_views': rng.randint(1000, 500000)} for hour in range(24)},
+            'best_hours': [{'hour': h, 'avg_views': rng.uniform(10000, 40000)} for h in (19, 20, 12)]
+        },
+        'top_posts': [
+            {'id': 10000 + i, 'date': '15.09.2026 19:00', 'views': 90000 - i * 1000, 'reactions': 900,
+             'forwards': 120, 'text_preview': make_text(rng, 16)[:100] + '...', 'content_type': 'photo_with_text',
+             'is_group': False, 'group_size': 1}
+            for i in range(5)
+        ],
+        'recommendations': [make_text(rng, 12) for _ in range(4)],
+        'generated_at': '01.10.2026 00:00:01',
+        'group_processing_info': {'groups_processed': 57, 'single_messages': 355},
+        'last_message_date': '2026-09-30 23:10'
+    }
+
+def make_history(rng):
+    """Ответ /channel_history с 50 полными текстами постов"""
+    return {
+        'channel_info': {'id': 1234567890, 'title': 'Бенчмарк канал', 'username': 'bench', 'subscribers': 154321},
+        'posts': [
+            {'id': 20000 + i, 'date': '2026-09-30 12:00', 'text': make_text(rng, rng.randint(50, 400)),
+             'views': rng.randint(1000, 90000), 'reactions': rng.randint(0, 900),
+             'forwards': rng.randint(0, 200), 'comments': rng.randint(0, 90)}
+            for i in range(50)
+        ],
+        'total_count': 50,
+        'requested_limit': 50
+    }
+
+def make_ai_response(rng):
+    """Ответ /ai_analyze с длинным markdown отчетом"""
+    return {'ai_report': '\n'.join(make_text(rng, 20) for _ in range(600))}
+
+def measure(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    from AppAI import dumps_json, msgpack, brotli
+
+    rng = random.Random(42)
+    payloads = {
+        '/analyze': make_analysis_report(rng),
+        '/channel_history': make_history(rng),
+        '/ai_analyze': make_ai_response(rng)
+    }
+
+    encoders = {
+        'json (jsonify)': lambda data: json.dumps(data, ensure_ascii=False, sort_keys=True, indent=None).encode('utf-8'),
+        'dumps_json': dumps_json
+    }
+    if msgpack is not None:
+        encoders['msgpack'] = lambda data: msgpack.packb(data, use_bin_type=True)
+
+    for endpoint, data in payloads.items():
+        print(f"\n{endpoint}")
+        print(f"  {'кодек':<16}{'мс':>8}{'байт':>10}{'gzip':>10}{'brotli':>10}")
+        for name, encode in encoders.items():
+            ms, body = measure(lambda: encode(data), args.repeat)
+            gzipped = len(gzip.compress(body, 6))
+            brotlied = len(brotli.compress(body, quality=5)) if brotli is not None else '-'
+            print(f"  {name:<16}{ms:>8.3f}{len(body):>10}{gzipped:>10}{brotlied:>10}")
+
+if __name__ == '__main__':
+    main()
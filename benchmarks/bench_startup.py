@@ -0,0 +1,95 @@
+"""Профиль холодного старта: время импорта AppAI и самые тяжелые модули.
+
+Запуск: python benchmarks/bench_startup.py [--runs 5] [--top 15]
+Каждый прогон - отдельный процесс с python -X importtime, поэтому
+результат соответствует старту свежего инстанса после сна хостинга.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+FIRST_RESPONSE_CODE = (
+    "import time; started = time.perf_counter(); import AppAI; "
+    "AppAI.app.test_client().get('/health'); "
+    "print(round(time.perf_counter() - started, 4))"
+)
+
+def profile_import():
+    """Один прогон импорта: общее время и время по модулям верхнего уровня, мс"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import AppAI'],
+        capture_output=True, text=True, cwd=ROOT, check=True
+    )
+    total_ms = None
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        # Отступ 1 пробел - модули, импортированные напрямую из AppAI
+        if name == 'AppAI':
+            total_ms = int(cumulative_us) / 1000
+        elif len(indent) <= 3:
+            modules[name] = int(cumulative_us) / 1000
+    return total_ms, modules
+
+def time_first_response():
+    """Время от старта процесса до ответа /health, с"""
+    result = subprocess.run(
+        [sys.executable, '-c', FIRST_RESPONSE_CODE],
+        capture_output=True, text=True, cwd=ROOT, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    args = parser.parse_args()
+
+    # Первый прогон прогревает кэш байткода и в статистику не входит
+    profile_import()
+
+    totals = []
+    per_module = {}
+    for _ in range(args.runs):
+        total_ms, modules = profile_import()
+        totals.append(total_ms)
+        for name, ms in modules.items():
+            per_module.setdefault(name, []).append(ms)
+    first_response = [time_first_response() for _ in range(args.runs)]
+
+    result = {
+        'import_ms_median': round(statistics.median(totals), 1),
+        'first_response_s_median': round(statistics.median(first_response), 3),
+        'heaviest_imports_ms': {
+            name: round(statistics.median(values), 1)
+            for name, values in sorted(per_module.items(), key=lambda x: -statistics.median(x[1]))[:args.top]
+        },
+        'runs': args.runs,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return result
+
+    print(f"Импорт AppAI (медиана): {result['import_ms_median']} мс")
+    print(f"До первого ответа /health (медиана): {result['first_response_s_median']} с")
+    print("Самые тяжелые импорты:")
+    for name, ms in result['heaviest_imports_ms'].items():
+        print(f"  {ms:>8} мс  {name}")
+    return result
+
+if __name__ == '__main__':
+    main()
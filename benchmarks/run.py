@@ -0,0 +1,278 @@
+"""Набор бенчмарков горячих путей аналитики на синтетических каналах.
+
+Запуск: python benchmarks/run.py [--sizes 100,1000,10000,100000] [--only analyze_channel,pdf]
+                                 [--compare HEAD~1] [--threshold 0.2] [--check]
+
+Работает без сети: сообщения генерирует fake_telegram.py (альбомы, медиа,
+реакции, комментарии), клиент подключается через фабрику клиента приложения
+без задержек RPC. Для каждого случая и размера выводятся min/медиана
+времени. Результаты сохраняются в benchmarks/results/<коммит>.json;
+--compare сравнивает с результатами другого коммита (sha, ref или путь
+к файлу), --check завершает процесс с кодом 1 при замедлении больше
+--threshold.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_pdf import make_ai_report
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+PDF_REPORTS = {'short': 60, 'long': 3000}  # Строк в отчете ИИ
+ANALYSIS_HOURS = 720
+CASES = {}
+
+def case(name, params=None):
+    """Регистрация случая: setup(параметр) возвращает функцию для замера"""
+    def decorator(setup):
+        CASES[name] = (setup, params)
+        return setup
+    return decorator
+
+class Fixtures:
+    """Синтетические каналы и производные данные, общие для случаев одного размера"""
+
+    def __init__(self):
+        self.channels = {}
+        self.loop = asyncio.new_event_loop()
+
+    def channel(self, size):
+        """Канал ровно из size сообщений за последние ANALYSIS_HOURS часов"""
+        if size not in self.channels:
+            from fake_telegram import generate_channel
+
+            days = ANALYSIS_HOURS // 24 - 1
+            posts_per_day = size / days
+            while True:
+                channel = generate_channel(1000, 'bench', subscribers=150000, posts_per_day=posts_per_day,
+                                           days=days, seed=size)
+                if len(channel.messages) >= size:
+                    break
+                posts_per_day *= 1.5
+            channel.messages = channel.messages[:size]
+            self.channels[size] = channel
+        return self.channels[size]
+
+    def analytics(self, size):
+        """Экземпляр аналитики с тестовым клиентом без задержек"""
+        from AppAI import TelegramAnalytics
+        from fake_telegram import FakeTelegramClient, LatencyModel
+
+        client = FakeTelegramClient([self.channel(size)], latency=LatencyModel(base=0, per_item=0, jitter=0))
+        analytics = TelegramAnalytics(client_factory=lambda: client)
+        self.loop.run_until_complete(analytics.ensure_client())
+        return analytics
+
+    def posts(self, size):
+        analytics = self.analytics(size)
+        posts, _ = self.loop.run_until_complete(analytics.fetch_posts('bench', limit=size))
+        return analytics, posts
+
+    def report(self, size):
+        analytics, posts = self.posts(size)
+        period = {'hours_back': ANALYSIS_HOURS, 'actual_period': '30 дней', 'used_fallback': False}
+        channel_info = {'id': 1000, 'title': 'Бенчмарк канал', 'username': 'bench', 'subscribers': 150000}
+        groups = sum(1 for post in posts if post['is_group'])
+        report = analytics.build_report(channel_info, posts, period, datetime.now(timezone.utc), groups, len(posts) - groups)
+        return self.loop.run_until_complete(analytics.add_topics(report, posts))
+
+fixtures = Fixtures()
+
+@case('analyze_channel')
+def bench_analyze_channel(size):
+    """Полный анализ: разрешение канала, чтение (лимит приложения), агрегация, темы"""
+    analytics = fixtures.analytics(size)
+    return lambda: fixtures.loop.run_until_complete(analytics.analyze_channel('bench', hours_back=ANALYSIS_HOURS))
+
+@case('fetch_and_build')
+def bench_fetch_and_build(size):
+    """Чтение всех size сообщений со сборкой альбомов и построение отчета"""
+    analytics = fixtures.analytics(size)
+    channel_info = {'id': 1000, 'title': 'Бенчмарк канал', 'username': 'bench', 'subscribers': 150000}
+    period = {'hours_back': ANALYSIS_HOURS, 'actual_period': '30 дней', 'used_fallback': False}
+
+    def run():
+        posts, info = fixtures.loop.run_until_complete(analytics.fetch_posts('bench', limit=size))
+        return analytics.build_report(channel_info, posts, period, info['last_message_date'], 0, len(posts))
+    return run
+
+@case('process_message_group')
+def bench_process_message_group(size):
+    """Обработка альбомов по 10 сообщений"""
+    analytics = fixtures.analytics(size)
+    messages = fixtures.channel(size).messages
+    groups = [messages[i:i + 10] for i in range(0, len(messages), 10)]
+    return lambda: [analytics._process_message_group(group) for group in groups]
+
+@case('categorize_single_content')
+def bench_categorize_single_content(size):
+    analytics = fixtures.analytics(size)
+    messages = fixtures.channel(size).messages
+    return lambda: [analytics._categorize_single_content(msg) for msg in messages]
+
+@case('get_time_analysis')
+def bench_get_time_analysis(size):
+    analytics, posts = fixtures.posts(size)
+    return lambda: analytics.get_time_analysis(posts)
+
+@case('engagement_and_recommendations')
+def bench_engagement_and_recommendations(size):
+    """calculate_engagement_rate и generate_recommendations по агрегатам отчета"""
+    analytics = fixtures.analytics(size)
+    report = fixtures.report(size)
+    summary = report['summary']
+
+    def run():
+        engagement = analytics.calculate_engagement_rate(summary['total_views'], summary['total_reactions'],
+                                                         summary['total_comments'], summary['total_forwards'], 150000)
+        return analytics.generate_recommendations(report['content_analysis'], report['time_analysis'], engagement,
+                                                  summary['total_posts'], ANALYSIS_HOURS)
+    return run
+
+@case('serialize_report')
+def bench_serialize_report(size):
+    """JSON отчета /analyze"""
+    from AppAI import dumps_json
+
+    report = fixtures.report(size)
+    return lambda: dumps_json(report)
+
+@case('serialize_posts')
+def bench_serialize_posts(size):
+    """JSON списка из всех постов (как история канала)"""
+    from AppAI import dumps_json
+
+    _, posts = fixtures.posts(size)
+    return lambda: dumps_json(posts)
+
+@case('generate_pdf', params=tuple(PDF_REPORTS))
+def bench_generate_pdf(variant):
+    """PDF отчета с коротким и длинным текстом ИИ"""
+    from pdf_report import render_pdf_report
+
+    report = fixtures.report(1000)
+    ai_report = make_ai_report(PDF_REPORTS[variant])
+    directory = tempfile.mkdtemp()
+    return lambda: render_pdf_report(report, ai_report, os.path.join(directory, 'report.pdf'))
+
+def measure(func, min_time, min_rounds, max_rounds):
+    """Повторные замеры: не меньше min_rounds и min_time секунд, не больше max_rounds"""
+    times = []
+    started = time.perf_counter()
+    while len(times) < max_rounds and (len(times) < min_rounds or time.perf_counter() - started < min_time):
+        begin = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - begin)
+    return {
+        'rounds': len(times),
+        'min_ms': round(min(times) * 1000, 3),
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'mean_ms': round(statistics.fmean(times) * 1000, 3)
+    }
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def current_commit():
+    """Короткий sha HEAD; -dirty при незакоммиченных изменениях кода"""
+    sha = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    if git('status', '--porcelain', '--untracked-files=no'):
+        sha += '-dirty'
+    return sha
+
+def load_results(reference):
+    """Результаты по пути к файлу, sha или ref git"""
+    if os.path.exists(reference):
+        path = reference
+    else:
+        sha = git('rev-parse', '--short', reference) or reference
+        path = os.path.join(RESULTS_DIR, f"{sha}.json")
+    if not os.path.exists(path):
+        sys.exit(f"Нет результатов для сравнения: {path}")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compare(results, baseline, threshold):
+    """Таблица сравнения по минимальному времени; возвращает число замедлений"""
+    previous = {(row['case'], str(row['param'])): row for row in baseline['results']}
+    regressions = 0
+    print(f"\nСравнение с {baseline['commit']} (по min, порог +{threshold:.0%})")
+    print(f"  {'случай':<34}{'параметр':>10}{'было мс':>12}{'стало мс':>12}{'x':>8}")
+    for row in results:
+        old = previous.get((row['case'], str(row['param'])))
+        if not old:
+            continue
+        ratio = row['min_ms'] / old['min_ms'] if old['min_ms'] else 1.0
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  медленнее'
+            regressions += 1
+        elif ratio < 1 / (1 + threshold):
+            mark = '  быстрее'
+        print(f"  {row['case']:<34}{row['param']:>10}{old['min_ms']:>12.3f}{row['min_ms']:>12.3f}{ratio:>8.2f}{mark}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES), help='числа сообщений')
+    parser.add_argument('--only', help='случаи через запятую (префиксы имен)')
+    parser.add_argument('--min-time', type=float, default=0.5, help='секунд замеров на случай')
+    parser.add_argument('--min-rounds', type=int, default=3)
+    parser.add_argument('--max-rounds', type=int, default=200)
+    parser.add_argument('--compare', help='sha, ref или файл результатов для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление (0.2 = 20%%)')
+    parser.add_argument('--check', action='store_true', help='код выхода 1 при замедлении')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)  # Логи анализа искажают замеры
+    sizes = [int(size) for size in args.sizes.split(',')]
+    selected = [name for name in CASES
+                if not args.only or any(name.startswith(prefix.strip()) for prefix in args.only.split(','))]
+
+    results = []
+    print(f"  {'случай':<34}{'параметр':>10}{'раундов':>9}{'min мс':>12}{'медиана мс':>12}")
+    for name in selected:
+        setup, params = CASES[name]
+        for param in params or sizes:
+            stats = measure(setup(param), args.min_time, args.min_rounds, args.max_rounds)
+            results.append({'case': name, 'param': param, **stats})
+            print(f"  {name:<34}{param:>10}{stats['rounds']:>9}{stats['min_ms']:>12.3f}{stats['median_ms']:>12.3f}")
+
+    commit = current_commit()
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{commit}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'commit': commit,
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'machine': f"{platform.system()} {platform.machine()}",
+                'results': results
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены: {os.path.relpath(path, ROOT)}")
+
+    if args.compare:
+        regressions = compare(results, load_results(args.compare), args.threshold)
+        if args.check and regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Индекс каналов аккаунта для поиска по названию и username.
+
+Каналы из диалогов (iter_dialogs) хранятся в памяти и обновляются в фоне,
+поэтому поиск не обращается к Telegram. Поддерживаются точное совпадение
+username, поиск по началу слов названия (отсортированный список слов и bisect)
+и нечеткий поиск по триграммам - для опечаток и неполных названий.
+"""
+import re
+import bisect
+import heapq
+import threading
+import time
+
+WORD_RE = re.compile(r'[0-9a-zа-яё_]+')
+
+# Источники записей: диалоги аккаунта сверяются при полном обновлении,
+# найденные через contacts.Search живут до вытеснения по сроку
+SOURCE_DIALOG = 'dialog'
+SOURCE_SEARCH = 'search'
+
+def normalize(text):
+    """Нижний регистр, ё -> е, без @ и ссылки t.me"""
+    value = (text or '').strip().lower().replace('ё', 'е')
+    for prefix in ('https://t.me/', 'http://t.me/', 't.me/'):
+        if value.startswith(prefix):
+            value = value[len(prefix):]
+    return value.lstrip('@')
+
+def trigrams(text):
+    """Множество триграмм слов текста (с границами слов, как в pg_trgm)"""
+    result = set()
+    for word in WORD_RE.findall(normalize(text)):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+class DialogIndex:
+    """Каналы по id с префиксным и триграммным индексами.
+
+    Запись - словарь с id, title, username, participants_count и source.
+    Все операции под одной блокировкой: индекс читают потоки Flask,
+    а обновляет задача в event loop.
+    """
+
+    def __init__(self, min_similarity=0.3, search_ttl=24 * 3600):
+        self.min_similarity = min_similarity
+        self.search_ttl = search_ttl
+        self.channels = {}  # id канала -> запись
+        self.usernames = {}  # username -> id канала
+        self.titles = {}  # id канала -> нормализованное название
+        self.words = []  # Отсортированные пары (слово, id канала)
+        self.trigram_postings = {}  # триграмма -> множество id каналов
+        self.channel_trigrams = {}  # id канала -> множество триграмм
+        self.added_at = {}  # id канала -> время добавления (для записей из поиска)
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _words(entry):
+        words = set(WORD_RE.findall(normalize(entry['title'])))
+        if entry['username']:
+            words.add(normalize(entry['username']))
+        return words
+
+    def _add(self, entry):
+        channel_id = entry['id']
+        self.channels[channel_id] = entry
+        self.added_at[channel_id] = time.time()
+        self.titles[channel_id] = normalize(entry['title'])
+        if entry['username']:
+            self.usernames[normalize(entry['username'])] = channel_id
+        for word in self._words(entry):
+            bisect.insort(self.words, (word, channel_id))
+        grams = trigrams(f"{entry['title']} {entry['username'] or ''}")
+        self.channel_trigrams[channel_id] = grams
+        for gram in grams:
+            self.trigram_postings.setdefault(gram, set()).add(channel_id)
+
+    def _remove(self, channel_id):
+        entry = self.channels.pop(channel_id, None)
+        if entry is None:
+            return
+        self.added_at.pop(channel_id, None)
+        self.titles.pop(channel_id, None)
+        if entry['username'] and self.usernames.get(normalize(entry['username'])) == channel_id:
+            del self.usernames[normalize(entry['username'])]
+        for word in self._words(entry):
+            position = bisect.bisect_left(self.words, (word, channel_id))
+            if position < len(self.words) and self.words[position] == (word, channel_id):
+                del self.words[position]
+        for gram in self.channel_trigrams.pop(channel_id, ()):
+            postings = self.trigram_postings.get(gram)
+            if postings:
+                postings.discard(channel_id)
+                if not postings:
+                    del self.trigram_postings[gram]
+
+    def upsert(self, entry):
+        """Добавление или обновление канала; True если запись изменилась"""
+        with self.lock:
+            current = self.channels.get(entry['id'])
+            if current is not None:
+                if current['source'] == SOURCE_DIALOG and entry['source'] != SOURCE_DIALOG:
+                    entry = dict(entry, source=SOURCE_DIALOG)  # Канал из диалогов не становится "найденным"
+                if current == entry:
+                    return False
+                self._remove(entry['id'])
+            self._add(entry)
+            return True
+
+    def sync_dialogs(self, entries):
+        """Полная сверка с диалогами аккаунта: (добавлено или изменено, удалено)"""
+        changed = sum(self.upsert(entry) for entry in entries)
+        seen = {entry['id'] for entry in entries}
+        now = time.time()
+        with self.lock:
+            stale = [channel_id for channel_id, entry in self.channels.items()
+                     if (entry['source'] == SOURCE_DIALOG and channel_id not in seen)
+                     or (entry['source'] == SOURCE_SEARCH and now - self.added_at[channel_id] > self.search_ttl)]
+            for channel_id in stale:
+                self._remove(channel_id)
+            self.refreshed_at = now
+        return changed, len(stale)
+
+    def search(self, query, limit=10):
+        """Каналы по запросу, лучшие первыми; у результата поля match и score"""
+        value = normalize(query)
+        query_words = WORD_RE.findall(value)
+        if not query_words:
+            return []
+
+        with self.lock:
+            scores = {}
+
+            def add(channel_id, score, match):
+                if score > scores.get(channel_id, (0, None))[0]:
+                    scores[channel_id] = (score, match)
+
+            # Точный username
+            if value in self.usernames:
+                add(self.usernames[value], 3.0, 'username')
+
+            # Каждое слово запроса - начало какого-либо слова названия или username
+            matched = None
+            for word in query_words:
+                ids = set()
+                position = bisect.bisect_left(self.words, (word,))
+                while position < len(self.words) and self.words[position][0].startswith(word):
+                    ids.add(self.words[position][1])
+                    position += 1
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    break
+            for channel_id in matched or ():
+                title = self.titles[channel_id]
+                add(channel_id, 2.0 if title == value else 1.0 + min(len(value) / max(len(title), 1), 0.99), 'prefix')
+
+            # Нечеткое совпадение (коэффициент Жаккара по триграммам) - только если точных не хватает
+            if len(scores) < limit:
+                query_grams = trigrams(value)
+                shared = {}
+                for gram in query_grams:
+                    for channel_id in self.trigram_postings.get(gram, ()):
+                        shared[channel_id] = shared.get(channel_id, 0) + 1
+                for channel_id, count in shared.items():
+                    similarity = count / (len(query_grams) + len(self.channel_trigrams[channel_id]) - count)
+                    if similarity >= self.min_similarity:
+                        add(channel_id, similarity, 'fuzzy')
+
+            best = heapq.nlargest(limit, scores.items(),
+                                  key=lambda item: (item[1][0], self.channels[item[0]]['participants_count'] or 0))
+            results = []
+            for channel_id, (score, match) in best:
+                result = dict(self.channels[channel_id])
+                result['match'] = match
+                result['score'] = round(score, 4)
+                results.append(result)
+            return results
+
+    def stats(self):
+        with self.lock:
+            return {'channels': len(self.channels), 'words': len(self.words),
+                    'trigrams': len(self.trigram_postings), 'refreshed_at': self.refreshed_at}
@@ -0,0 +1,151 @@
+"""Потоковая запись строк экспорта в CSV, NDJSON и Parquet.
+
+Каждый писатель принимает итератор словарей с колонками EXPORT_COLUMNS и
+возвращает итератор байтовых порций для потокового ответа. В памяти держится
+только текущая порция строк (для Parquet - одна группа строк), поэтому размер
+выгрузки не ограничен памятью процесса. Parquet требует пакета pyarrow,
+который импортируется только при выгрузке Parquet.
+
+Итог выгрузки (словарь cursor: has_more, count, scanned, before_id) заполняется
+после чтения всех строк и записывается в конец файла, чтобы обрезанная по
+лимиту или оборванная ошибкой выгрузка не выглядела полной:
+
+- NDJSON - последняя строка {"cursor": {...}} или {"error": ..., "cursor": {...}};
+- CSV - последняя строка-комментарий "# cursor: has_more=... count=..." или
+  "# error: ..." (pandas пропускает ее с comment='#'); нет такой строки -
+  соединение оборвалось;
+- Parquet - метаданные файла export.has_more, export.count, export.before_id;
+  при ошибке файл остается без footer и не читается.
+"""
+import csv
+import importlib.util
+import io
+import json
+
+EXPORT_COLUMNS = ('id', 'date', 'content_type', 'group_size', 'views', 'reactions', 'forwards', 'comments')
+CSV_BATCH_ROWS = 1000  # Строк в одной порции CSV/NDJSON
+PARQUET_ROW_GROUP = 10000  # Строк в группе Parquet
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),  # charset=utf-8 Flask добавит сам
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+_has_pyarrow = None
+
+def available_formats():
+    global _has_pyarrow
+    if _has_pyarrow is None:
+        _has_pyarrow = importlib.util.find_spec('pyarrow') is not None
+    return [name for name in FORMATS if name != 'parquet' or _has_pyarrow]
+
+def _json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+def iter_csv(rows, cursor, batch_rows=CSV_BATCH_ROWS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    try:
+        for row in rows:
+            writer.writerow([row['date'].isoformat() if column == 'date' else row[column] for column in EXPORT_COLUMNS])
+            count += 1
+            if count % batch_rows == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception as e:
+        error = ' '.join(str(e).split())
+        yield (buffer.getvalue() + f"# error: {error}\n# cursor: {_csv_cursor(cursor)}\n").encode('utf-8')
+        raise
+    yield (buffer.getvalue() + f"# cursor: {_csv_cursor(cursor)}\n").encode('utf-8')
+
+def _csv_cursor(cursor):
+    return ' '.join(f"{key}={str(value).lower() if isinstance(value, bool) else value}" for key, value in cursor.items())
+
+def iter_ndjson(rows, cursor, batch_rows=CSV_BATCH_ROWS):
+    lines = []
+    try:
+        for row in rows:
+            lines.append(_json({**row, 'date': row['date'].isoformat()}))
+            if len(lines) >= batch_rows:
+                yield ('\n'.join(lines) + '\n').encode('utf-8')
+                lines = []
+    except Exception as e:
+        lines.append(_json({'error': str(e), 'cursor': cursor}))
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+        raise
+    lines.append(_json({'cursor': cursor}))
+    yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+class _ChunkSink:
+    """Файлоподобный приемник для ParquetWriter: записанное забирается порциями через drain()"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _parquet_schema(pyarrow):
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('date', pyarrow.timestamp('us', tz='UTC')),
+        ('content_type', pyarrow.string()),
+        ('group_size', pyarrow.int32()),
+        ('views', pyarrow.int64()),
+        ('reactions', pyarrow.int64()),
+        ('forwards', pyarrow.int64()),
+        ('comments', pyarrow.int64()),
+    ])
+
+def iter_parquet(rows, cursor, row_group=PARQUET_ROW_GROUP):
+    """Parquet по группам строк: каждая группа отдается сразу после записи"""
+    try:
+        import pyarrow
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise RuntimeError('Для экспорта в Parquet нужен пакет pyarrow')
+    schema = _parquet_schema(pyarrow)
+    sink = _ChunkSink()
+    writer = parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema, compression='zstd')
+    columns = {column: [] for column in EXPORT_COLUMNS}
+
+    def write_group():
+        writer.write_table(pyarrow.table(columns, schema=schema))
+        for values in columns.values():
+            values.clear()
+        return sink.drain()
+
+    for row in rows:
+        for column in EXPORT_COLUMNS:
+            columns[column].append(row[column])
+        if len(columns['id']) >= row_group:
+            yield write_group()
+    if columns['id']:
+        yield write_group()
+    writer.add_key_value_metadata({f"export.{key}": _json(value) for key, value in cursor.items()})
+    writer.close()
+    yield sink.drain()
+
+WRITERS = {'csv': iter_csv, 'ndjson': iter_ndjson, 'parquet': iter_parquet}
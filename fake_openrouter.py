@@ -0,0 +1,223 @@
+"""Локальная замена OpenRouter для нагрузочных тестов и бенчмарков ИИ анализа.
+
+Запуск: python fake_openrouter.py [--port 8089] [--latency 0.5] [--tokens-per-second 80]
+Приложение направляется на заглушку переменной окружения
+OPENROUTER_API_URL=http://127.0.0.1:8089/api/v1/chat/completions
+
+Реализует POST /api/v1/chat/completions в формате OpenAI/OpenRouter: обычный
+ответ и потоковый (SSE, "stream": true), finish_reason 'length' при нехватке
+max_tokens, usage с кэшированными токенами повторяющегося системного промпта
+и ошибки (доля --error-rate или заголовок X-Fake-Status в запросе).
+Только стандартная библиотека; ответ детерминирован для одинакового запроса.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('аудитория', 'канал', 'вовлеченность', 'публикации', 'охват', 'рост', 'контент', 'просмотры',
+         'реакции', 'рекомендуется', 'стратегия', 'формат', 'время', 'подписчики', 'динамика', 'тема')
+
+ERRORS = {
+    400: 'Bad request',
+    401: 'No auth credentials found',
+    402: 'Insufficient credits',
+    429: 'Rate limit exceeded',
+    500: 'Internal server error',
+    502: 'Provider returned error',
+    503: 'No available providers'
+}
+
+def count_tokens(text):
+    """Та же грубая оценка, что и в приложении: ~3 символа на токен"""
+    return max(1, len(text) // 3)
+
+class FakeOpenRouter:
+    """Генерация ответов и состояние кэша системных промптов"""
+
+    def __init__(self, latency=0.5, tokens_per_second=80.0, response_tokens=1500, error_rate=0.0, error_code=500, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.cached_prefixes = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def choose_error(self, forced_status):
+        if forced_status:
+            return int(forced_status)
+        with self.lock:
+            self.requests += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.error_code
+        return None
+
+    def generate_tokens(self, payload):
+        """Детерминированный текст ответа (список токенов) для запроса"""
+        messages = payload.get('messages') or []
+        prompt = messages[-1]['content'] if messages else ''
+        digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode('utf-8')).digest()
+        rng = random.Random(digest)
+
+        # Заголовок раздела из задания или первый пункт цельного отчета
+        title = '1. Краткое резюме по каналу'
+        if "Напиши раздел '" in prompt:
+            title = prompt.split("Напиши раздел '", 1)[1].split("'", 1)[0]
+
+        tokens = [title + '\n']
+        while len(tokens) < self.response_tokens:
+            sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))).capitalize()
+            tokens.extend(word + ' ' for word in sentence.split())
+            tokens[-1] = tokens[-1].rstrip() + ('.\n' if rng.random() < 0.2 else '. ')
+        return tokens[:self.response_tokens]
+
+    def usage(self, payload, completion_tokens):
+        messages = payload.get('messages') or []
+        prompt_tokens = sum(count_tokens(message.get('content', '')) for message in messages)
+        cached_tokens = 0
+        if messages and messages[0].get('role') == 'system':
+            prefix = hashlib.sha256(messages[0]['content'].encode('utf-8')).hexdigest()
+            with self.lock:
+                if prefix in self.cached_prefixes:
+                    cached_tokens = count_tokens(messages[0]['content'])
+                self.cached_prefixes.add(prefix)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens}
+        }
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'FakeOpenRouter/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'requests': self.server.fake.requests})
+        else:
+            self.send_json(404, {'error': {'message': 'Not found', 'code': 404}})
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/api/v1/chat/completions', '/v1/chat/completions'):
+            self.send_json(404, {'error': {'message': 'Not found', 'code': 404}})
+            return
+
+        fake = self.server.fake
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except json.JSONDecodeError:
+            self.send_json(400, {'error': {'message': ERRORS[400], 'code': 400}})
+            return
+
+        status = fake.choose_error(self.headers.get('X-Fake-Status'))
+        time.sleep(fake.latency)
+        if status:
+            headers = {'Retry-After': '1'} if status == 429 else None
+            self.send_json(status, {'error': {'message': ERRORS.get(status, 'Error'), 'code': status}}, headers)
+            return
+
+        tokens = fake.generate_tokens(payload)
+        max_tokens = payload.get('max_tokens') or len(tokens)
+        finish_reason = 'length' if len(tokens) > max_tokens else 'stop'
+        tokens = tokens[:max_tokens]
+        completion_id = f"gen-{uuid.uuid4().hex[:24]}"
+        model = payload.get('model', 'fake/model')
+
+        if payload.get('stream'):
+            self.stream(completion_id, model, tokens, finish_reason, fake.usage(payload, len(tokens)))
+            return
+
+        time.sleep(len(tokens) / fake.tokens_per_second)
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'provider': 'fake',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                'finish_reason': finish_reason
+            }],
+            'usage': fake.usage(payload, len(tokens))
+        })
+
+    def stream(self, completion_id, model, tokens, finish_reason, usage):
+        """Потоковый ответ: по одному токену в событии SSE с заданной скоростью"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(data):
+            self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        delay = 1 / self.server.fake.tokens_per_second
+        for token in tokens:
+            event({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                   'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]})
+            time.sleep(delay)
+        event({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+               'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish_reason}], 'usage': usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+def create_server(host='127.0.0.1', port=8089, verbose=False, **options):
+    """HTTP сервер заглушки (для запуска в потоке из тестов и бенчмарков)"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = FakeOpenRouter(**options)
+    server.verbose = verbose
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.5, help='задержка до первого токена, секунд')
+    parser.add_argument('--tokens-per-second', type=float, default=80.0)
+    parser.add_argument('--response-tokens', type=int, default=1500, help='длина ответа до обрезки max_tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов с ошибкой')
+    parser.add_argument('--error-code', type=int, default=500, choices=sorted(ERRORS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, verbose=args.verbose, latency=args.latency,
+                           tokens_per_second=args.tokens_per_second, response_tokens=args.response_tokens,
+                           error_rate=args.error_rate, error_code=args.error_code, seed=args.seed)
+    print(f"Fake OpenRouter: http://{args.host}:{args.port}/api/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Тестовый Telegram клиент с синтетическими каналами для офлайн нагрузочных тестов.
+
+Подключается вместо TelethonClient переменной окружения TELEGRAM_BACKEND=fake
+и повторяет используемую приложением часть API Telethon: get_entity,
+get_messages, iter_messages, iter_dialogs, GetFullChannelRequest,
+contacts.SearchRequest, обработчики событий.
+Каналы генерируются детерминированно по зерну: частота постов, доля альбомов
+(grouped_id), смесь типов медиа, реакции и комментарии. Задержки RPC задаются
+моделью LatencyModel, FloodWaitError внедряется с заданной вероятностью.
+
+Настройка через окружение (см. FakeTelegramClient.from_env):
+FAKE_TELEGRAM_CHANNELS=5, FAKE_TELEGRAM_POSTS_PER_DAY=12, FAKE_TELEGRAM_DAYS=60,
+FAKE_TELEGRAM_ALBUM_RATIO=0.15, FAKE_TELEGRAM_LATENCY=0.05, FAKE_TELEGRAM_FLOOD_RATE=0,
+FAKE_TELEGRAM_SEED=1, FAKE_TELEGRAM_DIALOGS (сколько каналов в диалогах аккаунта,
+по умолчанию все). Каналы доступны как @fake_channel_0 ... @fake_channel_N.
+"""
+import asyncio
+import math
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from telethon import events
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.contacts import SearchRequest
+from telethon.tl.types import (PeerChannel, MessageMediaPhoto, MessageMediaDocument,
+                               MessageReactions, ReactionCount, ReactionEmoji, MessageReplies)
+
+WORDS = ('новости', 'рынок', 'аналитика', 'запуск', 'продукт', 'обзор', 'инвестиции', 'команда', 'рост',
+         'подписчики', 'реклама', 'стратегия', 'контент', 'видео', 'интервью', 'технологии', 'крипто',
+         'стартап', 'итоги', 'прогноз', 'telegram', 'ai', 'релиз', 'конференция', 'опрос')
+
+DEFAULT_MEDIA_MIX = {'text': 0.45, 'photo': 0.3, 'video': 0.15, 'document': 0.06, 'audio': 0.04}
+MIME_TYPES = {'video': 'video/mp4', 'audio': 'audio/mpeg', 'document': 'application/pdf'}
+REACTIONS = ('👍', '🔥', '❤', '😁', '👏')
+PAGE_SIZE = 100  # Как у Telethon: iter_messages читает историю страницами по 100
+
+class LatencyModel:
+    """Задержка RPC: база + время на элемент + случайный разброс"""
+
+    def __init__(self, base=0.05, per_item=0.0005, jitter=0.3, seed=0):
+        self.base = base
+        self.per_item = per_item
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    def delay(self, items=1):
+        value = self.base + self.per_item * items
+        return max(0.0, value * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+class FakeMessage:
+    """Сообщение канала с полями, которые читает приложение"""
+
+    def __init__(self, id, date, text='', media=None, grouped_id=None, views=0, forwards=0, reactions=None, replies=None):
+        self.id = id
+        self.date = date
+        self.message = text
+        self.text = text
+        self.media = media
+        self.grouped_id = grouped_id
+        self.views = views
+        self.forwards = forwards
+        self.reactions = reactions
+        self.replies = replies
+
+    def __repr__(self):
+        return f"FakeMessage(id={self.id}, grouped_id={self.grouped_id}, date={self.date:%Y-%m-%d %H:%M})"
+
+class FakeChannel:
+    """Синтетический канал: сущность и сообщения по убыванию id"""
+
+    def __init__(self, id, username, title, subscribers, about=''):
+        self.entity = SimpleNamespace(id=id, username=username, title=title, participants_count=subscribers,
+                                      about=about, broadcast=True)
+        self.subscribers = subscribers
+        self.messages = []
+
+    @property
+    def id(self):
+        return self.entity.id
+
+def _make_media(kind):
+    if kind == 'photo':
+        return MessageMediaPhoto()
+    if kind in MIME_TYPES:
+        return MessageMediaDocument(document=SimpleNamespace(mime_type=MIME_TYPES[kind]))
+    return None
+
+def _make_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def generate_channel(channel_id, username, title=None, subscribers=50000, posts_per_day=12, days=60,
+                     album_ratio=0.15, media_mix=None, seed=0, now=None):
+    """Генерация канала с постами за days дней.
+
+    Посты распределены по времени процессом Пуассона с суточным ритмом,
+    альбомы занимают 2-10 подряд идущих id с общим grouped_id, просмотры
+    распределены логнормально относительно числа подписчиков.
+    """
+    rng = random.Random(seed)
+    media_mix = media_mix or DEFAULT_MEDIA_MIX
+    kinds, weights = zip(*media_mix.items())
+    now = now or datetime.now(timezone.utc)
+    channel = FakeChannel(channel_id, username, title or f"Тестовый канал {username}", subscribers,
+                          about=_make_text(rng, 20))
+
+    # Время постов: от старых к новым, чаще днем
+    times = []
+    moment = now - timedelta(days=days)
+    while True:
+        moment += timedelta(hours=rng.expovariate(posts_per_day / 24))
+        if moment >= now:
+            break
+        if rng.random() < 0.35 + 0.65 * math.sin(math.pi * ((moment.hour + 3) % 24) / 24):
+            times.append(moment)
+
+    message_id = 1
+    grouped_id = channel_id * 1000000
+    messages = []
+    for posted_at in times:
+        age_days = (now - posted_at).total_seconds() / 86400
+        views = int(subscribers * rng.lognormvariate(-1.2, 0.6) * min(1.0, 0.3 + age_days))
+        reactions = MessageReactions(results=[
+            ReactionCount(reaction=ReactionEmoji(emoticon), count=max(1, int(views * rng.uniform(0.001, 0.02))))
+            for emoticon in rng.sample(REACTIONS, rng.randint(1, 3))
+        ])
+        replies = MessageReplies(replies=int(views * rng.uniform(0, 0.004)), replies_pts=0)
+        forwards = int(views * rng.uniform(0, 0.01))
+        text = _make_text(rng, rng.randint(8, 120))
+
+        if rng.random() < album_ratio:
+            grouped_id += 1
+            size = rng.randint(2, 10)
+            for position in range(size):
+                kind = rng.choice(('photo', 'photo', 'video'))
+                messages.append(FakeMessage(
+                    message_id, posted_at, text=text if position == 0 else '', media=_make_media(kind),
+                    grouped_id=grouped_id, views=views, forwards=forwards if position == 0 else 0,
+                    reactions=reactions if position == 0 else None, replies=replies if position == 0 else None
+                ))
+                message_id += 1
+        else:
+            kind = rng.choices(kinds, weights)[0]
+            messages.append(FakeMessage(
+                message_id, posted_at, text=text if kind == 'text' or rng.random() < 0.7 else '',
+                media=_make_media(kind), views=views, forwards=forwards, reactions=reactions, replies=replies
+            ))
+            message_id += 1
+
+    channel.messages = messages[::-1]
+    return channel
+
+class FakeTelegramClient:
+    """Замена TelegramClient для синтетических каналов"""
+
+    def __init__(self, channels=(), latency=None, flood_wait_rate=0.0, flood_wait_seconds=3, seed=0, dialogs=None):
+        self.channels = {channel.id: channel for channel in channels}
+        # id каналов, на которые подписан аккаунт (по умолчанию все)
+        self.dialogs = list(self.channels) if dialogs is None else list(dialogs)
+        self.usernames = {channel.entity.username.lower(): channel for channel in channels}
+        self.latency = latency or LatencyModel(seed=seed)
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.random = random.Random(seed)
+        self.handlers = []
+        self.connected = False
+        self.rpc_count = 0
+
+    @classmethod
+    def from_env(cls):
+        """Клиент с каналами по переменным окружения FAKE_TELEGRAM_*"""
+        seed = int(os.getenv('FAKE_TELEGRAM_SEED', 1))
+        channels = [
+            generate_channel(
+                1000000 + i, f"fake_channel_{i}",
+                subscribers=int(os.getenv('FAKE_TELEGRAM_SUBSCRIBERS', 50000)) * (i + 1),
+                posts_per_day=float(os.getenv('FAKE_TELEGRAM_POSTS_PER_DAY', 12)),
+                days=int(os.getenv('FAKE_TELEGRAM_DAYS', 60)),
+                album_ratio=float(os.getenv('FAKE_TELEGRAM_ALBUM_RATIO', 0.15)),
+                seed=seed + i
+            )
+            for i in range(int(os.getenv('FAKE_TELEGRAM_CHANNELS', 5)))
+        ]
+        dialogs = os.getenv('FAKE_TELEGRAM_DIALOGS')
+        return cls(
+            channels,
+            dialogs=[channel.id for channel in channels[:int(dialogs)]] if dialogs else None,
+            latency=LatencyModel(base=float(os.getenv('FAKE_TELEGRAM_LATENCY', 0.05)), seed=seed),
+            flood_wait_rate=float(os.getenv('FAKE_TELEGRAM_FLOOD_RATE', 0)),
+            seed=seed
+        )
+
+    # Подключение и авторизация
+
+    async def connect(self):
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def is_user_authorized(self):
+        return True
+
+    async def start(self, *args, **kwargs):
+        self.connected = True
+        return self
+
+    async def get_me(self):
+        return SimpleNamespace(id=1, bot=False, first_name='Fake', phone='+70000000000')
+
+    # RPC
+
+    async def _rpc(self, items=1):
+        """Задержка запроса и случайный FloodWaitError"""
+        self.rpc_count += 1
+        await asyncio.sleep(self.latency.delay(items))
+        if self.flood_wait_rate and self.random.random() < self.flood_wait_rate:
+            raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+
+    def _resolve(self, peer):
+        """Канал по username, ссылке, id, -100id, PeerChannel или сущности"""
+        if isinstance(peer, FakeChannel):
+            return peer
+        if isinstance(peer, PeerChannel):
+            peer = peer.channel_id
+        elif isinstance(peer, SimpleNamespace):
+            peer = peer.id
+        if isinstance(peer, str):
+            value = peer.strip().lower().replace('https://t.me/', '').lstrip('@')
+            if value.lstrip('-').isdigit():
+                peer = int(value)
+            else:
+                channel = self.usernames.get(value)
+                if channel is None:
+                    raise ValueError(f'No user has "{value}" as username')
+                return channel
+        channel_id = abs(peer)
+        if channel_id not in self.channels and str(channel_id).startswith('100'):
+            channel_id = int(str(channel_id)[3:])  # Формат -100<id>
+        if channel_id not in self.channels:
+            raise ValueError(f'Could not find the input entity for PeerChannel(channel_id={peer})')
+        return self.channels[channel_id]
+
+    async def get_entity(self, peer):
+        await self._rpc()
+        return self._resolve(peer).entity
+
+    async def __call__(self, request):
+        if isinstance(request, GetFullChannelRequest):
+            await self._rpc()
+            channel = self._resolve(request.channel)
+            return SimpleNamespace(full_chat=SimpleNamespace(participants_count=channel.subscribers,
+                                                             about=channel.entity.about))
+        if isinstance(request, SearchRequest):
+            await self._rpc()
+            query = request.q.lower().lstrip('@')
+            chats = [channel.entity for channel in self.channels.values()
+                     if query in channel.entity.title.lower() or query in channel.entity.username.lower()]
+            return SimpleNamespace(chats=chats[:request.limit], users=[], my_results=[], results=[])
+        raise NotImplementedError(f'{type(request).__name__} не поддерживается тестовым клиентом')
+
+    async def iter_messages(self, entity, limit=None, offset_id=0, min_id=0, max_id=0, reverse=False, offset_date=None):
+        """История по убыванию id страницами по 100 сообщений (reverse - по возрастанию)"""
+        channel = self._resolve(entity)
+        messages = [msg for msg in channel.messages
+                    if (not offset_id or (msg.id > offset_id if reverse else msg.id < offset_id))
+                    and (not offset_date or (msg.date > offset_date if reverse else msg.date < offset_date))
+                    and msg.id > min_id and (not max_id or msg.id < max_id)]
+        if reverse:
+            messages.reverse()
+        if limit is not None:
+            messages = messages[:limit]
+        for start in range(0, len(messages), PAGE_SIZE):
+            page = messages[start:start + PAGE_SIZE]
+            await self._rpc(len(page))
+            for msg in page:
+                yield msg
+
+    async def iter_dialogs(self, limit=None):
+        """Каналы аккаунта от недавно активных, страницами по 100 диалогов"""
+        channels = sorted((self.channels[channel_id] for channel_id in self.dialogs),
+                          key=lambda channel: channel.messages[0].date if channel.messages else datetime.min.replace(tzinfo=timezone.utc),
+                          reverse=True)[:limit]
+        for start in range(0, len(channels), PAGE_SIZE):
+            page = channels[start:start + PAGE_SIZE]
+            await self._rpc(len(page))
+            for channel in page:
+                yield SimpleNamespace(id=int(f"-100{channel.id}"), name=channel.entity.title, entity=channel.entity,
+                                      date=channel.messages[0].date if channel.messages else None,
+                                      pinned=False, is_channel=True)
+
+    async def get_messages(self, entity, limit=None, ids=None, **kwargs):
+        if ids is not None:
+            channel = self._resolve(entity)
+            await self._rpc(len(ids))
+            by_id = {msg.id: msg for msg in channel.messages}
+            return [by_id.get(message_id) for message_id in ids]
+        return [msg async for msg in self.iter_messages(entity, limit=limit, **kwargs)]
+
+    # События
+
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self.handlers = [(handler, builder) for handler, builder in self.handlers
+                         if handler is not callback or (event is not None and builder is not event)]
+
+    async def publish(self, channel_identifier, text='', media_kind='text', grouped_id=None, views=0, edit_id=None):
+        """Новое (или отредактированное, edit_id) сообщение канала с вызовом обработчиков событий"""
+        channel = self._resolve(channel_identifier)
+        if edit_id is not None:
+            msg = next(msg for msg in channel.messages if msg.id == edit_id)
+            msg.text = msg.message = text
+            msg.views = views or msg.views
+            event_type = events.MessageEdited
+        else:
+            msg = FakeMessage((channel.messages[0].id if channel.messages else 0) + 1, datetime.now(timezone.utc),
+                              text=text, media=_make_media(media_kind), grouped_id=grouped_id, views=views)
+            channel.messages.insert(0, msg)
+            event_type = events.NewMessage
+
+        for callback, builder in list(self.handlers):
+            if type(builder) is not event_type:
+                continue
+            chats = builder.chats if isinstance(builder.chats, (list, tuple, set)) else [builder.chats]
+            if builder.chats is None or any(self._resolve(chat) is channel for chat in chats):
+                await callback(SimpleNamespace(message=msg, chat_id=channel.id))
+        return msg
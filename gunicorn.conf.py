@@ -0,0 +1,21 @@
+"""Запуск нескольких воркеров: gunicorn -c gunicorn.conf.py AppAI:app
+
+Telegram клиент держит один воркер-владелец (flock), остальные пересылают ему
+запросы к Telegram через Unix сокет. Кэш PDF, задачи и версии отчетов - в общем
+хранилище SHARED_STORE_URL (SQLite по умолчанию, Redis для нескольких машин).
+"""
+import os
+
+os.environ.setdefault('TELEGRAM_OWNER_MODE', 'shared')
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5050)}"
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = 180  # Анализ с AI может идти дольше минуты
+preload_app = False  # У каждого воркера свой event loop и свое подключение к хранилищу
+
+def post_worker_init(worker):
+    """Фоновые службы воркера: event loop, прогрев, Telegram у владельца"""
+    from AppAI import start_background_services
+    start_background_services()
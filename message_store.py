@@ -0,0 +1,147 @@
+"""Локальный архив постов каналов для полной истории (backfill).
+
+Посты хранятся в SQLite компактно: метрики в целочисленных колонках, дата -
+секунды Unix, текст сжат zlib; таблица без rowid с ключом (канал, id поста).
+Там же хранится состояние обхода истории каждого канала - курсор и счетчики,
+которые сохраняются в одной транзакции с очередной страницей постов, поэтому
+обход продолжается с последней сохраненной страницы после перезапуска.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+POST_COLUMNS = ('id', 'date', 'content_type', 'is_group', 'group_size', 'views', 'reactions', 'forwards',
+                'comments', 'text_preview', 'text')
+
+class MessageStore:
+    """Посты и состояние обхода истории в файле SQLite (WAL)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        conn = self._connection()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS posts (
+                channel_id INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                date INTEGER NOT NULL,
+                content_type TEXT NOT NULL,
+                is_group INTEGER NOT NULL,
+                group_size INTEGER NOT NULL,
+                views INTEGER NOT NULL,
+                reactions INTEGER NOT NULL,
+                forwards INTEGER NOT NULL,
+                comments INTEGER NOT NULL,
+                text_preview TEXT,
+                text BLOB,
+                PRIMARY KEY (channel_id, id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS backfill_state (
+                channel_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+        ''')
+
+    def _connection(self):
+        """Соединение потока (sqlite3 не разрешает общее соединение между потоками)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(channel_id, post):
+        text = post.get('text') or ''
+        return (
+            channel_id, post['id'], int(post['date'].replace(tzinfo=timezone.utc).timestamp()), post['content_type'],
+            int(post['is_group']), post['group_size'], post['views'], post['reactions'], post['forwards'],
+            post['comments'], post['text_preview'], zlib.compress(text.encode('utf-8')) if text else None
+        )
+
+    @staticmethod
+    def _post(row):
+        post = dict(zip(POST_COLUMNS, row))
+        post['date'] = datetime.fromtimestamp(post['date'], timezone.utc)
+        post['is_group'] = bool(post['is_group'])
+        post['text'] = zlib.decompress(post['text']).decode('utf-8') if post['text'] else ''
+        return post
+
+    def save_page(self, channel_id, posts, state):
+        """Посты страницы и новое состояние обхода - одной транзакцией"""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             [self._row(channel_id, post) for post in posts])
+            conn.execute('INSERT OR REPLACE INTO backfill_state VALUES (?, ?)', (channel_id, json.dumps(state)))
+
+    def save_state(self, channel_id, state):
+        self._connection().execute('INSERT OR REPLACE INTO backfill_state VALUES (?, ?)', (channel_id, json.dumps(state)))
+
+    def get_state(self, channel_id):
+        row = self._connection().execute('SELECT state FROM backfill_state WHERE channel_id = ?', (channel_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def states(self):
+        return [json.loads(row[0]) for row in self._connection().execute('SELECT state FROM backfill_state')]
+
+    def iter_posts(self, channel_id, before_id=None, since=None, until=None, batch_size=1000):
+        """Посты канала по убыванию id, порциями из курсора SQLite"""
+        query = 'SELECT ' + ', '.join(POST_COLUMNS) + ' FROM posts WHERE channel_id = ?'
+        params = [channel_id]
+        if before_id is not None:
+            query += ' AND id < ?'
+            params.append(before_id)
+        if since is not None:
+            query += ' AND date >= ?'
+            params.append(int(since.timestamp()))
+        if until is not None:
+            query += ' AND date <= ?'
+            params.append(int(until.timestamp()))
+        cursor = self._connection().execute(query + ' ORDER BY id DESC', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield self._post(row)
+
+    def stats(self, channel_id):
+        """(постов, самый старый пост, самый новый пост) канала в архиве"""
+        count, oldest, newest = self._connection().execute(
+            'SELECT COUNT(*), MIN(date), MAX(date) FROM posts WHERE channel_id = ?', (channel_id,)
+        ).fetchone()
+        def to_date(value):
+            return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+        return count, to_date(oldest), to_date(newest)
+
+class RpcBudget:
+    """Ограничение частоты запросов к Telegram (token bucket) для фоновых задач"""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 10)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        """Ожидание права на один запрос"""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
@@ -0,0 +1,169 @@
+"""Метрики приложения в текстовом формате Prometheus (/metrics).
+
+Счетчики, гистограммы и gauge с метками хранятся в памяти процесса.
+Значения, которые дешевле посчитать при чтении (размер кэша и т.п.),
+задаются функцией через Registry.gauge(..., collect=...).
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 20 * 1024 ** 2, 100 * 1024 ** 2)
+FLOOD_WAIT_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 3600, 86400)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    """Метрика с набором меток; значения по кортежу значений меток"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.values[()] = self._initial()
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, None, value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        # collect возвращает число (без меток) или {кортеж значений меток: число}
+        collected = self.collect()
+        if not isinstance(collected, dict):
+            collected = {(): collected}
+        return [(self.name, key, None, value) for key, value in sorted(collected.items())]
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _initial(self):
+        return {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = self._initial()
+            state['buckets'][bisect.bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока в секундах (в том числе при исключении)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), state['buckets']):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, ('le', _format_value(float(bound))), cumulative))
+                samples.append((f"{self.name}_sum", key, None, state['sum']))
+                samples.append((f"{self.name}_count", key, None, state['count']))
+        return samples
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), collect=None):
+        return self._register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
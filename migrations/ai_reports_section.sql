@@ -0,0 +1,9 @@
+-- Кэш ИИ отчета по разделам (AI_REPORT_MODE=sections, "mode": "sections" в /ai_analyze).
+-- Строка с section = NULL - цельный отчет, иначе - один раздел (ключ из AI_SECTIONS).
+-- Применяется один раз в SQL редакторе Supabase; повторный запуск ничего не меняет.
+
+alter table ai_reports add column if not exists section text;
+
+-- Поиск свежих разделов и цельного отчета канала за период
+create index if not exists ai_reports_channel_period_idx
+    on ai_reports (channel_id, hours_back, section, created_at desc);
@@ -0,0 +1,367 @@
+"""Сборка PDF отчетов и графиков на ReportLab.
+
+Модуль загружается лениво (при первом запросе PDF или фоновым прогревом),
+чтобы импорт ReportLab и регистрация шрифтов не замедляли старт приложения.
+"""
+import os
+import re
+import logging
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, KeepTogether
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+from reportlab.platypus.flowables import Flowable
+from reportlab.graphics.shapes import Drawing
+from reportlab.graphics import renderPDF
+from reportlab.graphics.charts.barcharts import VerticalBarChart, HorizontalBarChart
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+logger = logging.getLogger(__name__)
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'fonts')
+PDF_FLOWABLE_BUFFER = 200  # Сколько элементов PDF держим в памяти одновременно
+CHART_WIDTH = 520  # Ширина рамки страницы за вычетом отступов
+CHART_HEIGHT = 180
+
+# Регистрируем шрифты с кириллицей один раз при загрузке модуля
+try:
+    pdfmetrics.registerFont(TTFont('DejaVuSans', os.path.join(FONTS_DIR, 'DejaVuSans.ttf')))
+    pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', os.path.join(FONTS_DIR, 'DejaVuSans-Bold.ttf')))
+    CYRILLIC_FONT_AVAILABLE = True
+except Exception:
+    logger.warning("Шрифты DejaVuSans не найдены. Кириллица в PDF может отображаться некорректно.")
+    CYRILLIC_FONT_AVAILABLE = False
+
+class LazyFlowables(list):
+    """Список элементов PDF, который подгружается из генератора по мере сборки документа.
+
+    ReportLab работает со списком (удаляет первый элемент, вставляет части
+    разбитых параграфов обратно в начало), поэтому держим в памяти только
+    небольшое окно элементов и дочитываем генератор при каждой проверке длины.
+    """
+    def __init__(self, source, buffer_size=PDF_FLOWABLE_BUFFER):
+        super().__init__()
+        self._source = iter(source)
+        self._buffer_size = buffer_size
+        self._exhausted = False
+
+    def _fill(self):
+        while not self._exhausted and list.__len__(self) < self._buffer_size:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._exhausted = True
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+def replace_content_terms(text):
+    """Замена англоязычных названий типов контента на русские"""
+    text = text.replace('mixed_media_with_text', 'текст + медиа')
+    text = text.replace('text', 'текст')
+    text = text.replace('photo', 'фото')
+    text = text.replace('video', 'видео')
+    text = text.replace('media', 'медиа')
+    return text
+
+def iter_text_lines(text, start=0):
+    """Построчный обход текста без создания полного списка строк"""
+    length = len(text)
+    while start <= length:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def iter_ai_report_flowables(ai_report, styles):
+    """Разбор markdown отчета ИИ в элементы PDF в виде генератора.
+
+    Секции разделены пустыми строками; первая строка секции вида "1. ..."
+    становится заголовком, строки с "-" превращаются в элементы списка.
+    """
+    yield Paragraph("ИИ Анализ", styles['HeaderRU'])
+    yield Spacer(1, 12)
+
+    start = 0
+    # Если есть пометка о кэше — добавляем её
+    if "кэша" in ai_report:
+        first_line_end = ai_report.find('\n')
+        cache_line = ai_report if first_line_end == -1 else ai_report[:first_line_end]
+        yield Paragraph(cache_line, styles['SmallRU'])
+        yield Spacer(1, 12)
+        # Пропускаем строку кэша в основном отчёте
+        start = len(ai_report) + 1 if first_line_end == -1 else first_line_end + 1
+
+    section_started = False
+    for raw_line in iter_text_lines(ai_report, start):
+        if not raw_line:
+            # Пустая строка закрывает секцию
+            if section_started:
+                yield Spacer(1, 8)
+                section_started = False
+            continue
+
+        # Обрабатываем строку - заменяем англоязычные термины и удаляем **
+        line = replace_content_terms(raw_line).replace('**', '').strip()
+        if not line:
+            continue
+
+        if not section_started:
+            section_started = True
+            # Первая строка секции, начинающаяся с цифры, - заголовок
+            if re.match(r'^\d+\.', line):
+                yield Paragraph(line, styles['BoldRU'])
+                yield Spacer(1, 8)
+                continue
+
+        if line.startswith('-'):
+            # Элемент списка
+            yield Paragraph(f"• {line[1:].strip()}", styles['NormalRU'])
+        else:
+            # Обычная строка
+            yield Paragraph(line, styles['NormalRU'])
+
+    if section_started:
+        yield Spacer(1, 8)
+
+def build_pdf_styles(is_mobile=False):
+    """Стили PDF отчета с поддержкой кириллицы"""
+    # Используем шрифты с поддержкой кириллицы
+    if CYRILLIC_FONT_AVAILABLE:
+        base_font = 'DejaVuSans'
+        bold_font = 'DejaVuSans-Bold'
+    else:
+        # Fallback на стандартные шрифты
+        base_font = 'Helvetica'
+        bold_font = 'Helvetica-Bold'
+
+    styles = getSampleStyleSheet()
+
+    # Переопределяем стандартные стили для поддержки кириллицы
+    styles['Normal'].fontName = base_font
+    styles['BodyText'].fontName = base_font
+    styles['Italic'].fontName = base_font
+    styles['Heading1'].fontName = bold_font
+    styles['Heading2'].fontName = bold_font
+    styles['Heading3'].fontName = bold_font
+
+    # Основные стили
+    styles.add(ParagraphStyle(
+        name='NormalRU',
+        fontName=base_font,
+        fontSize=10,
+        leading=12,
+        spaceAfter=6
+    ))
+
+    styles.add(ParagraphStyle(
+        name='HeaderRU',
+        fontName=bold_font,
+        fontSize=14,
+        textColor=colors.HexColor('#3B82F6'),
+        spaceAfter=12
+    ))
+
+    styles.add(ParagraphStyle(
+        name='SubheaderRU',
+        fontName=bold_font,
+        fontSize=12,
+        textColor=colors.HexColor('#2563EB'),
+        spaceAfter=8
+    ))
+
+    styles.add(ParagraphStyle(
+        name='SmallRU',
+        fontName=base_font,
+        fontSize=8,
+        textColor=colors.HexColor('#666666'),
+        spaceAfter=4,
+        leading=10
+    ))
+
+    # Добавляем стиль для жирного текста
+    styles.add(ParagraphStyle(
+        name='BoldRU',
+        fontName=bold_font,
+        fontSize=11,
+        leading=13,
+        spaceAfter=8,
+        spaceBefore=12
+    ))
+
+    if is_mobile:
+        styles['NormalRU'].fontSize = 9
+        styles['HeaderRU'].fontSize = 12
+        styles['SubheaderRU'].fontSize = 10
+        styles['SmallRU'].fontSize = 7
+
+    return styles, base_font, bold_font
+
+def iter_report_flowables(report_data, ai_report, styles, base_font, bold_font, charts=None):
+    """Последовательная генерация всех элементов PDF отчета"""
+    # Заголовок - сохраняем смайлы как есть
+    title = report_data['channel_info']['title']
+    yield Paragraph(
+        f"Аналитический отчет: {title}",
+        styles['HeaderRU']
+    )
+
+    # Период анализа
+    yield Paragraph(
+        f"Период анализа: {report_data['analysis_period']['hours_back']} часов",
+        styles['NormalRU']
+    )
+    yield Spacer(1, 20)
+
+    # Основные метрики
+    metrics = [
+        ['Метрика', 'Значение'],
+        ['Подписчиков', str(report_data['channel_info']['subscribers'])],
+        ['Всего постов', str(report_data['summary']['total_posts'])],
+        ['Всего просмотров', str(report_data['summary']['total_views'])],
+        ['Средний охват', str(round(report_data['summary']['avg_views_per_post'], 1))],
+        ['ER (просмотры)', f"{report_data['summary']['engagement_rate']['er_views']}%"],
+        ['ER (подписчики)', f"{report_data['summary']['engagement_rate']['er_subscribers']}%"]
+    ]
+
+    metrics_table = Table(metrics, colWidths=[200, 100])
+    metrics_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F3F4F6')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#1F2937')),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), bold_font),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#E5E7EB')),
+        ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#E5E7EB')),
+        ('FONTNAME', (0, 1), (-1, -1), base_font),
+        ('WORDWRAP', (0, 0), (-1, -1), True)
+    ]))
+
+    yield metrics_table
+    yield Spacer(1, 30)
+
+    # Графики - заранее отрисованные и закэшированные векторные изображения
+    for title, drawing in charts or []:
+        yield KeepTogether([Paragraph(title, styles['SubheaderRU']), CachedChart(drawing)])
+        yield Spacer(1, 16)
+
+    # Рекомендации - сохраняем смайлы как есть
+    yield Paragraph("Рекомендации", styles['HeaderRU'])
+    for rec in report_data.get('recommendations', []):
+        # Только заменяем названия типов контента, смайлы оставляем
+        yield Paragraph(f"• {replace_content_terms(rec)}", styles['NormalRU'])
+    yield Spacer(1, 20)
+
+    # Анализ ИИ - разбираем построчно, не держа весь отчет в виде элементов
+    if ai_report:
+        yield from iter_ai_report_flowables(ai_report, styles)
+
+    # Топ постов - сохраняем смайлы как есть
+    if report_data.get('top_posts'):
+        yield Paragraph("Топ постов", styles['HeaderRU'])
+        yield Spacer(1, 10)
+
+        # Упрощенный формат списка вместо таблицы
+        for i, post in enumerate(report_data['top_posts'][:3], 1):
+            content_type = post.get('content_type', '')
+            content_type = content_type.replace('mixed_media_with_text', 'текст + медиа')
+            content_type = content_type.replace('text', 'текст')
+            content_type = content_type.replace('photo', 'фото')
+            content_type = content_type.replace('video', 'видео')
+
+            preview = post.get('text_preview', '')
+            # Сохраняем смайлы в превью
+            if len(preview) > 60:
+                preview = preview[:57] + '...'
+
+            # Используем простой список вместо таблицы
+            post_info = f"{i}. {post.get('date', '')} - {post.get('views', 0)} просмотров"
+            yield Paragraph(post_info, styles['NormalRU'])
+            yield Paragraph(f"   Тип: {content_type}", styles['SmallRU'])
+            if preview:
+                yield Paragraph(f"   {preview}", styles['SmallRU'])
+            yield Spacer(1, 10)
+
+def render_pdf_report(report_data, ai_report, output_path, is_mobile=False, charts=None):
+    """Сборка PDF отчета напрямую в файл.
+
+    Элементы создаются генератором и передаются ReportLab небольшими порциями,
+    поэтому потребление памяти не растет с длиной отчета ИИ.
+    """
+    styles, base_font, bold_font = build_pdf_styles(is_mobile)
+
+    # Инициализация документа с UTF-8 кодировкой
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=letter,
+        rightMargin=30,
+        leftMargin=30,
+        topMargin=30,
+        bottomMargin=30,
+        encoding='utf-8',
+        pageCompression=1  # Страницы хранятся до сохранения, сжимаем их сразу
+    )
+
+    flowables = LazyFlowables(iter_report_flowables(report_data, ai_report, styles, base_font, bold_font, charts))
+    doc.build(flowables)
+    return os.path.getsize(output_path)
+
+class CachedChart(Flowable):
+    """Обертка над закэшированным графиком для одной сборки PDF.
+
+    ReportLab помечает перенесенные на следующую страницу элементы флагами,
+    поэтому общий Drawing из кэша не передается в документ напрямую.
+    """
+    def __init__(self, drawing):
+        super().__init__()
+        self.drawing = drawing
+        self.width = drawing.width
+        self.height = drawing.height
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        renderPDF.draw(self.drawing, self.canv, 0, 0)
+
+def render_chart(kind, data):
+    """Отрисовка графика в векторный Drawing"""
+    font = 'DejaVuSans' if CYRILLIC_FONT_AVAILABLE else 'Helvetica'
+    drawing = Drawing(CHART_WIDTH, CHART_HEIGHT)
+
+    if kind == 'top_posts':
+        # Горизонтальные столбцы, первый пост сверху
+        chart = HorizontalBarChart()
+        chart.x = 90
+        chart.width = CHART_WIDTH - 110
+        chart.data = [list(reversed(data['values']))]
+        chart.categoryAxis.categoryNames = list(reversed(data['labels']))
+    else:
+        chart = VerticalBarChart()
+        chart.x = 50
+        chart.width = CHART_WIDTH - 70
+        chart.data = [data['values']]
+        chart.categoryAxis.categoryNames = data['labels']
+        if kind == 'content':
+            chart.categoryAxis.labels.angle = 20
+            chart.categoryAxis.labels.boxAnchor = 'ne'
+
+    chart.y = 35
+    chart.height = CHART_HEIGHT - 50
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.labels.fontName = font
+    chart.valueAxis.labels.fontSize = 7
+    chart.categoryAxis.labels.fontName = font
+    chart.categoryAxis.labels.fontSize = 7
+    chart.bars[0].fillColor = colors.HexColor('#3B82F6')
+    chart.bars[0].strokeColor = None
+    drawing.add(chart)
+
+    # Разворачиваем виджет в примитивы, чтобы при повторной сборке PDF не пересчитывать разметку
+    return drawing.expandUserNodes()
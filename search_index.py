@@ -0,0 +1,262 @@
+"""Полнотекстовый поиск по постам каналов.
+
+Инвертированный индекс в памяти с русским стеммером (алгоритм Snowball)
+и ранжированием BM25. Индекс обновляется инкрементально по мере загрузки
+постов и не обращается к Telegram.
+"""
+import re
+import math
+import heapq
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+VOWELS = 'аеиоуыэюя'
+TOKEN_RE = re.compile(r'[0-9a-zа-яё]+')
+
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было
+вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас
+нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их
+чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при
+наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве три
+эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно
+всю между это the a an and or of to in on for is are was with at by from as it this that be
+""".split())
+
+PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+             'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+REFLEXIVE = ('ся', 'сь')
+VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+VERB_2 = ('уйте', 'ейте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены',
+          'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю')
+NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой',
+        'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы',
+        'ь', 'ю', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+def _by_length(*groups):
+    return tuple(sorted(set().union(*groups), key=len, reverse=True))
+
+# Проверяем сначала самые длинные окончания
+PERFECTIVE_GERUND = _by_length(PERFECTIVE_GERUND_1, PERFECTIVE_GERUND_2)
+PARTICIPLE = _by_length(PARTICIPLE_1, PARTICIPLE_2)
+VERB = _by_length(VERB_1, VERB_2)
+ADJECTIVE, NOUN, SUPERLATIVE, DERIVATIONAL = _by_length(ADJECTIVE), _by_length(NOUN), _by_length(SUPERLATIVE), _by_length(DERIVATIONAL)
+
+def _regions(word):
+    """Начала областей RV и R2 алгоритма Snowball"""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+def _strip(word, start, suffixes):
+    """Удаление самого длинного окончания из списка внутри области; None если не найдено"""
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= start:
+            return word[:-len(suffix)]
+    return None
+
+def _strip_group(word, start, suffixes, group_2):
+    """Как _strip, но окончания первой группы требуют перед собой 'а' или 'я'"""
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= start:
+            stem = word[:-len(suffix)]
+            if suffix in group_2:
+                return stem
+            if stem.endswith(('а', 'я')) and len(stem) - 1 >= start:
+                return stem
+    return None
+
+@lru_cache(maxsize=100000)
+def stem_russian(word):
+    """Стемминг русского слова (Snowball Russian stemmer)"""
+    word = word.replace('ё', 'е')
+    rv, r2 = _regions(word)
+    if rv >= len(word):
+        return word
+
+    # Шаг 1
+    stemmed = _strip_group(word, rv, PERFECTIVE_GERUND, PERFECTIVE_GERUND_2)
+    if stemmed is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        adjective = _strip(word, rv, ADJECTIVE)
+        if adjective is not None:
+            stemmed = _strip_group(adjective, rv, PARTICIPLE, PARTICIPLE_2) or adjective
+        else:
+            stemmed = _strip_group(word, rv, VERB, VERB_2)
+            if stemmed is None:
+                stemmed = _strip(word, rv, NOUN)
+    word = stemmed if stemmed is not None else word
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word = _strip(word, r2, DERIVATIONAL) or word
+
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        return word[:-1]
+    superlative = _strip(word, rv, SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+        if word.endswith('нн') and len(word) - 1 >= rv:
+            word = word[:-1]
+        return word
+    if word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+def iter_terms(text):
+    """Пары (слово, основа) текста без стоп-слов"""
+    for token in TOKEN_RE.findall((text or '').lower()):
+        if token in STOP_WORDS or len(token) < 2:
+            continue
+        yield token, stem_russian(token) if not token.isascii() else token
+
+def tokenize(text):
+    """Разбиение текста на нормализованные основы слов"""
+    return [stem for _, stem in iter_terms(text)]
+
+class SearchIndex:
+    """Инвертированный индекс постов с ранжированием BM25.
+
+    Документ - пост канала, ключ - (id канала, id поста). Повторное добавление
+    поста заменяет его (например, после редактирования или обновления метрик).
+    Самые старые документы вытесняются при превышении max_docs.
+    """
+
+    def __init__(self, max_docs=100000, k1=1.5, b=0.75):
+        self.max_docs = max_docs
+        self.k1 = k1
+        self.b = b
+        self.docs = OrderedDict()  # (id канала, id поста) -> документ
+        self.postings = {}  # основа -> {ключ документа: частота}
+        self.channels = {}  # id канала -> информация о канале
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def add_posts(self, channel_info, posts):
+        """Добавление или обновление постов канала"""
+        with self.lock:
+            self.channels[channel_info['id']] = {
+                'id': channel_info['id'],
+                'title': channel_info.get('title'),
+                'username': channel_info.get('username')
+            }
+            for post in posts:
+                self._add(channel_info['id'], post)
+            while len(self.docs) > self.max_docs:
+                self._remove(next(iter(self.docs)))
+
+    def remove_post(self, channel_id, post_id):
+        with self.lock:
+            self._remove((channel_id, post_id))
+
+    def _add(self, channel_id, post):
+        key = (channel_id, post['id'])
+        text_hash = hash(post.get('text'))
+        if key in self.docs:
+            if self.docs[key]['text_hash'] == text_hash:
+                # Текст не изменился - обновляем только метрики
+                self.docs[key]['post'] = self._stored_post(post)
+                return
+            self._remove(key)
+
+        terms = tokenize(post.get('text'))
+        if not terms:
+            return
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[key] = frequency
+        self.docs[key] = {'text_hash': text_hash, 'frequencies': frequencies, 'length': len(terms), 'post': self._stored_post(post)}
+        self.total_length += len(terms)
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if not doc:
+            return
+        self.total_length -= doc['length']
+        for term in doc['frequencies']:
+            postings = self.postings.get(term)
+            if postings:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+
+    @staticmethod
+    def _stored_post(post):
+        return {field: post.get(field) for field in
+                ('id', 'date', 'text_preview', 'views', 'reactions', 'forwards', 'comments', 'content_type')}
+
+    def search(self, query, channel_id=None, limit=20):
+        """Поиск постов по запросу; возвращает (найдено всего, лучшие результаты)"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+
+        with self.lock:
+            doc_count = len(self.docs)
+            if not doc_count:
+                return 0, []
+            avg_length = self.total_length / doc_count
+
+            scores = {}
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, frequency in postings.items():
+                    if channel_id is not None and key[0] != channel_id:
+                        continue
+                    length = self.docs[key]['length']
+                    denominator = frequency + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[key] = scores.get(key, 0) + idf * frequency * (self.k1 + 1) / denominator
+
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            results = []
+            for key, score in best:
+                result = dict(self.docs[key]['post'])
+                result['channel'] = self.channels.get(key[0])
+                result['score'] = round(score, 4)
+                results.append(result)
+            return len(scores), results
+
+    def find_channel_id(self, channel_identifier):
+        """Id проиндексированного канала по username или ID"""
+        value = str(channel_identifier).strip().lstrip('@').lower()
+        if value.startswith('-100'):
+            value = value[4:]
+        with self.lock:
+            for channel in self.channels.values():
+                if str(channel['id']) == value or (channel['username'] or '').lower() == value:
+                    return channel['id']
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {'documents': len(self.docs), 'terms': len(self.postings), 'channels': len(self.channels)}
@@ -0,0 +1,180 @@
+"""Общее хранилище состояния для нескольких воркеров (gunicorn).
+
+Ключ-значение с TTL: кэш PDF, состояние фоновых задач, версии отчетов.
+Бэкенды выбираются адресом SHARED_STORE_URL:
+
+- sqlite:///путь/к/файлу.db - по умолчанию, для воркеров одной машины;
+- redis://хост:порт/0 (или rediss://, unix://) - для нескольких машин,
+  нужен пакет redis. Локально Redis можно заменить fakeredis:
+  python -c "from fakeredis import TcpFakeServer; TcpFakeServer(('127.0.0.1', 6390)).serve_forever()"
+  и SHARED_STORE_URL=redis://127.0.0.1:6390/0.
+"""
+import json
+import math
+import sqlite3
+import threading
+import time
+
+class SharedStore:
+    """Байтовые значения по строковым ключам с необязательным TTL в секундах"""
+
+    shared_across_hosts = False  # Видят ли хранилище воркеры на других машинах
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def keys(self, prefix):
+        """Живые ключи с префиксом"""
+        raise NotImplementedError
+
+    def get_json(self, key):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key, data, ttl=None):
+        self.set(key, json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'), ttl)
+
+class SQLiteStore(SharedStore):
+    """Хранилище в файле SQLite (WAL): подходит для воркеров одной машины"""
+
+    def __init__(self, path, cleanup_interval=60):
+        self.path = path
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = 0
+        self.local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)'
+        )
+
+    def _connection(self):
+        """Соединение потока (sqlite3 не разрешает общее соединение между потоками)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, value, now + ttl if ttl else None)
+        )
+        if now - self.last_cleanup > self.cleanup_interval:
+            self.last_cleanup = now
+            self._connection().execute('DELETE FROM kv WHERE expires_at <= ?', (now,))
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def keys(self, prefix):
+        # Диапазон [prefix, prefix со следующим последним символом) использует индекс первичного ключа
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._connection().execute(
+            'SELECT key FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)',
+            (prefix, upper, time.time())
+        )
+        return [row[0] for row in rows]
+
+class RedisStore(SharedStore):
+    """Хранилище в Redis (или совместимом сервере); TTL - средствами Redis"""
+
+    shared_across_hosts = True
+
+    def __init__(self, client, namespace='telegram_analytics:'):
+        self.client = client
+        self.namespace = namespace
+
+    def get(self, key):
+        return self.client.get(self.namespace + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.namespace + key, value, ex=math.ceil(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.namespace + key)
+
+    def keys(self, prefix):
+        start = len(self.namespace)
+        return [key.decode('utf-8')[start:] for key in self.client.scan_iter(match=f"{self.namespace}{prefix}*", count=500)]
+
+def create_store(url):
+    """Хранилище по адресу SHARED_STORE_URL"""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        # Импорт только для Redis: пакет заметно замедляет запуск, а по умолчанию не нужен
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('Для SHARED_STORE_URL=redis://... нужен пакет redis')
+        return RedisStore(redis.Redis.from_url(url))
+    if url.startswith('sqlite://'):
+        return SQLiteStore(url[len('sqlite://'):])  # sqlite:///abs/path.db или sqlite://relative.db
+    raise ValueError(f'Неизвестный адрес хранилища: {url}')
+
+class StoreMapping:
+    """Словарь поверх хранилища: JSON значения под общим префиксом ключей.
+
+    Повторяет используемую приложением часть интерфейса dict, чтобы
+    глобальные кэши можно было перенести в общее хранилище без изменения
+    мест использования.
+    """
+
+    def __init__(self, store, prefix, ttl=None):
+        self.store = store
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self.store.get_json(self.prefix + key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set_json(self.prefix + key, value, self.ttl)
+
+    def __contains__(self, key):
+        return self.store.get(self.prefix + key) is not None
+
+    def pop(self, key, default=None):
+        value = self.get(key)
+        if value is None:
+            return default
+        self.store.delete(self.prefix + key)
+        return value
+
+    def keys(self):
+        start = len(self.prefix)
+        return [key[start:] for key in self.store.keys(self.prefix)]
+
+    def items(self):
+        pairs = []
+        for key in self.keys():
+            value = self.get(key)
+            if value is not None:
+                pairs.append((key, value))
+        return pairs
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __len__(self):
+        return len(self.keys())
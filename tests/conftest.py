@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Тесты работают с синтетическим Telegram клиентом и без прогрева PDF
+os.environ.setdefault('TELEGRAM_BACKEND', 'fake')
+os.environ.setdefault('PDF_WARMUP', 'false')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
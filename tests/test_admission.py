@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+import AppAI
+from admission import (AdmissionController, Overloaded, REJECT_CLIENT_QUOTA, REJECT_NO_SLOT, REJECT_QUEUE_FULL,
+                       REJECT_QUEUE_TIMEOUT)
+
+
+def make_controller(name='analyze', **kwargs):
+    params = dict(max_concurrent=1, max_queue=0, queue_timeout=1, per_client=3, service_time=2.0)
+    params.update(kwargs)
+    return AdmissionController(name, **params)
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert predicate()
+
+
+def test_limit_is_per_endpoint():
+    analyze = make_controller('analyze', max_concurrent=2)
+    pdf = make_controller('generate_pdf', max_concurrent=1)
+    analyze.acquire('a')
+    analyze.acquire('b')
+    with pytest.raises(Overloaded) as e:
+        analyze.acquire('c')
+    assert (e.value.endpoint, e.value.reason, e.value.status) == ('analyze', REJECT_QUEUE_FULL, 503)
+
+    # Занятые слоты анализа не мешают другому эндпоинту
+    pdf.acquire('c')
+    assert pdf.stats()['active'] == 1
+    analyze.release('a')
+    analyze.acquire('c')
+    assert analyze.stats()['active'] == 2
+
+
+def test_queue_deadline():
+    controller = make_controller(max_queue=1, queue_timeout=0.05)
+    controller.acquire('a')
+    started = time.monotonic()
+    with pytest.raises(Overloaded) as e:
+        controller.acquire('b')
+    assert time.monotonic() - started >= 0.05
+    assert (e.value.reason, e.value.status) == (REJECT_QUEUE_TIMEOUT, 503)
+    assert e.value.retry_after >= 1
+    assert controller.stats()['queued'] == 0
+
+
+def test_retry_after_grows_with_queue():
+    controller = make_controller(max_queue=5, service_time=4.0)
+    assert controller.retry_after() == 4
+    controller.waiters = [['x', False], ['y', False]]
+    assert controller.retry_after() == 12
+
+
+def test_client_quota():
+    controller = make_controller(max_concurrent=5, per_client=2)
+    controller.acquire('a')
+    controller.acquire('a')
+    with pytest.raises(Overloaded) as e:
+        controller.acquire('a')
+    assert (e.value.reason, e.value.status) == (REJECT_CLIENT_QUOTA, 429)
+    controller.acquire('b')
+
+
+def test_free_slot_goes_to_least_active_client():
+    """Освободившийся слот получает клиент с меньшим числом выполняемых запросов, хотя пришел позже"""
+    controller = make_controller(max_concurrent=2, max_queue=2, queue_timeout=2)
+    controller.acquire('a')
+    controller.acquire('a')
+    granted = []
+
+    def wait(client):
+        controller.acquire(client)
+        granted.append(client)
+
+    threads = [threading.Thread(target=wait, args=(client,)) for client in ('a', 'b')]
+    threads[0].start()
+    wait_for(lambda: controller.stats()['queued'] == 1)
+    threads[1].start()
+    wait_for(lambda: controller.stats()['queued'] == 2)
+
+    controller.release('a')
+    wait_for(lambda: granted == ['b'])
+    controller.release('a')
+    wait_for(lambda: granted == ['b', 'a'])
+    for thread in threads:
+        thread.join()
+
+
+def test_non_blocking_acquire():
+    controller = make_controller(max_queue=5)
+    controller.acquire('a', block=False)
+    with pytest.raises(Overloaded) as e:
+        controller.acquire('b', block=False)
+    assert (e.value.reason, e.value.status) == (REJECT_NO_SLOT, 503)
+    assert controller.stats()['queued'] == 0
+
+
+@pytest.fixture
+def saturated(monkeypatch):
+    """Все слоты дорогих эндпоинтов заняты; в очереди ждать можно до секунды"""
+    controllers = {name: make_controller(name, max_queue=5, queue_timeout=1) for name in AppAI.admission}
+    for controller in controllers.values():
+        controller.acquire('other')
+    monkeypatch.setattr(AppAI, 'admission', controllers)
+    return controllers
+
+
+def test_health_is_not_admitted(saturated):
+    response = AppAI.app.test_client().get('/health')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'healthy'
+
+
+def test_job_submit_does_not_wait_for_slot(saturated):
+    started = time.monotonic()
+    response = AppAI.app.test_client().post('/jobs/analyze', json={'channel_username': 'busy', 'hours_back': 24})
+    assert time.monotonic() - started < 0.5
+    assert response.status_code == 503
+    assert response.get_json()['reason'] == REJECT_NO_SLOT
+    assert int(response.headers['Retry-After']) >= 1
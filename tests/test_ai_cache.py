@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import AppAI
+
+MISSING_COLUMN = '{"code":"42703","details":null,"hint":null,"message":"column ai_reports.section does not exist"}'
+
+
+def test_report_cache_without_section_column(monkeypatch):
+    """Без миграции колонки section кэш цельного отчета работает без фильтра, и это проверяется один раз"""
+    urls = []
+
+    def get(url, **kwargs):
+        urls.append(url)
+        if 'section=' in url:
+            return SimpleNamespace(status_code=400, text=MISSING_COLUMN)
+        return SimpleNamespace(status_code=200, text='[]')
+
+    monkeypatch.setattr(AppAI.requests, 'get', get)
+    monkeypatch.setattr(AppAI, 'ai_section_column', None)
+
+    assert AppAI.fetch_cached_ai_report(1, 24).status_code == 200
+    assert AppAI.fetch_cached_ai_report(1, 24).status_code == 200
+    assert ['section=is.null' in url for url in urls] == [True, False, False]
+
+
+def test_report_cache_skips_section_rows(monkeypatch):
+    urls = []
+
+    def get(url, **kwargs):
+        urls.append(url)
+        return SimpleNamespace(status_code=200, text='[]')
+
+    monkeypatch.setattr(AppAI.requests, 'get', get)
+    monkeypatch.setattr(AppAI, 'ai_section_column', None)
+
+    AppAI.fetch_cached_ai_report(1, 24)
+    AppAI.fetch_cached_ai_report(1, 24)
+    assert all('section=is.null' in url for url in urls)
+    assert AppAI.ai_section_column is True
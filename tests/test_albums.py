@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import AppAI
+import fake_telegram
+from fake_telegram import FakeChannel, FakeMessage, FakeTelegramClient, LatencyModel, _make_media
+from message_store import MessageStore, RpcBudget
+
+
+def make_client(layout, now=None):
+    """Клиент с одним каналом @albums; layout - (grouped_id или None, дата) по возрастанию id"""
+    channel = FakeChannel(42, 'albums', 'Альбомы', 1000)
+    channel.messages = [
+        FakeMessage(message_id, date, text='пост' if grouped_id is None else '', media=_make_media('photo'),
+                    grouped_id=grouped_id, views=100)
+        for message_id, (grouped_id, date) in enumerate(layout, start=1)
+    ][::-1]
+    return FakeTelegramClient([channel], latency=LatencyModel(base=0, per_item=0, jitter=0))
+
+
+def fetch(client, **kwargs):
+    analytics = AppAI.TelegramAnalytics()
+    analytics.client = client
+    return asyncio.run(analytics.fetch_posts('albums', **kwargs))
+
+
+def albums(posts):
+    return {post['id']: post['group_size'] for post in posts if post['is_group']}
+
+
+def test_album_split_by_message_limit_is_read_whole():
+    now = datetime.now(timezone.utc)
+    # Старший альбом id 1-5, затем 10 одиночных: при limit=12 лимит приходится на середину альбома
+    client = make_client([(7, now)] * 5 + [(None, now)] * 10)
+    posts, info = fetch(client, limit=12)
+    assert albums(posts) == {1: 5}
+    assert info['messages_fetched'] == 15
+    assert len(posts) == 11
+
+
+def test_album_split_by_page_boundary(tmp_path, monkeypatch):
+    """Обход истории: альбом на границе двух страниц сохраняется одним постом"""
+    monkeypatch.setattr(AppAI, 'BACKFILL_PAGE_SIZE', 10)
+    monkeypatch.setattr(fake_telegram, 'PAGE_SIZE', 10)
+    now = datetime.now(timezone.utc)
+    # По убыванию id первая страница - 25..16, вторая - 15..6: альбом 14-18 разрезан между ними
+    layout = [(None, now)] * 13 + [(9, now)] * 5 + [(None, now)] * 7
+    client = make_client(layout)
+    store = MessageStore(str(tmp_path / 'history.db'))
+    backfill = AppAI.ChannelBackfill(AppAI.TelegramAnalytics(client_factory=lambda: client), store, RpcBudget(60000))
+
+    async def main():
+        state = await backfill.start('albums')
+        await backfill.tasks[state['channel_id']]
+
+    asyncio.run(main())
+    posts = list(store.iter_posts(42))
+    assert albums(posts) == {14: 5}
+    assert len(posts) == 25 - 4
+    assert len({post['id'] for post in posts}) == len(posts)
+    assert store.get_state(42)['status'] == 'done'
+
+
+def test_album_at_time_window_edge():
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(hours=24)
+    layout = (
+        # Альбом начался до периода, последние части - внутри: относится к дате первого сообщения
+        [(1, start - timedelta(minutes=2))] * 2 + [(1, start + timedelta(minutes=1))] * 2
+        # Альбом в самом начале периода учитывается целиком
+        + [(2, start + timedelta(minutes=5))] * 3
+        + [(None, now - timedelta(hours=1))]
+    )
+    analytics = AppAI.TelegramAnalytics(client_factory=lambda: make_client(layout))
+    report = asyncio.run(analytics.analyze_channel('albums', hours_back=24))
+    assert report['analysis_period']['used_fallback'] is False
+    assert report['summary']['total_posts'] == 2
+    assert report['group_processing_info']['groups_processed'] == 1
+    assert sum(stats['count'] for stats in report['content_analysis'].values()) == 2
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import AppAI
+import fake_telegram
+from fake_telegram import FakeChannel, FakeMessage, FakeTelegramClient, LatencyModel, _make_media
+from message_store import MessageStore, RpcBudget
+
+CHANNEL_ID = 55
+
+
+def make_client():
+    """45 сообщений; по убыванию id страницы по 10: альбом 23-28 разрезан между второй и третьей страницей"""
+    channel = FakeChannel(CHANNEL_ID, 'archive', 'Архив', 1000)
+    now = datetime.now(timezone.utc)
+    channel.messages = [
+        FakeMessage(message_id, now - timedelta(hours=50 - message_id), text=f'пост {message_id}',
+                    media=_make_media('photo'), grouped_id=3 if 23 <= message_id <= 28 else None, views=message_id)
+        for message_id in range(1, 46)
+    ][::-1]
+    return FakeTelegramClient([channel], latency=LatencyModel(base=0, per_item=0, jitter=0))
+
+
+class InterruptedStore(MessageStore):
+    """Архив, на котором обход «падает» на заданной странице - до или после ее сохранения"""
+
+    def __init__(self, path, fail_on_page, after_commit):
+        super().__init__(path)
+        self.fail_on_page = fail_on_page
+        self.after_commit = after_commit
+        self.pages = 0
+
+    def save_page(self, channel_id, posts, state):
+        self.pages += 1
+        if self.pages == self.fail_on_page and not self.after_commit:
+            raise asyncio.CancelledError()
+        super().save_page(channel_id, posts, state)
+        if self.pages == self.fail_on_page:
+            raise asyncio.CancelledError()
+
+
+def backfill_for(client, store):
+    return AppAI.ChannelBackfill(AppAI.TelegramAnalytics(client_factory=lambda: client), store, RpcBudget(60000))
+
+
+@pytest.mark.parametrize('after_commit', [True, False])
+def test_resume_after_interrupted_walk(tmp_path, monkeypatch, after_commit):
+    monkeypatch.setattr(AppAI, 'BACKFILL_PAGE_SIZE', 10)
+    monkeypatch.setattr(fake_telegram, 'PAGE_SIZE', 10)
+    client = make_client()
+    path = str(tmp_path / 'history.db')
+    store = InterruptedStore(path, fail_on_page=2, after_commit=after_commit)
+
+    async def first_run():
+        backfill = backfill_for(client, store)
+        state = await backfill.start('archive')
+        with pytest.raises(asyncio.CancelledError):
+            await backfill.tasks[state['channel_id']]
+
+    asyncio.run(first_run())
+    saved = store.get_state(CHANNEL_ID)
+    assert saved['status'] in AppAI.BACKFILL_ACTIVE_STATUSES
+    if after_commit:
+        # Сохранена и вторая страница, но открытый альбом в курсор не вошел: он будет прочитан заново
+        assert saved['cursor'] == 29
+    else:
+        assert saved['cursor'] == 36
+
+    # «Перезапуск»: новый экземпляр продолжает обход по сохраненному состоянию
+    restarted = backfill_for(client, MessageStore(path))
+
+    async def second_run():
+        await restarted.resume()
+        await restarted.tasks[CHANNEL_ID]
+        return await restarted.load_posts(CHANNEL_ID, None, None)
+
+    posts = asyncio.run(second_run())
+    ids = [post['id'] for post in posts]
+    assert ids == sorted(set(ids), reverse=True)
+    assert ids == list(range(45, 28, -1)) + [23] + list(range(22, 0, -1))
+    album = next(post for post in posts if post['is_group'])
+    assert (album['id'], album['group_size']) == (23, 6)
+
+    state = restarted.store.get_state(CHANNEL_ID)
+    assert state['status'] == 'done'
+    assert state['tail_done'] is True
+    assert state['newest_id'] == 45
+
+
+def test_save_page_is_idempotent(tmp_path):
+    store = MessageStore(str(tmp_path / 'history.db'))
+    post = {'id': 7, 'date': datetime(2026, 1, 1, tzinfo=timezone.utc), 'content_type': 'text', 'is_group': False,
+            'group_size': 1, 'views': 10, 'reactions': 0, 'forwards': 0, 'comments': 0,
+            'text_preview': 'текст', 'text': 'текст'}
+    store.save_page(CHANNEL_ID, [post], {'cursor': 7})
+    store.save_page(CHANNEL_ID, [dict(post, views=25)], {'cursor': 7})
+    posts = list(store.iter_posts(CHANNEL_ID))
+    assert [(post['id'], post['views'], post['text']) for post in posts] == [(7, 25, 'текст')]
+    assert store.stats(CHANNEL_ID)[0] == 1
+    assert store.get_state(CHANNEL_ID) == {'cursor': 7}
+
+
+def test_rpc_budget_waits_for_tokens():
+    budget = RpcBudget(per_minute=1200, burst=2)  # 20 запросов в секунду
+
+    async def main():
+        started = time.monotonic()
+        for _ in range(2):
+            await budget.acquire()
+        burst = time.monotonic() - started
+        for _ in range(2):
+            await budget.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(main())
+    assert burst < 0.02
+    assert 0.08 <= total < 0.5
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+import pytest
+
+import AppAI
+
+CHANNEL = 'fake_channel_0'
+URL = f'/analyze?channel_username={CHANNEL}&hours_back=720'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(AppAI, 'report_versions', OrderedDict())
+    return AppAI.app.test_client()
+
+
+def get(client, etag=None, encoding='identity'):
+    headers = {'Accept-Encoding': encoding}
+    if etag:
+        headers['If-None-Match'] = etag
+    return client.get(URL, headers=headers)
+
+
+def test_report_etag_and_not_modified(client):
+    response = get(client)
+    assert response.status_code == 200
+    version = response.get_json()['version']
+    assert response.headers['ETag'] == f'"{version}"'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = get(client, etag=f'"{version}"')
+    assert response.status_code == 304
+    assert response.headers['ETag'] == f'"{version}"'
+    assert response.data == b''
+
+
+def test_gzip_etag_variant(client):
+    response = get(client, encoding='gzip')
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    etag = response.headers['ETag']
+    version = AppAI.get_remembered_report(CHANNEL, 720)['version']
+    # Сжатое тело - другие байты, поэтому и другой сильный ETag
+    assert etag == f'"{version}-gzip"'
+
+    response = get(client, etag=etag, encoding='gzip')
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert 'Content-Encoding' not in response.headers
+
+    # ETag несжатого представления той же версии тоже подходит
+    assert get(client, etag=f'"{version}"', encoding='gzip').status_code == 304
+
+
+def test_new_version_after_channel_changes(client):
+    first = get(client)
+    version = first.get_json()['version']
+
+    AppAI.run_async(AppAI.analytics.client.publish(CHANNEL, text='Новый пост после первого отчета'))
+
+    response = get(client, etag=f'"{version}"')
+    assert response.status_code == 200
+    new_version = response.get_json()['version']
+    assert new_version != version
+    assert response.headers['ETag'] == f'"{new_version}"'
+    assert get(client, etag=f'"{new_version}"').status_code == 304
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import AppAI
+from dialog_index import DialogIndex, SOURCE_DIALOG, SOURCE_SEARCH
+
+
+def entry(channel_id, title, username=None, participants=0, source=SOURCE_DIALOG):
+    return {'id': channel_id, 'title': title, 'username': username, 'participants_count': participants, 'source': source}
+
+
+def make_index():
+    index = DialogIndex()
+    index.sync_dialogs([
+        entry(1, 'Крипто Новости', 'crypto_news', 5000),
+        entry(2, 'Новости спорта', 'sportnews', 20000),
+        entry(3, 'Новости', 'novosti', 100),
+        entry(4, 'Кулинарные рецепты', 'recipes', 300),
+    ])
+    return index
+
+
+def ids(results):
+    return [result['id'] for result in results]
+
+
+def test_exact_username_ranks_first():
+    results = make_index().search('@Crypto_News')
+    assert results[0]['id'] == 1
+    assert (results[0]['match'], results[0]['score']) == ('username', 3.0)
+
+
+def test_prefix_of_every_word():
+    index = make_index()
+    # Все слова запроса - начала слов названия; ё и регистр не важны
+    assert ids(index.search('кри нов')) == [1]
+    assert ids(index.search('КУЛИН')) == [4]
+    assert all(result['match'] == 'prefix' for result in index.search('кри нов'))
+
+
+def test_prefix_ranking():
+    results = make_index().search('новости')
+    # Полное совпадение названия выше; у 1 и 2 одинаковая доля запроса в названии - выше канал с большим числом подписчиков
+    assert ids(results) == [3, 2, 1]
+    assert results[0]['score'] == 2.0
+    assert results[1]['score'] == results[2]['score'] == 1.5
+    assert ids(make_index().search('нов')) == [3, 2, 1]
+
+
+def test_trigram_typo():
+    results = make_index().search('novosty')
+    assert ids(results) == [3]
+    assert results[0]['match'] == 'fuzzy'
+    assert 0.3 <= results[0]['score'] < 1
+    assert make_index().search('zzzz') == []
+
+
+def test_sync_removes_dialogs_left():
+    index = make_index()
+    changed, removed = index.sync_dialogs([entry(1, 'Крипто Новости', 'crypto_news', 5000),
+                                           entry(3, 'Новости дня', 'novosti', 100)])
+    assert (changed, removed) == (1, 2)
+    assert ids(index.search('спорт')) == []
+    assert ids(index.search('recipes')) == []
+    assert ids(index.search('дня')) == [3]
+    assert index.stats()['channels'] == 2
+
+
+def test_search_entries_expire_by_ttl():
+    index = DialogIndex(search_ttl=60)
+    index.sync_dialogs([entry(1, 'Крипто Новости', 'crypto_news')])
+    index.upsert(entry(5, 'Свежий канал', 'fresh', source=SOURCE_SEARCH))
+    index.upsert(entry(6, 'Старый канал', 'old', source=SOURCE_SEARCH))
+    index.added_at[6] = time.time() - 120
+    # Канал из диалогов, найденный и через поиск, остается диалогом
+    index.upsert(entry(1, 'Крипто Новости', 'crypto_news', source=SOURCE_SEARCH))
+
+    # Найденных через поиск нет в диалогах: сверка удаляет их только по сроку
+    changed, removed = index.sync_dialogs([entry(1, 'Крипто Новости', 'crypto_news')])
+    assert (changed, removed) == (0, 1)
+    assert ids(index.search('fresh')) == [5]
+    assert ids(index.search('old')) == []
+    assert index.channels[1]['source'] == SOURCE_DIALOG
+
+
+def test_index_ready_after_failed_load():
+    """Неудачная первая загрузка не задерживает поиск на DIALOG_INDEX_WAIT"""
+    analytics = AppAI.TelegramAnalytics()
+
+    async def failing_refresh(full=False):
+        raise RuntimeError('нет соединения')
+
+    analytics.refresh_dialog_index = failing_refresh
+
+    async def main():
+        started = time.monotonic()
+        ready = await analytics.ensure_dialog_index(wait=5)
+        analytics._dialog_index_task.cancel()
+        return ready, time.monotonic() - started
+
+    ready, elapsed = asyncio.run(main())
+    assert ready is False
+    assert elapsed < 1
+
+
+def test_find_channel_rejects_bad_limit():
+    response = AppAI.app.test_client().get('/find_channel?q=news&limit=abc')
+    assert response.status_code == 400
+    assert 'limit' in response.get_json()['error']
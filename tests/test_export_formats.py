@@ -0,0 +1,95 @@
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from export_formats import EXPORT_COLUMNS, iter_csv, iter_ndjson, iter_parquet
+
+NOW = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def make_rows(cursor, count=3, fail_after=None, has_more=False):
+    """Строки экспорта; итог в cursor заполняется после чтения, как в /export"""
+    for i in range(count):
+        if fail_after is not None and i == fail_after:
+            raise RuntimeError('архив\nнедоступен')
+        yield {'id': 100 - i, 'date': NOW - timedelta(hours=i), 'content_type': 'text', 'group_size': 1,
+               'views': 10 * i, 'reactions': i, 'forwards': 0, 'comments': 0}
+    cursor.update(has_more=has_more, count=count, before_id=100 - count + 1 if has_more else None)
+
+
+def collect(writer, rows, cursor, **kwargs):
+    chunks = []
+    try:
+        for chunk in writer(rows, cursor, **kwargs):
+            chunks.append(chunk)
+    except RuntimeError as e:
+        return b''.join(chunks), e
+    return b''.join(chunks), None
+
+
+def test_csv_cursor_trailer():
+    cursor = {}
+    data, error = collect(iter_csv, make_rows(cursor, has_more=True), cursor, batch_rows=2)
+    lines = data.decode('utf-8').splitlines()
+    assert error is None
+    assert lines[0] == ','.join(EXPORT_COLUMNS)
+    assert len(lines) == 1 + 3 + 1
+    assert lines[-1] == '# cursor: has_more=true count=3 before_id=98'
+
+
+def test_csv_error_trailer():
+    cursor = {}
+    data, error = collect(iter_csv, make_rows(cursor, fail_after=2), cursor, batch_rows=1)
+    lines = data.decode('utf-8').splitlines()
+    assert str(error) == 'архив\nнедоступен'
+    assert len(lines) == 1 + 2 + 2
+    # Текст ошибки - одной строкой комментария, итог не заполнен
+    assert lines[-2] == '# error: архив недоступен'
+    assert lines[-1] == '# cursor: '
+
+
+def test_ndjson_cursor_line():
+    cursor = {}
+    data, error = collect(iter_ndjson, make_rows(cursor), cursor, batch_rows=2)
+    lines = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+    assert error is None
+    assert [line['id'] for line in lines[:-1]] == [100, 99, 98]
+    assert lines[-1] == {'cursor': {'has_more': False, 'count': 3, 'before_id': None}}
+
+
+def test_ndjson_error_line():
+    cursor = {}
+    data, error = collect(iter_ndjson, make_rows(cursor, fail_after=1), cursor, batch_rows=5)
+    lines = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+    assert error is not None
+    assert [line.get('id') for line in lines] == [100, None]
+    assert lines[-1] == {'error': 'архив\nнедоступен', 'cursor': {}}
+
+
+def test_parquet_metadata():
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as parquet
+
+    cursor = {}
+    data, error = collect(iter_parquet, make_rows(cursor, count=5, has_more=True), cursor, row_group=2)
+    assert error is None
+    assert parquet.read_table(io.BytesIO(data)).column('id').to_pylist() == [100, 99, 98, 97, 96]
+    file_metadata = parquet.ParquetFile(io.BytesIO(data)).metadata
+    assert file_metadata.num_row_groups == 3
+    metadata = {key.decode(): json.loads(value) for key, value in file_metadata.metadata.items()
+                if key.startswith(b'export.')}
+    assert metadata == {'export.has_more': True, 'export.count': 5, 'export.before_id': 96}
+
+
+def test_parquet_unreadable_after_error():
+    pytest.importorskip('pyarrow')
+    import pyarrow
+    import pyarrow.parquet as parquet
+
+    cursor = {}
+    data, error = collect(iter_parquet, make_rows(cursor, count=5, fail_after=3), cursor, row_group=2)
+    assert error is not None
+    with pytest.raises(pyarrow.ArrowInvalid):
+        parquet.read_table(io.BytesIO(data))
@@ -0,0 +1,29 @@
+import logging
+import queue
+import time
+
+import AppAI
+
+
+def test_listener_survives_idle_period(tmp_path, monkeypatch):
+    """После паузы дольше LOG_FLUSH_INTERVAL записи по-прежнему доходят до файла"""
+    monkeypatch.setattr(AppAI, 'LOG_FLUSH_INTERVAL', 0.05)
+    log_path = tmp_path / 'app.log'
+    handler = logging.FileHandler(log_path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    listener = AppAI.BatchingQueueListener(log_queue, handler)
+    listener.start()
+    try:
+        log_queue.put(logging.makeLogRecord({'msg': 'первая запись', 'levelno': logging.INFO, 'levelname': 'INFO'}))
+        time.sleep(0.3)
+        assert listener._thread.is_alive()
+
+        log_queue.put(logging.makeLogRecord({'msg': 'после паузы', 'levelno': logging.WARNING, 'levelname': 'WARNING'}))
+        deadline = time.monotonic() + 2
+        while 'после паузы' not in log_path.read_text(encoding='utf-8') and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert 'WARNING - после паузы' in log_path.read_text(encoding='utf-8')
+    finally:
+        listener.stop()
+        handler.close()
@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+import AppAI
+from shared_store import SQLiteStore, StoreMapping, create_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(str(tmp_path / 'shared.db'))
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert predicate()
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    """Воркеры открывают один файл: запись одного сразу видна другому, в том числе из другого потока"""
+    path = str(tmp_path / 'shared.db')
+    first, second = SQLiteStore(path), create_store(f'sqlite://{path}')
+    first.set_json('job:1', {'status': 'running'})
+    assert second.get_json('job:1') == {'status': 'running'}
+
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(second.get('job:1')))
+    thread.start()
+    thread.join()
+    assert seen == [b'{"status": "running"}']
+
+    second.delete('job:1')
+    assert first.get('job:1') is None
+
+
+def test_sqlite_store_ttl_and_keys(store):
+    store.cleanup_interval = 0
+    store.set('pdf:a', b'1', ttl=0.05)
+    store.set('pdf:b', b'2')
+    store.set('pdq:c', b'3')
+    assert sorted(store.keys('pdf:')) == ['pdf:a', 'pdf:b']
+
+    time.sleep(0.1)
+    assert store.get('pdf:a') is None
+    assert store.keys('pdf:') == ['pdf:b']
+    # Следующая запись удаляет истекшие строки из файла
+    store.set('pdf:d', b'4')
+    rows = store._connection().execute('SELECT key FROM kv ORDER BY key').fetchall()
+    assert [row[0] for row in rows] == ['pdf:b', 'pdf:d', 'pdq:c']
+
+
+def test_create_store_rejects_unknown_url():
+    with pytest.raises(ValueError):
+        create_store('memcached://localhost')
+
+
+def test_store_mapping(store):
+    mapping = StoreMapping(store, 'report_version:', ttl=0.1)
+    mapping['news:24'] = {'version': 'abc'}
+    mapping['sport:24'] = {'version': 'def'}
+    store.set_json('other:1', {'version': 'x'})
+
+    assert mapping['news:24'] == {'version': 'abc'}
+    assert 'news:24' in mapping and 'missing' not in mapping
+    assert mapping.get('missing', 'default') == 'default'
+    assert sorted(mapping.keys()) == ['news:24', 'sport:24']
+    assert len(mapping) == 2
+    assert mapping.pop('sport:24') == {'version': 'def'}
+    assert mapping.items() == [('news:24', {'version': 'abc'})]
+
+    time.sleep(0.15)
+    assert len(mapping) == 0
+    with pytest.raises(KeyError):
+        mapping['news:24']
+
+
+class ManualJobs(AppAI.AnalysisJobs):
+    """Таблица задач без запуска анализа: статусы меняет тест"""
+
+    async def _analyze(self, job_id):
+        pass
+
+
+@pytest.fixture
+def shared(store, monkeypatch):
+    monkeypatch.setattr(AppAI, 'shared_store', store)
+    monkeypatch.setattr(AppAI, 'JOB_SHARED_POLL_INTERVAL', 0.02)
+    return store
+
+
+def test_jobs_are_deduplicated_by_channel_and_period(shared):
+    jobs = ManualJobs()
+    job, created = jobs.submit('@News', 24)
+    assert created
+    same, created = jobs.submit('news ', 24)
+    assert (same['id'], created) == (job['id'], False)
+    assert jobs.find('NEWS', 24)['id'] == job['id']
+
+    other, created = jobs.submit('news', 48)
+    assert created and other['id'] != job['id']
+    assert jobs.find('sport', 24) is None
+
+
+def test_job_table_is_bounded(shared):
+    jobs = ManualJobs(max_jobs=2)
+    first, _ = jobs.submit('a', 24)
+    jobs.submit('b', 24)
+    # Обе задачи выполняются: места нет
+    assert jobs.submit('c', 24) == (None, False)
+
+    # Завершенная задача вытесняется новой
+    jobs.update(first['id'], status='done', result={'total_posts': 1})
+    job, created = jobs.submit('c', 24)
+    assert created
+    assert first['id'] not in jobs.jobs
+    assert len(jobs.jobs) == 2
+
+
+def test_finished_jobs_expire(shared):
+    jobs = ManualJobs(ttl=0.05)
+    job, _ = jobs.submit('news', 24)
+    jobs.update(job['id'], status='done', result={'total_posts': 1})
+    assert jobs.find('news', 24)['id'] == job['id']
+
+    time.sleep(0.1)
+    assert jobs.find('news', 24) is None
+    renewed, created = jobs.submit('news', 24)
+    assert created and renewed['id'] != job['id']
+
+
+def test_job_state_is_visible_to_other_worker(shared):
+    owner, other = ManualJobs(), ManualJobs()
+    job, _ = owner.submit('news', 24)
+    data = other.get(job['id'])
+    assert (data['job_id'], data['status'], data['version']) == (job['id'], 'queued', 0)
+    assert 'result' not in data
+
+    # Long-poll другого воркера опрашивает хранилище до изменения версии
+    timer = threading.Timer(0.1, owner.update, (job['id'],), {'status': 'done', 'result': {'total_posts': 3}})
+    timer.start()
+    data = other.get(job['id'], wait=2, since_version=0)
+    timer.join()
+    assert data['status'] == 'done'
+    assert data['result'] == {'total_posts': 3}
+    assert other.get('missing') is None
+
+
+def test_on_finish_runs_when_job_ends(shared):
+    jobs = ManualJobs()
+    released = threading.Event()
+    job, _ = jobs.submit('news', 24, on_finish=released.set)
+    assert released.wait(2)
+    wait_for(lambda: job['id'] not in jobs.on_finish)
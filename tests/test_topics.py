@@ -0,0 +1,34 @@
+import pytest
+
+import topics
+
+pytestmark = pytest.mark.skipif(not topics.TOPICS_AVAILABLE, reason='нужны NumPy и SciPy')
+
+
+def make_posts():
+    """Посты про футбол набирают много просмотров, про погоду - мало"""
+    posts = []
+    for i in range(6):
+        posts.append({'text': f'football match goals stadium fans {i}', 'views': 1000 + i})
+        posts.append({'text': f'weather rain forecast cloudy {i}', 'views': 100 + i})
+        posts.append({'text': f'recipe dinner cooking kitchen {i}', 'views': 400 + i})
+    return posts
+
+
+def test_tiers_and_engagement_lift():
+    result = topics.extract_topics(make_posts())
+    assert result['posts_with_text'] == 18
+    assert 'football' in result['tiers']['high']
+    assert 'weather' in result['tiers']['low']
+    assert 'football' not in result['tiers']['low']
+
+    lifts = {item['term']: item['lift'] for item in result['engagement_terms']}
+    assert 'football' in lifts
+    assert all(lift > 1 for lift in lifts.values())
+    assert 'weather' not in lifts
+
+
+def test_too_few_posts_with_text():
+    posts = [{'text': 'football match', 'views': 10}, {'text': '', 'views': 5}, {'text': 'rain', 'views': 1}]
+    assert len([post for post in posts if post['text']]) < topics.MIN_POSTS
+    assert topics.extract_topics(posts) is None
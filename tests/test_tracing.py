@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+from tracing import Tracer
+
+
+def read_traces(path):
+    with open(path, encoding='utf-8') as f:
+        return [[span['name'] for span in json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans']] for line in f]
+
+
+def test_late_span_is_dropped(tmp_path):
+    """Спан, завершившийся после записи корня, не копится в памяти"""
+    tracer = Tracer(str(tmp_path / 'traces.jsonl'))
+    with tracer.span('request'):
+        late = tracer.start_span('background')
+    tracer.end_span(late)
+    assert tracer.traces == {}
+    assert tracer.dropped_spans == 1
+    assert read_traces(tmp_path / 'traces.jsonl') == [['request']]
+
+
+def test_detached_task_has_own_trace(tmp_path):
+    """Фоновая задача, запущенная из запроса, пишет отдельную трассу"""
+    tracer = Tracer(str(tmp_path / 'traces.jsonl'))
+
+    async def job():
+        await asyncio.sleep(0.01)
+        with tracer.span('job.step'):
+            pass
+
+    async def main():
+        with tracer.span('request'):
+            task = asyncio.ensure_future(tracer.detach(job(), 'job'))
+        await task
+
+    asyncio.run(main())
+    assert tracer.traces == {}
+    assert read_traces(tmp_path / 'traces.jsonl') == [['request'], ['job.step', 'job']]
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import AppAI
+from fake_telegram import FakeChannel, FakeMessage, FakeTelegramClient, LatencyModel, _make_media
+
+
+def make_client():
+    """Канал @live с двумя старыми постами"""
+    channel = FakeChannel(77, 'live', 'Живой канал', 500)
+    now = datetime.now(timezone.utc)
+    channel.messages = [FakeMessage(2, now - timedelta(hours=2), text='второй', media=_make_media('text'), views=20),
+                        FakeMessage(1, now - timedelta(hours=3), text='первый', media=_make_media('text'), views=10)]
+    return FakeTelegramClient([channel], latency=LatencyModel(base=0, per_item=0, jitter=0))
+
+
+def test_refresh_is_not_an_event_and_keeps_album_flush(monkeypatch):
+    """Периодический опрос обновляет метрики, но не считается событием и не откладывает сборку альбома"""
+    monkeypatch.setattr(AppAI, 'ALBUM_FLUSH_DELAY', 0.3)
+    monkeypatch.setattr(AppAI, 'TRACK_REFRESH_INTERVAL', 0.01)
+    client = make_client()
+    tracker = AppAI.ChannelTracker(AppAI.TelegramAnalytics(client_factory=lambda: client))
+
+    async def main():
+        await tracker.analytics.ensure_client()
+        await tracker.track('live')
+        tracked = tracker.find('live')
+        assert tracked.events_processed == 0
+
+        single = await client.publish('live', text='новость', views=5)
+        first = await client.publish('live', media_kind='photo', grouped_id=9, views=7)
+        await client.publish('live', media_kind='photo', grouped_id=9, views=7)
+        assert tracked.events_processed == 3
+        flush = tracked.pending_albums[9]
+
+        # Просмотры выросли: опрос идет каждые 10 мс, пока альбом ждет сборки
+        single.views = 50
+        first.views = 70
+        await asyncio.sleep(0.1)
+        assert tracked.posts[single.id]['views'] == 50
+        assert tracked.pending_albums[9] is flush
+        assert tracked.events_processed == 3
+
+        await asyncio.sleep(0.4)
+        assert 9 not in tracked.pending_albums
+        album = tracked.posts[first.id]
+        assert album['group_size'] == 2
+        assert album['views'] == 70
+
+        # Собранный альбом опрос перестраивает сразу, без отложенной сборки
+        first.views = 90
+        await asyncio.sleep(0.1)
+        assert tracked.posts[first.id]['views'] == 90
+        assert tracked.pending_albums == {}
+        assert tracked.events_processed == 3
+        assert tracked.totals()['posts'] == 4
+
+        await tracker.untrack('live')
+
+    asyncio.run(main())
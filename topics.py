@@ -0,0 +1,185 @@
+"""Выделение тем и ключевых слов постов канала.
+
+TF-IDF считается по разреженной матрице SciPy, кластеры - сферическим
+k-means на NumPy. Результат компактный (десятки слов), поэтому его можно
+передавать ИИ вместо исходных текстов постов. Без NumPy/SciPy анализ тем
+отключается.
+"""
+import math
+from collections import Counter, defaultdict
+from search_index import iter_terms
+
+try:
+    import numpy as np
+    from scipy import sparse
+    TOPICS_AVAILABLE = True
+except ImportError:
+    np = None
+    sparse = None
+    TOPICS_AVAILABLE = False
+
+TOP_TERMS = 15
+TIER_TERMS = 8
+CLUSTER_TERMS = 4
+MAX_CLUSTERS = 5
+POSTS_PER_CLUSTER = 10  # Минимум постов на кластер
+MIN_POSTS = 3
+MAX_DOCUMENT_RATIO = 0.8  # Слова, встречающиеся почти везде, не характеризуют тему
+KMEANS_ITERATIONS = 15
+
+def _tokenize_posts(posts):
+    """Основы слов каждого поста и самая частая словоформа каждой основы"""
+    documents = []
+    surface_forms = defaultdict(Counter)
+    for post in posts:
+        stems = []
+        for token, stem in iter_terms(post.get('text')):
+            if token.isdigit():
+                continue
+            stems.append(stem)
+            surface_forms[stem][token] += 1
+        documents.append(stems)
+    labels = {stem: forms.most_common(1)[0][0] for stem, forms in surface_forms.items()}
+    return documents, labels
+
+def _build_matrix(documents):
+    """Нормированная TF-IDF матрица (посты x слова) и словарь"""
+    document_frequency = Counter()
+    for stems in documents:
+        document_frequency.update(set(stems))
+
+    total = len(documents)
+    min_df = 2 if total >= 10 else 1
+    vocabulary = sorted(stem for stem, df in document_frequency.items()
+                        if df >= min_df and (total < 10 or df / total <= MAX_DOCUMENT_RATIO))
+    index = {stem: i for i, stem in enumerate(vocabulary)}
+
+    rows, cols, values = [], [], []
+    for row, stems in enumerate(documents):
+        for stem, count in Counter(stems).items():
+            col = index.get(stem)
+            if col is not None:
+                rows.append(row)
+                cols.append(col)
+                values.append(1 + math.log(count))  # Сублинейная частота
+
+    counts = sparse.csr_matrix((values, (rows, cols)), shape=(total, len(vocabulary)), dtype=np.float64)
+    df = np.array([document_frequency[stem] for stem in vocabulary], dtype=np.float64)
+    idf = np.log((1 + total) / (1 + df)) + 1
+    tfidf = counts.multiply(idf).tocsr()
+
+    norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    tfidf = sparse.diags(1 / norms) @ tfidf
+    return tfidf.tocsr(), vocabulary
+
+def _top_terms(scores, vocabulary, labels, limit):
+    order = np.argsort(-scores)[:limit]
+    return [labels[vocabulary[i]] for i in order if scores[i] > 0]
+
+def _engagement_terms(tfidf, views, vocabulary, labels):
+    """Слова, посты с которыми набирают больше просмотров, чем в среднем по каналу"""
+    presence = (tfidf > 0).astype(np.float64)
+    posts_with_term = np.asarray(presence.sum(axis=0)).ravel()
+    mean_views = views.mean()
+    if mean_views <= 0:
+        return []
+
+    avg_views = (presence.T @ views) / np.maximum(posts_with_term, 1)
+    lift = avg_views / mean_views
+    # Слова из одного поста - шум, если постов достаточно
+    lift[posts_with_term < (2 if len(views) >= 10 else 1)] = 0
+
+    order = np.argsort(-lift)[:TIER_TERMS]
+    return [{
+        'term': labels[vocabulary[i]],
+        'posts': int(posts_with_term[i]),
+        'avg_views': round(float(avg_views[i]), 1),
+        'lift': round(float(lift[i]), 2)
+    } for i in order if lift[i] > 1]
+
+def _tier_terms(tfidf, views, vocabulary, labels):
+    """Характерные слова постов с высокими, средними и низкими просмотрами"""
+    low, high = np.quantile(views, [1 / 3, 2 / 3])
+    tiers = {
+        'high': views > high,
+        'medium': (views > low) & (views <= high),
+        'low': views <= low
+    }
+    overall = np.asarray(tfidf.mean(axis=0)).ravel()
+    result = {}
+    for tier, mask in tiers.items():
+        if not mask.any():
+            result[tier] = []
+            continue
+        # Вычитаем средний вес, чтобы общие для всех постов слова не повторялись в каждом уровне
+        tier_scores = np.asarray(tfidf[mask].mean(axis=0)).ravel() - overall
+        result[tier] = _top_terms(tier_scores, vocabulary, labels, TIER_TERMS)
+    return result
+
+def _clusters(tfidf, views, vocabulary, labels):
+    """Дешевая кластеризация постов: сферический k-means по TF-IDF"""
+    total = tfidf.shape[0]
+    k = min(MAX_CLUSTERS, total // POSTS_PER_CLUSTER)
+    if k < 2 or tfidf.nnz == 0:
+        return []
+
+    # Инициализация k-means++ с фиксированным зерном - одинаковые посты дают одинаковые темы
+    rng = np.random.default_rng(0)
+    centers = [tfidf[rng.integers(total)].toarray().ravel()]
+    for _ in range(1, k):
+        similarity = np.max(tfidf @ np.array(centers).T, axis=1)
+        distance = np.maximum(1 - similarity, 0) ** 2
+        if distance.sum() == 0:
+            break
+        centers.append(tfidf[rng.choice(total, p=distance / distance.sum())].toarray().ravel())
+    centers = np.array(centers)
+
+    assignment = None
+    for _ in range(KMEANS_ITERATIONS):
+        new_assignment = np.asarray(tfidf @ centers.T).argmax(axis=1)
+        if assignment is not None and np.array_equal(assignment, new_assignment):
+            break
+        assignment = new_assignment
+        for cluster in range(len(centers)):
+            members = assignment == cluster
+            if members.any():
+                center = np.asarray(tfidf[members].mean(axis=0)).ravel()
+                centers[cluster] = center / (np.linalg.norm(center) or 1)
+
+    clusters = []
+    for cluster in range(len(centers)):
+        members = assignment == cluster
+        if not members.any():
+            continue
+        clusters.append({
+            'terms': _top_terms(centers[cluster], vocabulary, labels, CLUSTER_TERMS),
+            'posts': int(members.sum()),
+            'avg_views': round(float(views[members].mean()), 1)
+        })
+    return sorted(clusters, key=lambda cluster: cluster['avg_views'], reverse=True)
+
+def extract_topics(posts):
+    """Темы и ключевые слова постов; None, если данных мало или нет NumPy/SciPy"""
+    if not TOPICS_AVAILABLE:
+        return None
+
+    documents, labels = _tokenize_posts(posts)
+    text_posts = [i for i, stems in enumerate(documents) if stems]
+    if len(text_posts) < MIN_POSTS:
+        return None
+
+    documents = [documents[i] for i in text_posts]
+    views = np.array([posts[i]['views'] for i in text_posts], dtype=np.float64)
+    tfidf, vocabulary = _build_matrix(documents)
+    if not vocabulary:
+        return None
+
+    term_scores = np.asarray(tfidf.sum(axis=0)).ravel() / tfidf.shape[0]
+    return {
+        'posts_with_text': len(text_posts),
+        'top_terms': _top_terms(term_scores, vocabulary, labels, TOP_TERMS),
+        'engagement_terms': _engagement_terms(tfidf, views, vocabulary, labels),
+        'tiers': _tier_terms(tfidf, views, vocabulary, labels),
+        'clusters': _clusters(tfidf, views, vocabulary, labels)
+    }
@@ -0,0 +1,268 @@
+"""Легкие спаны запросов с экспортом в JSON формата OpenTelemetry (OTLP/JSON).
+
+Спан - именованный интервал выполнения с атрибутами; вложенность передается
+через contextvars, поэтому работает и в потоках Flask, и в задачах asyncio.
+Спаны одной трассы копятся в памяти и при завершении корневого спана
+дописываются в файл одной строкой ExportTraceServiceRequest (как у файлового
+экспортера OpenTelemetry Collector). Такой файл читают otel-cli, Jaeger
+(через collector с filelog/otlpjsonfile) или обычный jq.
+
+Если путь к файлу не задан, трассировка выключена и спаны почти ничего не стоят.
+"""
+import contextvars
+import functools
+from collections import OrderedDict
+import inspect
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+SERVICE_NAME = 'telegram-analytics'
+
+# Виды спанов OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def _attribute_value(value):
+    """Значение атрибута в формате OTLP/JSON (int64 передается строкой)"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+class Span:
+    """Интервал выполнения внутри трассы"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name, trace_id, parent_id=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    @property
+    def recording(self):
+        return True
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [{'key': key, 'value': _attribute_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': STATUS_CODE_ERROR, 'message': self.error} if self.error else {'code': STATUS_CODE_OK}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+class NoopSpan:
+    """Спан выключенной или не попавшей в выборку трассы"""
+
+    trace_id = None
+    recording = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+def parse_traceparent(header):
+    """(trace_id, parent_id, sampled) из заголовка W3C traceparent или None"""
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+class Tracer:
+    """Создание спанов и запись завершенных трасс в файл"""
+
+    def __init__(self, path=None, sample_rate=1.0, service_name=SERVICE_NAME, max_spans_per_trace=5000, max_finished=10000):
+        self.path = path
+        self.enabled = bool(path)
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.max_spans_per_trace = max_spans_per_trace
+        self.traces = {}  # trace_id -> завершенные спаны еще не записанной трассы
+        self.finished = OrderedDict()  # trace_id недавно записанных трасс - их опоздавшие спаны отбрасываются
+        self.max_finished = max_finished
+        self.dropped_spans = 0
+        self.lock = threading.Lock()
+        if self.enabled and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def current_span(self):
+        return _current_span.get() or NOOP_SPAN
+
+    def start_span(self, name, kind=SPAN_KIND_INTERNAL, attributes=None, traceparent=None):
+        """Новый спан - дочерний для текущего или корень новой трассы"""
+        parent = _current_span.get()
+        if parent is not None:
+            if not parent.recording:
+                return NOOP_SPAN
+            return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+        if not self.enabled:
+            return NOOP_SPAN
+
+        remote = parse_traceparent(traceparent)
+        if remote:
+            trace_id, parent_id, sampled = remote
+        else:
+            trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < self.sample_rate
+        if not sampled:
+            return NOOP_SPAN
+        span = Span(name, trace_id, parent_id, kind, attributes)
+        span.attributes['trace.root'] = True
+        return span
+
+    def activate(self, span):
+        """Сделать спан текущим; возвращает токен для deactivate"""
+        return _current_span.set(span)
+
+    def deactivate(self, token):
+        _current_span.reset(token)
+
+    def end_span(self, span, error=None):
+        if not span.recording:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+
+        with self.lock:
+            if span.trace_id in self.finished:
+                # Корень уже записан (например, спан фоновой задачи пережил запрос) - трасса не будет записана снова
+                self.dropped_spans += 1
+                return
+            spans = self.traces.setdefault(span.trace_id, [])
+            if len(spans) < self.max_spans_per_trace:
+                spans.append(span)
+            if not span.attributes.get('trace.root'):
+                return
+            spans = self.traces.pop(span.trace_id)
+            self.finished[span.trace_id] = True
+            if len(self.finished) > self.max_finished:
+                self.finished.popitem(last=False)
+            self._export(spans)
+
+    def _export(self, spans):
+        """Запись трассы в файл одной строкой OTLP/JSON (под self.lock)"""
+        record = {
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': self.service_name}},
+                    {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}}
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': self.service_name},
+                    'spans': [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    @contextmanager
+    def span(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        """Спан на время блока; исключение отмечается в статусе спана"""
+        span = self.start_span(name, kind, attributes)
+        if not self.enabled:
+            yield span
+            return
+        # Спан вне выборки тоже становится текущим, чтобы вложенные спаны не начинали свои трассы
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+        finally:
+            _current_span.reset(token)
+
+    def traced(self, name=None, kind=SPAN_KIND_INTERNAL):
+        """Декоратор: вызов функции (обычной или async) в отдельном спане"""
+        def decorator(func):
+            span_name = name or func.__qualname__
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(span_name, kind):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, kind):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def bind(self, coro):
+        """Корутина для другого потока (event loop) с текущим спаном в качестве родителя"""
+        parent = _current_span.get()
+        if parent is None:
+            return coro
+
+        async def bound():
+            _current_span.set(parent)  # У задачи своя копия контекста, сбрасывать не нужно
+            return await coro
+        return bound()
+
+    def detach(self, coro, name=None, **attributes):
+        """Корутина фоновой задачи вне трассы запроса, который ее запустил.
+
+        Задача, живущая дольше запроса, иначе добавляла бы спаны в уже
+        записанную трассу. С name задача становится корнем своей трассы.
+        """
+        async def detached():
+            _current_span.set(None)  # У задачи своя копия контекста, сбрасывать не нужно
+            if name is None:
+                return await coro
+            with self.span(name, **attributes):
+                return await coro
+        return detached()
+
+    def wrap(self, func):
+        """Функция для пула потоков, выполняемая в копии текущего контекста"""
+        if _current_span.get() is None:
+            return func
+        return functools.partial(contextvars.copy_context().run, func)
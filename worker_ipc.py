@@ -0,0 +1,103 @@
+"""Один воркер-владелец Telegram клиента при запуске нескольких воркеров.
+
+Владельцем становится процесс, захвативший flock на файл блокировки; он
+держит Telegram сессию и общий event loop и дополнительно обслуживает
+приложение через Unix сокет. Остальные воркеры пересылают запросы,
+которым нужен Telegram, владельцу через этот сокет. Блокировка снимается
+ядром при завершении владельца, и ее забирает следующий воркер.
+"""
+import http.client
+import os
+import socket
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Не Unix: один процесс, он же владелец
+
+# Заголовки одного соединения, которые не пересылаются
+HOP_BY_HOP_HEADERS = frozenset(('connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+                                'proxy-authorization', 'proxy-authenticate', 'host', 'content-length'))
+
+class TelegramOwnerLock:
+    """Неблокирующий эксклюзивный flock; владение держится до завершения процесса"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_owner(self):
+        return self.fd is not None
+
+    def try_acquire(self):
+        """Попытка стать владельцем; True если процесс уже или теперь владелец"""
+        with self.lock:
+            if self.fd is not None:
+                return True
+            if fcntl is None:
+                self.fd = -1
+                return True
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode())
+            self.fd = fd
+            return True
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP соединение через Unix сокет"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+def serve_unix_socket(app, socket_path):
+    """WSGI сервер приложения на Unix сокете в фоновом потоке"""
+    from werkzeug.serving import make_server
+
+    # Старый сокет остается после аварийного завершения прежнего владельца
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = make_server(f"unix://{socket_path}", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='telegram-owner-ipc', daemon=True).start()
+    return server
+
+def forward_request(socket_path, method, path, headers, body, timeout):
+    """Пересылка запроса владельцу: (статус, заголовки, итератор тела).
+
+    OSError при подключении означает, что владельца нет.
+    """
+    connection = UnixHTTPConnection(socket_path, timeout=timeout)
+    try:
+        connection.request(method, path, body=body or None,
+                           headers={name: value for name, value in headers if name.lower() not in HOP_BY_HOP_HEADERS})
+        response = connection.getresponse()
+    except BaseException:
+        connection.close()
+        raise
+
+    def iter_body():
+        try:
+            while True:
+                chunk = response.read1(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            connection.close()
+
+    response_headers = [(name, value) for name, value in response.getheaders() if name.lower() not in HOP_BY_HOP_HEADERS]
+    return response.status, response_headers, iter_body()